@@ -0,0 +1,226 @@
+"""Progressive assembly of the final video while segments are still generating.
+
+Each segment is normalized (trimmed to its slot length and conformed to
+the first segment's codec, size and frame rate, with its camera move
+rendered in) as soon as its download lands. Whenever the run of consecutive ready segments grows, the prefix is
+remuxed (stream copy) into a preview. Once the last segment is in, only the
+audio mux is left.
+
+Joining by stream copy needs every segment to carry the same H.264
+parameter sets, so segments are only copied while they all match the
+first one's. As soon as one has to be encoded (a camera move, a loop, a
+different format or encoder), every segment is encoded with the same
+profile, and the ones already copied are encoded again in place.
+"""
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import ffmpeg_tools
+import video_loop
+from encoder_planner import get_planner
+from scheduler import get_scheduler
+from tracing import NULL_TRACER
+
+logger = logging.getLogger(__name__)
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def conform_segment(path, reference, segment_seconds, output_path, fps=24, deadline=None, loop_mode=None, move=None, profile=None):
+    """Re-encode ``path`` to ``reference``'s size, frame rate and pixel format, exactly ``segment_seconds`` long.
+
+    Clips that are too short are looped with ``loop_mode`` (see video_loop;
+    a plain repeat by default) and a camera ``move`` is rendered in the
+    same pass. Pass the same ``profile`` for every segment that will be
+    joined by stream copy; otherwise one is planned for this encode.
+    """
+    w, h = reference.width, reference.height
+    fps = reference.fps or fps
+    frames = int(segment_seconds * fps)
+    planner = get_planner()
+    profile = profile or planner.plan(frames, w, h, deadline=deadline)
+    # One decode into a frame buffer when it fits; that depends only on the output size, so
+    # every segment of a job takes the same path and gets the same stream headers
+    if video_loop.loop_segment(path, reference, segment_seconds, output_path, loop_mode or "forward",
+                               fps=fps, move=move, profile=profile):
+        return output_path
+    if move:
+        logger.warning("Segment %s is too large to move in memory; conforming it without its %s", path, move.name)
+    # Encodes use every core, so they take turns across sessions
+    with get_scheduler().slot("encode"):
+        start = time.perf_counter()
+        ffmpeg_tools.run_ffmpeg([
+            "-stream_loop", "-1", "-i", path, "-map", "0:v:0", "-t", str(segment_seconds),
+            "-vf", f"scale={w}:{h}:force_original_aspect_ratio=decrease,pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,fps={fps},format={reference.pix_fmt or 'yuv420p'}",
+            *profile.ffmpeg_args(), "-an", "-movflags", "+faststart", output_path,
+        ])
+    planner.record(profile, frames, time.perf_counter() - start, w, h)
+    return output_path
+
+
+class IncrementalAssembler:
+    def __init__(self, num_segments, segment_seconds=5, fps=24, tracer=None, workspace=None, loop_mode=None, moves=None):
+        self.num_segments = num_segments
+        self.segment_seconds = segment_seconds
+        self.fps = fps
+        # How clips shorter than their slot are looped (video_loop.LOOP_MODES); None repeats them with ffmpeg
+        self.loop_mode = loop_mode
+        # Camera move per segment (camera_motion.CameraMove or None), rendered while normalizing
+        self.moves = moves or [None] * num_segments
+        self.tracer = tracer or NULL_TRACER
+        # Intermediates count against the job's workspace quota when there is one
+        self.workspace = workspace
+        self.work_dir = workspace.subdir("assembly") if workspace else tempfile.mkdtemp(prefix="gpt-volca-assembly-")
+        self.reference = None  # MediaInfo every segment is conformed to
+        self.reference_sets = None  # The reference's SPS/PPS, which copied segments must share
+        self.normalized = {}
+        self.sources = {}
+        self.copied = set()  # Segments normalized by stream copy
+        # Encode every segment once any has to be; a move always does
+        self.encode_all = any(self.moves)
+        self.profile = None  # x264 settings shared by every encoded segment
+        self._reencoding = False
+        self.prefix = 0  # Number of consecutive segments in the preview
+        self.preview_path = None
+        self._lock = threading.Lock()
+        self._previews = 0
+
+    @property
+    def complete(self):
+        return self.prefix == self.num_segments
+
+    def normalize(self, index, path):
+        """Trim/conform one segment into the work dir and return the intermediate path."""
+        with self.tracer.span("normalize", segment=index + 1) as span:
+            out = self._normalize(index, path)
+            span.bytes = os.path.getsize(out)
+        if self.workspace:
+            self.workspace.check()
+        return out
+
+    def _normalize(self, index, path):
+        info = ffmpeg_tools.probe(path)
+        if not info.has_video:
+            raise ffmpeg_tools.FFmpegError(f"Segment {index + 1} has no video stream")
+        with self._lock:
+            if self.reference is None:
+                self.reference = info
+                self.reference_sets = ffmpeg_tools.parameter_sets(path)
+            self.sources[index] = path
+            encode = self.encode_all
+
+        out = os.path.join(self.work_dir, f"segment_{index + 1:02d}.mp4")
+        if not encode and self._copy(path, info, out):
+            with self._lock:
+                if not self.encode_all:
+                    self.copied.add(index)
+                    return out
+            # Another segment switched to encoding while this one was copied
+        with self._lock:
+            recopy = [] if self.encode_all else sorted(self.copied)
+            self.encode_all, self._reencoding = True, bool(recopy)
+            self.copied.clear()
+        try:
+            for i in recopy:
+                logger.info("Re-encoding segment %d to match segment %d", i + 1, index + 1)
+                self._encode(i, self.sources[i], os.path.join(self.work_dir, f"segment_{i + 1:02d}.mp4"))
+        finally:
+            if recopy:
+                with self._lock:
+                    self._reencoding = False
+        self._encode(index, path, out, info)
+        return out
+
+    def _copy(self, path, info, out):
+        """Trim ``path`` into ``out`` without re-encoding if it can join the reference by stream copy."""
+        if not ffmpeg_tools.can_stream_copy([self.reference, info], self.segment_seconds):
+            return False
+        sets = ffmpeg_tools.parameter_sets(path)
+        if sets is None or sets != self.reference_sets:
+            return False
+        if info.duration <= self.segment_seconds + 0.05:
+            # Already trimmed on ingest: nothing to cut
+            _link_or_copy(path, out)
+        else:
+            # A keyframe-safe tail cut
+            ffmpeg_tools.run_ffmpeg([
+                "-i", path, "-map", "0:v:0", "-t", str(self.segment_seconds),
+                "-c", "copy", "-an", "-movflags", "+faststart", out,
+            ])
+        return True
+
+    def _encode(self, index, path, out, info=None):
+        info = info or ffmpeg_tools.probe(path)
+        ref = self.reference
+        with self._lock:
+            if self.profile is None:
+                planner = get_planner()
+                fps = ref.fps or self.fps
+                # Each segment gets its share of the whole job's encode deadline
+                self.profile = planner.plan(int(self.segment_seconds * fps), ref.width, ref.height,
+                                            deadline=planner.deadline / self.num_segments)
+            profile = self.profile
+        short = info.duration + 0.05 < self.segment_seconds
+        # Never write through ``out``: a copied segment's may be a hard link to its
+        # (cached) source. Encode beside it and swap the result in
+        tmp = os.path.join(self.work_dir, f"encode_{index + 1:02d}.mp4")
+        try:
+            conform_segment(path, ref, self.segment_seconds, tmp, fps=self.fps,
+                            loop_mode=self.loop_mode if short else None, move=self.moves[index], profile=profile)
+            with self._lock:  # Not mid-preview
+                os.replace(tmp, out)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def add_segment(self, index, path):
+        """Normalize segment ``index`` (0-based) and extend the preview if it is next in line.
+
+        Safe to call from worker threads in any order. Returns True when the
+        preview grew.
+        """
+        normalized = self.normalize(index, path)
+        with self._lock:
+            self.normalized[index] = normalized
+            prefix = self.prefix
+            while prefix in self.normalized:
+                prefix += 1
+            # A preview built while copied segments are being re-encoded would mix encoders
+            if prefix == self.prefix or self._reencoding:
+                return False
+            self._previews += 1
+            preview = os.path.join(self.work_dir, f"preview_{self._previews:02d}.mp4")
+            parts = [self.normalized[i] for i in range(prefix)]
+            with self.tracer.span("preview", segments=prefix) as span:
+                ffmpeg_tools.concat_copy(parts, preview)
+                span.bytes = os.path.getsize(preview)
+            # Older previews stay on disk until cleanup(); the UI may still be reading them
+            self.preview_path, self.prefix = preview, prefix
+        return True
+
+    def finalize(self, final_audio, output_path):
+        """Mux the finished soundtrack (an audio_engine.Track or None) onto the complete video."""
+        if not self.complete:
+            missing = [i + 1 for i in range(self.num_segments) if i not in self.normalized]
+            raise RuntimeError(f"Cannot finalize before segments {missing} are assembled")
+        duration = self.num_segments * self.segment_seconds
+        with self.tracer.span("mux", path="incremental") as span:
+            if final_audio is None:
+                ffmpeg_tools.mux_audio(self.preview_path, None, output_path, duration=duration)
+            else:
+                ffmpeg_tools.mux_pcm(self.preview_path, final_audio.to_pcm16(), final_audio.sample_rate,
+                                     final_audio.samples.shape[1], output_path, duration=duration)
+            span.bytes = os.path.getsize(output_path)
+        return output_path
+
+    def cleanup(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
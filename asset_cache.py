@@ -0,0 +1,166 @@
+"""Persistent content-addressed cache for model outputs.
+
+Entries are keyed by a hash of the model path plus the canonicalized input
+dict, so rerunning the same job (or any Streamlit rerun) returns the stored
+script text or downloaded artifact instead of calling Replicate again.
+Files live under ``objects/``; a small SQLite index tracks size and last
+access for LRU eviction under a total size cap.
+"""
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+DEFAULT_ROOT = os.environ.get("GPT_VOLCA_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "gpt-volca"))
+DEFAULT_MAX_BYTES = int(os.environ.get("GPT_VOLCA_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+
+
+def cache_key(model_path, input_data, variant=""):
+    # sort_keys + compact separators make equal dicts hash equally
+    canonical = json.dumps(
+        {"model": model_path, "input": input_data, "variant": variant},
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _link_or_copy(src, dst):
+    # Hard links make hits free; fall back to a copy across filesystems
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class AssetCache:
+    def __init__(self, root=DEFAULT_ROOT, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(root, "index.sqlite"), check_same_thread=False, timeout=30)
+        with self._lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, model TEXT, path TEXT, text TEXT, "
+                "size INTEGER, created REAL, last_access REAL)"
+            )
+
+    def _lookup(self, key):
+        with self._lock, self._db:
+            row = self._db.execute("SELECT path, text FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            path, text = row
+            if path and not os.path.exists(path):
+                # Object vanished from disk; forget the entry
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return row
+
+    def _store(self, key, model_path, path, text, size):
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, model, path, text, size, created, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model_path, path, text, size, now, now),
+            )
+        self.evict()
+
+    def get_text(self, key):
+        row = self._lookup(key)
+        return row[1] if row else None
+
+    def put_text(self, key, text, model_path=""):
+        self._store(key, model_path, None, text, len(text.encode("utf-8")))
+
+    def get_file(self, key, suffix="", dest=None):
+        """Return a private working copy of the cached file (at ``dest`` if given), or None on a miss."""
+        row = self._lookup(key)
+        if not row:
+            return None
+        if dest is None:
+            dst = tempfile.NamedTemporaryFile(delete=False, suffix=suffix).name
+            os.remove(dst)
+        else:
+            dst = dest
+        _link_or_copy(row[0], dst)
+        return dst
+
+    def put_file(self, key, src_path, model_path=""):
+        suffix = os.path.splitext(src_path)[1]
+        obj_dir = os.path.join(self.root, "objects", key[:2])
+        os.makedirs(obj_dir, exist_ok=True)
+        obj_path = os.path.join(obj_dir, key + suffix)
+        if not os.path.exists(obj_path):
+            tmp = obj_path + f".{os.getpid()}.{threading.get_ident()}.tmp"
+            _link_or_copy(src_path, tmp)
+            os.replace(tmp, obj_path)
+        self._store(key, model_path, obj_path, None, os.path.getsize(obj_path))
+        return obj_path
+
+    def fetch_text(self, model_path, input_data, produce):
+        """Return the cached text for (model, input), calling ``produce()`` on a miss."""
+        key = cache_key(model_path, input_data)
+        text = self.get_text(key)
+        if text is None:
+            text = produce()
+            self.put_text(key, text, model_path)
+        return text
+
+    def fetch_file(self, model_path, input_data, suffix, produce, variant="", dest=None):
+        """Return a working copy of the artifact, calling ``produce()`` for a local path on a miss."""
+        key = cache_key(model_path, input_data, variant)
+        path = self.get_file(key, suffix, dest)
+        if path is None:
+            path = produce()
+            self.put_file(key, path, model_path)
+        return path
+
+    def evict(self):
+        # Drop least recently used entries until the cache fits under the cap
+        with self._lock, self._db:
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+            removed = 0
+            for key, path, size in self._db.execute("SELECT key, path, size FROM entries ORDER BY last_access").fetchall():
+                if total <= self.max_bytes:
+                    break
+                if path:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                total -= size
+                removed += 1
+            return removed
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def get_cache():
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = AssetCache()
+        return _shared
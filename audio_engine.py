@@ -0,0 +1,140 @@
+"""Vectorized NumPy audio mixer for the final soundtrack.
+
+Voice and music are decoded once by ffmpeg into float32 arrays at a common
+sample rate; looping, placement, fades, gain and sidechain ducking of the
+music under the voice are then rendered in a few array operations. The
+result is a single PCM buffer that goes straight to the muxer. Music that
+is too short is looped seamlessly by music_loop.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+
+import music_loop
+from ffmpeg_tools import run_ffmpeg
+
+MIX_RATE = 44100
+MIX_CHANNELS = 2
+
+# Ducking is computed on a coarse control grid, then interpolated per sample
+CONTROL_RATE = 100
+
+
+@dataclass
+class Track:
+    samples: np.ndarray  # float32, shape (frames, channels), nominally in [-1, 1]
+    sample_rate: int = MIX_RATE
+
+    @property
+    def duration(self):
+        return len(self.samples) / self.sample_rate
+
+    def to_pcm16(self):
+        return (np.clip(self.samples, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+    def to_clip(self):
+        # For code paths that still hand audio to moviepy
+        from moviepy.audio.AudioClip import AudioArrayClip
+        return AudioArrayClip(self.samples, fps=self.sample_rate)
+
+    def write_wav(self, path):
+        import wave
+        with wave.open(path, "wb") as w:
+            w.setnchannels(self.samples.shape[1])
+            w.setsampwidth(2)
+            w.setframerate(self.sample_rate)
+            w.writeframes(self.to_pcm16())
+        return path
+
+
+def decode_audio(path, sample_rate=MIX_RATE, channels=MIX_CHANNELS):
+    """Decode any audio ffmpeg can read into a float32 (frames, channels) array."""
+    raw = run_ffmpeg(["-i", path, "-vn", "-f", "f32le", "-acodec", "pcm_f32le", "-ac", str(channels), "-ar", str(sample_rate), "pipe:1"])
+    return np.frombuffer(raw, dtype="<f4").reshape(-1, channels)
+
+
+def fit_length(x, frames, mode="start"):
+    """Trim ``x`` to exactly ``frames`` frames, or extend it by looping or by padding around it.
+
+    ``mode`` is "start" (silence after), "center" (silence on both sides) or "loop".
+    """
+    if len(x) == 0:
+        return np.zeros((frames, x.shape[1]), dtype=np.float32)
+    if len(x) >= frames:
+        return x[:frames]
+    if mode == "loop":
+        return np.tile(x, (int(np.ceil(frames / len(x))), 1))[:frames]
+    out = np.zeros((frames, x.shape[1]), dtype=np.float32)
+    start = (frames - len(x)) // 2 if mode == "center" else 0
+    out[start:start + len(x)] = x
+    return out
+
+
+def fade_curve(frames, sample_rate, fade_in=0.0, fade_out=0.0):
+    """Per-frame gain for linear fade in/out, shape (frames, 1)."""
+    t = np.arange(frames, dtype=np.float32) / sample_rate
+    gain = np.ones(frames, dtype=np.float32)
+    if fade_in > 0:
+        gain = np.minimum(gain, t / fade_in)
+    if fade_out > 0:
+        gain = np.minimum(gain, (frames / sample_rate - t) / fade_out)
+    return np.clip(gain, 0.0, 1.0)[:, None]
+
+
+def _moving(x, width, op):
+    # Centered sliding-window reduction over a 1-D control signal
+    width = max(1, int(width))
+    padded = np.pad(x, (width // 2, width - 1 - width // 2), mode="edge")
+    windows = np.lib.stride_tricks.sliding_window_view(padded, width)
+    return op(windows, axis=1)
+
+
+def duck_gain(voice, frames, sample_rate, depth=0.5, threshold_db=-40.0, attack=0.05, release=0.4):
+    """Music gain that dips by ``depth`` wherever the voice is active, shape (frames, 1).
+
+    The voice RMS envelope is measured on a 100 Hz grid; a moving max over
+    the release window holds the duck through short pauses between words,
+    a moving mean over the attack window smooths the transitions.
+    """
+    hop = sample_rate // CONTROL_RATE
+    blocks = int(np.ceil(frames / hop))
+    mono = fit_length(voice, blocks * hop).mean(axis=1)
+    rms = np.sqrt(np.mean(mono.reshape(blocks, hop) ** 2, axis=1) + 1e-12)
+    level_db = 20 * np.log10(rms)
+    # Map -10 dB below threshold .. threshold to 0 .. 1 so ducking eases in
+    activity = np.clip((level_db - threshold_db + 10.0) / 10.0, 0.0, 1.0)
+    activity = _moving(activity, release * CONTROL_RATE, np.max)
+    activity = _moving(activity, attack * CONTROL_RATE, np.mean)
+    gain = 1.0 - depth * activity
+    block_times = (np.arange(blocks) + 0.5) * hop
+    return np.interp(np.arange(frames), block_times, gain).astype(np.float32)[:, None]
+
+
+def mix_tracks(voice_path, music_path, duration, voice_gain=1.0, music_gain=0.2, music_fade=1.0,
+               voice_placement="center", duck=True, duck_depth=0.5, sample_rate=MIX_RATE, loop_cache=None):
+    """Render voice + music into one Track of exactly ``duration`` seconds, or None without inputs.
+
+    ``loop_cache`` (an AssetCache) remembers the music's loop points.
+    """
+    if not voice_path and not music_path:
+        return None
+    frames = int(round(duration * sample_rate))
+    out = np.zeros((frames, MIX_CHANNELS), dtype=np.float32)
+
+    voice = None
+    if voice_path:
+        voice = fit_length(decode_audio(voice_path, sample_rate), frames, voice_placement)
+        out += voice_gain * voice
+
+    if music_path:
+        music = music_loop.loop_to_length(music_path, decode_audio(music_path, sample_rate), frames, sample_rate, loop_cache)
+        gain = music_gain * fade_curve(frames, sample_rate, music_fade, music_fade)
+        if duck and voice is not None:
+            gain = gain * duck_gain(voice, frames, sample_rate, depth=duck_depth)
+        out += gain * music
+
+    # Soft safety limit instead of hard clipping when voice and music peak together
+    peak = float(np.max(np.abs(out))) if frames else 0.0
+    if peak > 1.0:
+        out /= peak
+    return Track(out, sample_rate)
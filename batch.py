@@ -0,0 +1,154 @@
+"""Headless batch runner for the video pipeline.
+
+Reads a JSONL file with one job per line, e.g.::
+
+    {"job_id": "earth", "topic": "Why the Earth rotates", "style": "Documentary",
+     "length": "20 seconds", "voice": "Wise Woman", "emotion": "auto"}
+
+and runs up to ``--jobs`` of them at once. Every job writes its video,
+script and stage trace to ``<out-dir>/<job_id>/``, a Prometheus textfile to
+``--metrics-dir`` and appends one result record to ``<out-dir>/results.jsonl``.
+
+Usage: python batch.py jobs.jsonl --out-dir outputs --jobs 3 --max-predictions 8
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import fields
+
+from generation import Generator
+from hedging import HedgePolicy
+from media_resources import LeakDetector
+from tracing import Tracer
+from video_engine import VIDEO_MODEL, VideoJob, run_job
+from workspace import get_workspaces
+
+logger = logging.getLogger("batch")
+
+JOB_FIELDS = {f.name for f in fields(VideoJob)}
+
+_UNSAFE = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+def safe_name(job_id):
+    """``job_id`` reduced to a single path component, e.g. for the job's output directory."""
+    name = _UNSAFE.sub("_", job_id).lstrip(".")
+    return name or "job"
+
+
+def load_jobs(path):
+    jobs = []
+    with open(path) as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            record = json.loads(line)
+            job_id = str(record.get("job_id") or record.get("request_id") or f"job-{line_no:04d}")
+            jobs.append((job_id, record))
+    return jobs
+
+
+def process_job(generator, job_id, record, out_dir, metrics_dir=None):
+    # Job ids come from the jobs file; never let one escape out_dir
+    name = safe_name(job_id)
+    job_dir = os.path.join(out_dir, name)
+    os.makedirs(job_dir, exist_ok=True)
+    result = {"job_id": job_id, "status": "failed", "output": None, "error": None, "started": time.time()}
+    start = time.perf_counter()
+    tracer = Tracer(job_id)
+    # Process-wide: with --jobs > 1, neighbours' readers and allocations show up here too
+    leaks = LeakDetector(job_id)
+    workspace = None
+    try:
+        # Intermediate assets land in the job's scratch workspace; only the job dir is kept.
+        # No room for it fails this job, not the batch
+        workspace = get_workspaces().create(name)
+        job = VideoJob(**{k: v for k, v in record.items() if k in JOB_FIELDS})
+        view = generator.for_owner(job_id, tracer=tracer, workspace=workspace)
+        output_path, results, errors = run_job(view, job, os.path.join(job_dir, "final_video.mp4"), logger=None)
+        with open(os.path.join(job_dir, "script.txt"), "w") as f:
+            f.write("\n\n".join(results["script"]))
+        result.update(
+            status="ok",
+            output=output_path,
+            script=results["script"],
+            skipped=sorted(errors),  # e.g. a failed voiceover that was left out
+        )
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        logger.debug(traceback.format_exc())
+    finally:
+        if workspace is not None:
+            workspace.cleanup()
+            result["scratch_peak_mb"] = round(workspace.peak / 1e6, 1)
+        report = leaks.check()
+        result.update(rss_growth_mb=round(report.rss_growth / 1e6, 1), leaked_ffmpeg=sorted(report.leaked_children))
+        result["trace"] = tracer.write_json(os.path.join(job_dir, "trace.json"))
+        if metrics_dir:
+            tracer.write_prometheus(os.path.join(metrics_dir, f"{name}.prom"))
+    result["seconds"] = round(time.perf_counter() - start, 2)
+    result["finished"] = time.time()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a JSONL file of video jobs without the Streamlit UI")
+    parser.add_argument("jobs_file", help="JSONL file with one job per line")
+    parser.add_argument("--out-dir", default="outputs", help="Directory for videos and results.jsonl")
+    parser.add_argument("--jobs", type=int, default=2, help="Number of jobs to run concurrently")
+    parser.add_argument("--max-predictions", type=int, default=8, help="Global cap on in-flight Replicate predictions")
+    parser.add_argument("--api-token", default=os.environ.get("REPLICATE_API_TOKEN"), help="Replicate API token (default: $REPLICATE_API_TOKEN)")
+    parser.add_argument("--metrics-dir", help="Directory for per-job Prometheus textfiles (default: <out-dir>/metrics)")
+    parser.add_argument("--hedge", action="store_true", help="Race a duplicate video prediction when one straggles (see hedging.py)")
+    parser.add_argument("--no-cache", action="store_true", help="Always call the models instead of reusing cached outputs")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    if not args.api_token:
+        parser.error("a Replicate API token is required (--api-token or REPLICATE_API_TOKEN)")
+
+    jobs = load_jobs(args.jobs_file)
+    os.makedirs(args.out_dir, exist_ok=True)
+    metrics_dir = args.metrics_dir or os.path.join(args.out_dir, "metrics")
+    os.makedirs(metrics_dir, exist_ok=True)
+    # One generator for every job so the prediction cap is global
+    hedge = HedgePolicy(models=[VIDEO_MODEL]) if args.hedge else None
+    generator = Generator(args.api_token, use_cache=not args.no_cache, max_concurrent=args.max_predictions, hedge=hedge)
+    results_path = os.path.join(args.out_dir, "results.jsonl")
+    write_lock = threading.Lock()
+
+    start = time.perf_counter()
+    failed = 0
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [pool.submit(process_job, generator, job_id, record, args.out_dir, metrics_dir) for job_id, record in jobs]
+        for future in as_completed(futures):
+            result = future.result()
+            failed += result["status"] != "ok"
+            with write_lock, open(results_path, "a") as f:
+                f.write(json.dumps(result) + "\n")
+            logger.info("%s %s in %.1fs %s", result["job_id"], result["status"], result["seconds"], result["error"] or "")
+
+    elapsed = time.perf_counter() - start
+    rate = len(jobs) / elapsed * 3600 if elapsed else 0.0
+    logger.info("Finished %d jobs (%d failed) in %.1fs, %.1f videos/hour", len(jobs), failed, elapsed, rate)
+    if generator.cache:
+        logger.info(generator.cache_summary())
+    if generator.hedge:
+        logger.info(generator.hedge_summary())
+    if generator.rate_summary():
+        logger.info(generator.rate_summary())
+    generator.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,327 @@
+"""Offline benchmarks for the local media stages of the video pipeline.
+
+Generates synthetic inputs at the shapes the models return (540p 24 fps
+5 s segments, a 32 kHz mono voiceover and stereo music), times each
+assembly step of main.py and main_ad_version.py, and compares the medians
+against a stored baseline. No network or API token is needed. The run
+calibrates its own encoder planner and uses its own asset cache in the
+scratch directory, so the app's calibration and cache are left untouched.
+
+Usage:
+    python bench_assembly.py                       # run and compare with bench_baseline.json
+    python bench_assembly.py --repeat 5 --steps main.
+    python bench_assembly.py --save-baseline       # record this machine's numbers as the baseline
+
+Exits with status 1 when a step is slower than its baseline by more than
+``--tolerance``.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import asset_cache
+import audio_engine
+import encoder_planner
+import ffmpeg_tools
+from assembler import IncrementalAssembler
+from encoder_planner import get_planner
+from preflight import preflight
+from tracing import Tracer
+from video_engine import SEGMENT_SECONDS, assemble_video_fast, build_audio
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+WIDTH, HEIGHT, FPS = 960, 540, 24
+NUM_SEGMENTS = 4
+VOICE_RATE = 32000
+MUSIC_RATE = 44100
+
+
+def make_assets(work_dir):
+    """Render the synthetic inputs with ffmpeg's lavfi sources; returns a dict of paths."""
+    assets = {"segments": []}
+    for i in range(NUM_SEGMENTS):
+        path = os.path.join(work_dir, f"segment_{i + 1}.mp4")
+        # Luma returns 120 frames at 24 fps, i.e. exactly one 5 s slot
+        ffmpeg_tools.run_ffmpeg([
+            "-f", "lavfi", "-i", f"testsrc2=size={WIDTH}x{HEIGHT}:rate={FPS}:duration={SEGMENT_SECONDS}",
+            "-vf", f"hue=h={i * 90}", "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p", path,
+        ])
+        assets["segments"].append(path)
+
+    # A clip that is too short and in a different format, like an off-spec model output
+    assets["odd_segment"] = os.path.join(work_dir, "odd_segment.mp4")
+    ffmpeg_tools.run_ffmpeg([
+        "-f", "lavfi", "-i", "testsrc2=size=640x360:rate=30:duration=3",
+        "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p", assets["odd_segment"],
+    ])
+
+    assets["voice"] = os.path.join(work_dir, "voice.mp3")
+    ffmpeg_tools.run_ffmpeg([
+        "-f", "lavfi", "-i", f"sine=frequency=220:sample_rate={VOICE_RATE}:duration=17",
+        "-af", "volume='0.5+0.5*sin(2*PI*3*t)':eval=frame", "-ac", "1", "-b:a", "128k", assets["voice"],
+    ])
+
+    assets["music"] = os.path.join(work_dir, "music.mp3")
+    ffmpeg_tools.run_ffmpeg([
+        "-f", "lavfi", "-i", f"sine=frequency=330:sample_rate={MUSIC_RATE}:duration=30",
+        "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate={MUSIC_RATE}:duration=30",
+        "-filter_complex", "[0:a][1:a]amerge=inputs=2", "-ac", "2", "-b:a", "192k", assets["music"],
+    ])
+    return assets
+
+
+# Each benchmark does its setup, then times only the step itself inside ``timed(span_name)``.
+# Steps are named "<app>.<step>" after the code path they mirror.
+
+def bench_main_clip_load(assets, work_dir, timed):
+    from moviepy.editor import VideoFileClip
+    with timed() as span:
+        clips = [VideoFileClip(path).subclip(0, SEGMENT_SECONDS) for path in assets["segments"]]
+        span.bytes = sum(os.path.getsize(path) for path in assets["segments"])
+    for clip in clips:
+        clip.close()
+
+
+def bench_main_concat(assets, work_dir, timed):
+    from moviepy.editor import VideoFileClip, concatenate_videoclips
+    clips = [VideoFileClip(path).subclip(0, SEGMENT_SECONDS) for path in assets["segments"]]
+    with timed():
+        concatenate_videoclips(clips, method="compose").set_duration(NUM_SEGMENTS * SEGMENT_SECONDS)
+    for clip in clips:
+        clip.close()
+
+
+def bench_main_audio_mix(assets, work_dir, timed):
+    with timed() as span:
+        track = build_audio(assets["voice"], assets["music"], NUM_SEGMENTS * SEGMENT_SECONDS)
+        span.bytes = track.samples.nbytes
+
+
+def bench_main_write_videofile(assets, work_dir, timed):
+    # The moviepy fallback in video_engine.assemble_video
+    from moviepy.editor import VideoFileClip, concatenate_videoclips
+    duration = NUM_SEGMENTS * SEGMENT_SECONDS
+    clips = [VideoFileClip(path).subclip(0, SEGMENT_SECONDS) for path in assets["segments"]]
+    video = concatenate_videoclips(clips, method="compose").set_duration(duration)
+    video = video.set_audio(build_audio(assets["voice"], assets["music"], duration).to_clip())
+    output_path = os.path.join(work_dir, "main_moviepy.mp4")
+    profile = get_planner().plan(duration * FPS, WIDTH, HEIGHT)
+    with timed() as span:
+        video.write_videofile(output_path, codec="libx264", audio_codec="aac",
+                              temp_audiofile=os.path.join(work_dir, "main_moviepy-audio.m4a"),
+                              remove_temp=True, fps=24, logger=None, **profile.moviepy_kwargs())
+        span.bytes = os.path.getsize(output_path)
+    video.close()
+    for clip in clips:
+        clip.close()
+
+
+def bench_main_fast_path(assets, work_dir, timed):
+    duration = NUM_SEGMENTS * SEGMENT_SECONDS
+    track = build_audio(assets["voice"], assets["music"], duration)
+    output_path = os.path.join(work_dir, "main_fast.mp4")
+    with timed() as span:
+        if assemble_video_fast(assets["segments"], track, duration, output_path) is None:
+            raise RuntimeError("Synthetic segments were rejected by the stream-copy path")
+        span.bytes = os.path.getsize(output_path)
+
+
+def bench_main_incremental(assets, work_dir, timed):
+    # Every segment normalized and appended, then the final audio mux
+    duration = NUM_SEGMENTS * SEGMENT_SECONDS
+    track = build_audio(assets["voice"], assets["music"], duration)
+    assembler = IncrementalAssembler(NUM_SEGMENTS, SEGMENT_SECONDS)
+    output_path = os.path.join(work_dir, "main_incremental.mp4")
+    try:
+        with timed() as span:
+            for i, path in enumerate(assets["segments"]):
+                assembler.add_segment(i, path)
+            assembler.finalize(track, output_path)
+            span.bytes = os.path.getsize(output_path)
+    finally:
+        assembler.cleanup()
+
+
+def bench_main_conform(assets, work_dir, timed):
+    # Re-encode path for a segment that can't be stream-copied
+    assembler = IncrementalAssembler(NUM_SEGMENTS, SEGMENT_SECONDS)
+    try:
+        assembler.normalize(0, assets["segments"][0])
+        with timed() as span:
+            span.bytes = os.path.getsize(assembler.normalize(1, assets["odd_segment"]))
+    finally:
+        assembler.cleanup()
+
+
+def bench_ad_preflight(assets, work_dir, timed):
+    # main_ad_version.py probes everything and conforms the off-spec segment
+    segments = assets["segments"][:-1] + [assets["odd_segment"]]
+    with timed():
+        preflight(segments, assets["voice"], assets["music"], SEGMENT_SECONDS, work_dir)
+
+
+def bench_ad_audio_mix(assets, work_dir, timed):
+    with timed() as span:
+        track = audio_engine.mix_tracks(assets["voice"], assets["music"], 20.0,
+                                        music_gain=0.25, music_fade=0, voice_placement="start")
+        span.bytes = track.samples.nbytes
+
+
+def bench_ad_assemble(assets, work_dir, timed):
+    # Pre-flight repair, then the single stream-copy join and audio encode
+    segments = assets["segments"][:-1] + [assets["odd_segment"]]
+    output_path = os.path.join(work_dir, "ad_final.mp4")
+    with timed() as span:
+        report = preflight(segments, assets["voice"], assets["music"], SEGMENT_SECONDS, work_dir)
+        track = audio_engine.mix_tracks(assets["voice"], assets["music"], 20.0,
+                                        music_gain=0.25, music_fade=0, voice_placement="start")
+        assemble_video_fast(report.segments, track, 20.0, output_path)
+        span.bytes = os.path.getsize(output_path)
+
+
+BENCHMARKS = {
+    "main.clip_load": bench_main_clip_load,
+    "main.concat": bench_main_concat,
+    "main.audio_mix": bench_main_audio_mix,
+    "main.write_videofile": bench_main_write_videofile,
+    "main.fast_path": bench_main_fast_path,
+    "main.incremental": bench_main_incremental,
+    "main.conform": bench_main_conform,
+    "ad.preflight": bench_ad_preflight,
+    "ad.audio_mix": bench_ad_audio_mix,
+    "ad.assemble": bench_ad_assemble,
+}
+
+
+def machine_info():
+    cpu = platform.processor()
+    try:
+        with open("/proc/cpuinfo") as f:
+            cpu = next((line.split(":", 1)[1].strip() for line in f if line.startswith("model name")), cpu)
+    except OSError:
+        pass
+    try:
+        ffmpeg_version = ffmpeg_tools.run_ffmpeg(["-version"]).decode().splitlines()[0]
+    except (ffmpeg_tools.FFmpegError, IndexError):
+        ffmpeg_version = None
+    import moviepy
+    import numpy
+    return {
+        "hostname": platform.node(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu": cpu,
+        "cpu_count": os.cpu_count(),
+        "ffmpeg": ffmpeg_version,
+        "moviepy": moviepy.__version__,
+        "numpy": numpy.__version__,
+    }
+
+
+@contextmanager
+def isolated_state(work_dir):
+    """Swap the process-wide encoder planner and asset cache for ones kept in ``work_dir``."""
+    with encoder_planner._planner_lock, asset_cache._shared_lock:
+        saved = encoder_planner._planner, asset_cache._shared
+        encoder_planner._planner = encoder_planner.EncoderPlanner(
+            calibration_path=os.path.join(work_dir, "encoder_calibration.json"))
+        asset_cache._shared = asset_cache.AssetCache(root=os.path.join(work_dir, "cache"))
+    try:
+        yield
+    finally:
+        with encoder_planner._planner_lock, asset_cache._shared_lock:
+            encoder_planner._planner, asset_cache._shared = saved
+
+
+def run_benchmarks(names, repeat, work_dir):
+    assets = make_assets(work_dir)
+    # Calibrate the encoder planner up front so no step pays for it
+    get_planner().throughput(WIDTH, HEIGHT)
+    tracer = Tracer("bench")
+    results = {}
+    for name in names:
+        for _ in range(repeat):
+            BENCHMARKS[name](assets, work_dir, lambda: tracer.span(name))
+        spans = [s for s in tracer.spans if s.name == name]
+        times = [s.wall_seconds for s in spans]
+        results[name] = {
+            "median": statistics.median(times),
+            "min": min(times),
+            "max": max(times),
+            "runs": len(times),
+            "bytes": spans[-1].bytes,
+            "peak_rss": max(s.peak_rss for s in spans),
+        }
+        print(f"{name:24s} median {results[name]['median']:8.3f}s  min {results[name]['min']:8.3f}s", flush=True)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return (name, median, baseline median) for every step slower than baseline * (1 + tolerance)."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get("results", {}).get(name)
+        if base and result["median"] > base["median"] * (1 + tolerance):
+            regressions.append((name, result["median"], base["median"]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the local assembly steps on synthetic media")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per step; the median is compared")
+    parser.add_argument("--steps", default="", help="Only run steps whose name starts with this prefix (e.g. 'main.' or 'ad.audio')")
+    parser.add_argument("--output", default="bench_results.json", help="Where to write this run's results")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Write this run's results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown before a step counts as a regression")
+    parser.add_argument("--keep", action="store_true", help="Keep the synthetic assets and outputs")
+    args = parser.parse_args(argv)
+
+    names = [name for name in BENCHMARKS if name.startswith(args.steps)]
+    if not names:
+        parser.error(f"No benchmark matches '{args.steps}'; choose from {', '.join(BENCHMARKS)}")
+
+    work_dir = tempfile.mkdtemp(prefix="gpt-volca-bench-")
+    try:
+        with isolated_state(work_dir):
+            report = {"machine": machine_info(), "created": time.time(), "repeat": args.repeat,
+                      "results": run_benchmarks(names, args.repeat, work_dir)}
+    finally:
+        if args.keep:
+            print(f"Assets kept in {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to record one")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("machine", {}).get("cpu") != report["machine"]["cpu"]:
+        print(f"Warning: baseline was recorded on '{baseline.get('machine', {}).get('cpu')}', timings may not be comparable")
+    regressions = compare(report["results"], baseline, args.tolerance)
+    for name, median, base in regressions:
+        print(f"REGRESSION {name}: {median:.3f}s vs baseline {base:.3f}s ({median / base - 1:+.0%})")
+    if not regressions:
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
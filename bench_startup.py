@@ -0,0 +1,103 @@
+"""Cold-start and rerun benchmark for the Streamlit apps.
+
+Each app is loaded with Streamlit's AppTest in a fresh interpreter, as a
+new server worker would be: the first run is the time to first paint,
+the following runs are plain reruns, and the last one edits a form field
+the way a user would. Also reports whether the API/media layers
+(replicate, requests, moviepy, numpy and the video engine) were imported
+before anything was generated; they should only load once the generate
+button is pressed.
+
+Usage: python bench_startup.py [main.py main_ad_version.py] --repeat 3 --reruns 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+HEAVY_MODULES = ["replicate", "requests", "moviepy", "moviepy.editor", "numpy", "generation", "downloader", "video_engine"]
+
+
+def measure(app, reruns):
+    """Runs in the child interpreter; returns the timings for one cold start of ``app``."""
+    start = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+    streamlit_import = time.perf_counter() - start
+
+    at = AppTest.from_file(os.path.join(HERE, app), default_timeout=120)
+    modules_before = set(sys.modules)
+    start = time.perf_counter()
+    at.run()
+    first_paint = time.perf_counter() - start
+    if at.exception:
+        raise RuntimeError(f"{app} raised on first run: {at.exception[0].message}")
+    new_modules = set(sys.modules) - modules_before
+
+    rerun_times = []
+    for _ in range(reruns):
+        start = time.perf_counter()
+        at.run()
+        rerun_times.append(time.perf_counter() - start)
+
+    # A form interaction: typing into the second text input (topic / product name)
+    start = time.perf_counter()
+    at.text_input[1].input("Why the sky is blue").run()
+    interaction = time.perf_counter() - start
+
+    return {
+        "app": app,
+        "streamlit_import": streamlit_import,
+        "first_paint": first_paint,
+        "rerun": statistics.median(rerun_times) if rerun_times else None,
+        "interaction": interaction,
+        "modules_loaded": len(new_modules),
+        "heavy_loaded": sorted(m for m in HEAVY_MODULES if m in sys.modules),
+    }
+
+
+def cold_start(app, reruns):
+    # A fresh interpreter per measurement, so nothing is already in sys.modules
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", app, "--reruns", str(reruns)],
+        cwd=HERE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"Benchmarking {app} failed:\n{proc.stderr[-2000:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure Streamlit first paint and rerun overhead")
+    parser.add_argument("apps", nargs="*", default=["main.py", "main_ad_version.py"])
+    parser.add_argument("--repeat", type=int, default=3, help="Cold starts per app; medians are reported")
+    parser.add_argument("--reruns", type=int, default=5, help="Warm reruns per cold start")
+    parser.add_argument("--output", help="Write the raw measurements as JSON")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(measure(args.child, args.reruns)))
+        return 0
+
+    report = {}
+    for app in args.apps:
+        runs = [cold_start(app, args.reruns) for _ in range(args.repeat)]
+        report[app] = runs
+        med = {key: statistics.median(r[key] for r in runs) for key in ("streamlit_import", "first_paint", "rerun", "interaction")}
+        print(f"{app:20s} first paint {med['first_paint'] * 1000:7.0f} ms (+{med['streamlit_import'] * 1000:.0f} ms streamlit)"
+              f"  rerun {med['rerun'] * 1000:6.0f} ms  interaction {med['interaction'] * 1000:6.0f} ms"
+              f"  modules {runs[0]['modules_loaded']}")
+        if runs[0]["heavy_loaded"]:
+            print(f"{'':20s} loaded before generation: {', '.join(runs[0]['heavy_loaded'])}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+"""Local camera moves applied to generated segments after download.
+
+A move is a per-frame crop window: a zoom factor (>= 1) and the window
+centre's offset within the margin that zoom leaves, both as arrays over
+the segment's frames. Sampling grids are computed for a batch of frames
+at once and each frame is warped with separable bilinear interpolation
+(two gathers per axis, blended in 8-bit fixed point), so pans and zooms
+glide at sub-pixel precision instead of stepping whole pixels. Rendering happens in video_loop's
+decode -> encode pass, so a move costs one local re-encode of its segment
+and no extra generation.
+
+Moves are drawn at random from the job's selection, one per segment, and
+each draws its own strength. Perspective moves (orbit, crane, dolly zoom)
+are approximated by pans and zooms.
+"""
+import random
+from dataclasses import dataclass
+
+import numpy as np
+
+# name -> (zoom at start, zoom at end, x offset start/end, y offset start/end, easing)
+# Offsets are fractions of the margin left by the zoom: -1 is the left/top edge, 1 the right/bottom
+MOVES = {
+    "static": None,
+    "zoom_in": (1.0, 1.2, (0, 0), (0, 0), "smooth"),
+    "zoom_out": (1.2, 1.0, (0, 0), (0, 0), "smooth"),
+    "pan_left": (1.15, 1.15, (0.9, -0.9), (0, 0), "smooth"),
+    "pan_right": (1.15, 1.15, (-0.9, 0.9), (0, 0), "smooth"),
+    "tilt_up": (1.15, 1.15, (0, 0), (0.9, -0.9), "smooth"),
+    "tilt_down": (1.15, 1.15, (0, 0), (-0.9, 0.9), "smooth"),
+    "orbit_left": (1.2, 1.12, (0.8, -0.8), (0, 0), "smooth"),
+    "orbit_right": (1.2, 1.12, (-0.8, 0.8), (0, 0), "smooth"),
+    "push_in": (1.0, 1.3, (0, 0), (0, 0.2), "in"),
+    "pull_out": (1.3, 1.0, (0, 0), (0.2, 0), "out"),
+    "crane_up": (1.1, 1.2, (0, 0), (0.8, -0.8), "smooth"),
+    "crane_down": (1.2, 1.1, (0, 0), (-0.8, 0.8), "smooth"),
+    "aerial": (1.25, 1.1, (-0.5, 0.5), (0.5, -0.3), "linear"),
+    "aerial_drone": (1.1, 1.25, (0.6, -0.4), (-0.4, 0.4), "linear"),
+    "handheld": (1.08, 1.08, (0, 0), (0, 0), "linear"),
+    "dolly_zoom": (1.0, 1.35, (0, 0), (0, 0), "in"),
+}
+
+_EASINGS = {
+    "linear": lambda u: u,
+    "smooth": lambda u: u * u * (3 - 2 * u),
+    "in": lambda u: u * u,
+    "out": lambda u: 1 - (1 - u) ** 2,
+}
+
+
+@dataclass
+class CameraMove:
+    name: str
+    strength: float = 1.0  # Scales the zoom change and travel
+    seed: int = 0  # Drives the handheld shake
+
+    def path(self, frames):
+        """(zoom, x offset, y offset) arrays of length ``frames``."""
+        z0, z1, (x0, x1), (y0, y1), easing = MOVES[self.name]
+        u = _EASINGS[easing](np.linspace(0.0, 1.0, frames))
+        s = self.strength
+        # Scale the change in zoom, not the zoom itself, so every frame stays >= 1
+        base = min(z0, z1)
+        zoom = base + (z0 - base + (z1 - z0) * u) * s
+        x = (x0 + (x1 - x0) * u) * s
+        y = (y0 + (y1 - y0) * u) * s
+        if self.name == "handheld":
+            x, y = x + _shake(frames, self.seed), y + _shake(frames, self.seed + 1)
+        return zoom, np.clip(x, -1, 1), np.clip(y, -1, 1)
+
+    def render(self, frames):
+        return MovePath(*self.path(frames))
+
+
+def _shake(frames, seed, amplitude=0.5, smooth=12):
+    # Random walk low-passed by a moving average: slow drift, no jitter
+    noise = np.random.default_rng(seed).standard_normal(frames + smooth)
+    walk = np.convolve(np.cumsum(noise), np.ones(smooth) / smooth, mode="valid")[:frames]
+    walk -= walk.mean()
+    peak = np.abs(walk).max()
+    return walk / peak * amplitude if peak else walk
+
+
+def _sample_grid(size, zoom, offset):
+    # Source coordinate of every output pixel centre along one axis, per frame: (frames, size)
+    window = size / zoom
+    centre = size / 2 + offset * (size - window) / 2
+    out = (np.arange(size) + 0.5) / size
+    pos = centre[:, None] - window[:, None] / 2 + out[None, :] * window[:, None] - 0.5
+    pos = np.clip(pos, 0, size - 1)
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.minimum(lo + 1, size - 1)
+    return lo, hi, (pos - lo).astype(np.float32)
+
+
+class MovePath:
+    """A move rendered for a fixed number of frames; warps frame batches by output index."""
+
+    def __init__(self, zoom, x, y):
+        self.zoom, self.x, self.y = zoom, x, y
+
+    def apply(self, batch, start):
+        """Warp ``batch`` (uint8, (frames, h, w, 3)), whose first frame is output frame ``start``."""
+        n, h, w, _ = batch.shape
+        span = slice(start, start + n)
+        y0, y1, fy = _sample_grid(h, self.zoom[span], self.y[span])
+        x0, x1, fx = _sample_grid(w, self.zoom[span], self.x[span])
+        # 8-bit fixed-point weights: a pixel times its weight fits uint16, so the blends run in
+        # place on half the memory of float32. Whole-batch gathers were slower than per-frame
+        # ones, since the (frames, h, w, 3) intermediates don't stay in cache
+        wy = np.rint(fy * 256).astype(np.uint16)[:, :, None, None]
+        wx = np.rint(fx * 256).astype(np.uint16)[:, None, :, None]
+        out = np.empty_like(batch)
+        for i, frame in enumerate(batch):
+            rows = np.take(frame, y0[i], axis=0).astype(np.uint16)
+            rows *= 256 - wy[i]
+            rows += np.take(frame, y1[i], axis=0) * wy[i]
+            rows += 128
+            rows >>= 8
+            cols = np.take(rows, x0[i], axis=1)
+            cols *= 256 - wx[i]
+            cols += np.take(rows, x1[i], axis=1) * wx[i]
+            cols += 128
+            cols >>= 8
+            out[i] = cols
+        return out
+
+def assign_moves(selected, num_segments, rng=None):
+    """Pick one move per segment at random from ``selected``; None where a segment stays static.
+
+    Consecutive segments get different moves when there is a choice.
+    """
+    rng = rng or random.Random()
+    names = [name for name in selected if name in MOVES]
+    if not names:
+        return [None] * num_segments
+    moves, previous = [], None
+    for _ in range(num_segments):
+        options = [name for name in names if name != previous] or names
+        previous = rng.choice(options)
+        if MOVES[previous] is None:
+            moves.append(None)
+        else:
+            moves.append(CameraMove(previous, strength=rng.uniform(0.7, 1.0), seed=rng.randrange(2 ** 31)))
+    return moves
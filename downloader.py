@@ -0,0 +1,259 @@
+"""Shared, pooled downloader for generated assets.
+
+One keep-alive ``requests.Session`` is shared by every download in the
+process. Downloads resume with HTTP Range requests after transient
+connection errors, read in adaptively sized chunks, verify size (and an
+optional SHA-256) and record their throughput. ``stream`` hands the body
+to a consumer (e.g. an ffmpeg pipe) chunk by chunk instead of a file.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
+
+logger = logging.getLogger(__name__)
+
+MIN_CHUNK = 64 * 1024
+MAX_CHUNK = 4 * 1024 * 1024
+MAX_STATS = 512  # Throughput records kept for files outside any workspace
+
+# Errors worth resuming from; anything else (4xx, bad checksum) fails immediately
+TRANSIENT_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.Timeout,
+    # Raised directly by resp.raw.read()
+    ProtocolError,
+    ReadTimeoutError,
+)
+
+
+class DownloadError(Exception):
+    pass
+
+
+@dataclass
+class DownloadStats:
+    url: str
+    path: str
+    bytes: int = 0
+    seconds: float = 0.0
+    resumes: int = 0
+
+    @property
+    def bytes_per_sec(self):
+        return self.bytes / self.seconds if self.seconds > 0 else 0.0
+
+    def describe(self):
+        return f"{self.bytes / 1e6:.1f} MB in {self.seconds:.1f}s ({self.bytes_per_sec / 1e6:.2f} MB/s, {self.resumes} resumes)"
+
+
+class Downloader:
+    def __init__(self, pool_size=16, timeout=(10, 60), max_retries=5):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # Destination path -> DownloadStats; a workspace's entries go when it is removed
+        self.stats = OrderedDict()
+        self._lock = threading.Lock()
+
+    def download(self, url, suffix="", dest=None, expected_size=None, sha256=None):
+        """Download ``url`` to ``dest`` (a new temp file by default) and return its path."""
+        url = str(url)  # Replicate may hand back FileOutput objects
+        if dest is None:
+            dest = tempfile.NamedTemporaryFile(delete=False, suffix=suffix).name
+        stats = DownloadStats(url=url, path=dest)
+        start = time.perf_counter()
+        try:
+            written = self._fetch(url, dest, expected_size, stats)
+            if sha256 and _file_sha256(dest) != sha256.lower():
+                raise DownloadError(f"Checksum mismatch for {url}")
+        except Exception:
+            # Never leave a truncated file behind for someone to pick up
+            try:
+                os.remove(dest)
+            except OSError:
+                pass
+            raise
+
+        stats.bytes = written
+        stats.seconds = time.perf_counter() - start
+        self._record(dest, stats)
+        logger.info("Downloaded %s: %s", url, stats.describe())
+        return dest
+
+    def _fetch(self, url, dest, expected_size, stats):
+        written = 0
+        total = expected_size
+        attempt = 0
+        with open(dest, "wb") as f:
+            while True:
+                headers = {"Range": f"bytes={written}-"} if written else {}
+                try:
+                    with self.session.get(url, stream=True, headers=headers, timeout=self.timeout) as resp:
+                        resp.raise_for_status()
+                        if written and resp.status_code != 206:
+                            # Server ignored the Range header, start over
+                            f.seek(0)
+                            f.truncate()
+                            written = 0
+                        if total is None:
+                            total = _total_size(resp)
+                        self._copy_body(resp, f)
+                        written = f.tell()
+                    if total is None or written >= total:
+                        break
+                    # Body ended early without raising: treat it like a reset
+                    raise requests.exceptions.ChunkedEncodingError(f"Connection closed at {written}/{total} bytes")
+                except TRANSIENT_ERRORS as e:
+                    written = f.tell()
+                    attempt += 1
+                    if attempt > self.max_retries:
+                        raise DownloadError(f"Giving up on {url} after {attempt} attempts: {e}") from e
+                    stats.resumes += 1
+                    logger.warning("Download of %s interrupted at %d bytes (%s), resuming", url, written, e)
+                    time.sleep(min(0.5 * 2 ** (attempt - 1), 8))
+
+        if total is not None and written != total:
+            raise DownloadError(f"Size mismatch for {url}: expected {total} bytes, got {written}")
+        return written
+
+    def stream(self, url, label=None, expected_size=None):
+        """Yield the body of ``url`` in chunks, resuming with Range requests after transient errors.
+
+        Throughput is recorded under ``label`` (e.g. the file the stream
+        ends up in). Closing the generator early drops the connection.
+        """
+        url = str(url)
+        stats = DownloadStats(url=url, path=label or url)
+        start = time.perf_counter()
+        sent = 0
+        total = expected_size
+        attempt = 0
+        try:
+            while True:
+                headers = {"Range": f"bytes={sent}-"} if sent else {}
+                try:
+                    with self.session.get(url, stream=True, headers=headers, timeout=self.timeout) as resp:
+                        resp.raise_for_status()
+                        if sent and resp.status_code != 206:
+                            # What was already handed on can't be taken back
+                            raise DownloadError(f"Cannot resume the stream of {url}: the server ignored the Range header")
+                        if total is None:
+                            total = _total_size(resp)
+                        for data in self._iter_body(resp):
+                            sent += len(data)
+                            yield data
+                    if total is None or sent >= total:
+                        break
+                    raise requests.exceptions.ChunkedEncodingError(f"Connection closed at {sent}/{total} bytes")
+                except TRANSIENT_ERRORS as e:
+                    attempt += 1
+                    if attempt > self.max_retries:
+                        raise DownloadError(f"Giving up on {url} after {attempt} attempts: {e}") from e
+                    stats.resumes += 1
+                    logger.warning("Stream of %s interrupted at %d bytes (%s), resuming", url, sent, e)
+                    time.sleep(min(0.5 * 2 ** (attempt - 1), 8))
+            if total is not None and sent != total:
+                raise DownloadError(f"Size mismatch for {url}: expected {total} bytes, got {sent}")
+        finally:
+            stats.bytes = sent
+            stats.seconds = time.perf_counter() - start
+            self._record(stats.path, stats)
+        logger.info("Streamed %s: %s", url, stats.describe())
+
+    def _record(self, path, stats):
+        with self._lock:
+            self.stats[path] = stats
+            self.stats.move_to_end(path)
+            while len(self.stats) > MAX_STATS:
+                self.stats.popitem(last=False)
+
+    def forget(self, directory):
+        """Drop the records of files under ``directory``, e.g. a job workspace being removed."""
+        prefix = os.path.join(os.path.abspath(directory), "")
+        with self._lock:
+            for path in [p for p in self.stats if os.path.abspath(p).startswith(prefix)]:
+                del self.stats[path]
+
+    def download_many(self, urls, suffix="", max_workers=4):
+        """Download several URLs concurrently, returning paths in input order."""
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(lambda url: self.download(url, suffix=suffix), urls))
+
+    def _copy_body(self, resp, f):
+        for data in self._iter_body(resp):
+            f.write(data)
+
+    def _iter_body(self, resp):
+        # Grow the chunk while reads are fast, shrink it when they stall
+        chunk = MIN_CHUNK
+        while True:
+            t0 = time.perf_counter()
+            data = resp.raw.read(chunk, decode_content=True)
+            if not data:
+                return
+            elapsed = time.perf_counter() - t0
+            yield data
+            if elapsed < 0.05 and chunk < MAX_CHUNK:
+                chunk *= 2
+            elif elapsed > 0.5 and chunk > MIN_CHUNK:
+                chunk //= 2
+
+
+def _total_size(resp):
+    # Content-Range carries the full size on a 206, Content-Length otherwise
+    content_range = resp.headers.get("Content-Range", "")
+    if "/" in content_range and not content_range.endswith("/*"):
+        return int(content_range.rsplit("/", 1)[1])
+    if "Content-Length" in resp.headers and not resp.headers.get("Content-Encoding"):
+        return int(resp.headers["Content-Length"])
+    return None
+
+
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def get_downloader():
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = Downloader()
+        return _shared
+
+
+def download_to_file(url, suffix: str, dest=None):
+    return get_downloader().download(url, suffix=suffix, dest=dest)
+
+
+def stream_download(url, label=None):
+    return get_downloader().stream(url, label=label)
+
+
+def download_stats(path):
+    return get_downloader().stats.get(path)
+
+
+def forget_downloads(directory):
+    get_downloader().forget(directory)
@@ -0,0 +1,175 @@
+"""Pick libx264 settings per encode from measured host throughput.
+
+Each encode gets an equal share of the cores: the scheduler runs up to
+GPT_VOLCA_ENCODE_SLOTS encodes at once, so more threads would only
+oversubscribe them. The planner times a short synthetic encode per preset
+at the output resolution, thread count and CRF (once per host, cached on
+disk). It then chooses the slowest preset (best compression) that still
+finishes a job's frames inside the latency target at the quality's CRF,
+and only raises the CRF within the quality's range when even the fastest
+preset can't make it.
+
+The table holds pure x264 throughput only. Real encodes also decode,
+warp and loop frames and share the CPU with everything else, so their fps
+is logged but never folded back in.
+
+Targets come from GPT_VOLCA_ENCODE_DEADLINE (seconds per encode) and
+GPT_VOLCA_ENCODE_QUALITY ("draft", "balanced" or "high").
+"""
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+import ffmpeg_tools
+from scheduler import get_scheduler
+
+logger = logging.getLogger(__name__)
+
+# Fastest to slowest; slower presets compress better at the same CRF
+PRESETS = ["ultrafast", "superfast", "veryfast", "faster", "fast", "medium"]
+
+# CRF, the highest CRF to fall back to, and the slowest preset worth waiting for, per quality target
+QUALITY_TARGETS = {
+    "draft": (26, 30, "veryfast"),
+    "balanced": (21, 25, "fast"),
+    "high": (18, 22, "medium"),
+}
+CRF_STEP = 2
+
+DEFAULT_DEADLINE = float(os.environ.get("GPT_VOLCA_ENCODE_DEADLINE", 30))
+DEFAULT_QUALITY = os.environ.get("GPT_VOLCA_ENCODE_QUALITY", "balanced")
+DEFAULT_CALIBRATION_PATH = os.path.join(
+    os.environ.get("GPT_VOLCA_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "gpt-volca")),
+    "encoder_calibration.json",
+)
+
+CALIBRATION_SECONDS = 2
+SAFETY = 1.25  # Headroom between predicted and allowed encode time
+
+
+@dataclass
+class EncodeProfile:
+    preset: str
+    crf: int
+    threads: int
+    predicted_fps: float = 0.0
+
+    def ffmpeg_args(self):
+        return ["-c:v", "libx264", "-preset", self.preset, "-crf", str(self.crf), "-threads", str(self.threads)]
+
+    def moviepy_kwargs(self):
+        # For VideoClip.write_videofile; CRF replaces a fixed bitrate
+        return {"preset": self.preset, "threads": self.threads, "ffmpeg_params": ["-crf", str(self.crf)]}
+
+    def describe(self):
+        return f"libx264 preset={self.preset} crf={self.crf} threads={self.threads} (~{self.predicted_fps:.0f} fps predicted)"
+
+
+class EncoderPlanner:
+    def __init__(self, deadline=DEFAULT_DEADLINE, quality=DEFAULT_QUALITY, threads=None, calibration_path=DEFAULT_CALIBRATION_PATH):
+        if quality not in QUALITY_TARGETS:
+            raise ValueError(f"Unknown encode quality '{quality}'; choose one of {sorted(QUALITY_TARGETS)}")
+        self.deadline = deadline
+        self.quality = quality
+        # Fixed thread count, or None for a share of the cores per concurrent encode
+        self.threads = threads
+        self.calibration_path = calibration_path
+        self._lock = threading.Lock()
+        self._table = self._load()
+
+    def encode_threads(self):
+        """Threads per encode: the cores divided among the encodes the scheduler runs at once."""
+        if self.threads:
+            return self.threads
+        return max(1, (os.cpu_count() or 1) // get_scheduler().pool("encode").slots)
+
+    @staticmethod
+    def _key(width, height, threads, crf):
+        return f"{width}x{height}@{threads}/crf{crf}"
+
+    def _load(self):
+        try:
+            with open(self.calibration_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.calibration_path), exist_ok=True)
+        tmp = self.calibration_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self._table, f, indent=2)
+        os.replace(tmp, self.calibration_path)
+
+    def calibrate(self, width, height, threads, crf):
+        """Time a short synthetic encode with every preset; returns {preset: fps}.
+
+        Runs in an encode slot so concurrent encodes don't skew it; don't
+        plan while holding one.
+        """
+        frames = CALIBRATION_SECONDS * 24
+        fps = {}
+        with get_scheduler().slot("encode"):
+            for preset in PRESETS:
+                start = time.perf_counter()
+                ffmpeg_tools.run_ffmpeg([
+                    "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate=24:duration={CALIBRATION_SECONDS}",
+                    "-pix_fmt", "yuv420p", "-c:v", "libx264", "-preset", preset, "-crf", str(crf),
+                    "-threads", str(threads), "-f", "null", "-",
+                ])
+                fps[preset] = frames / (time.perf_counter() - start)
+        logger.info("Calibrated libx264 at %dx%d, crf %d with %d threads: %s", width, height, crf, threads,
+                    ", ".join(f"{p} {v:.0f} fps" for p, v in fps.items()))
+        return fps
+
+    def throughput(self, width, height, threads=None, crf=None):
+        threads = threads or self.encode_threads()
+        crf = crf or QUALITY_TARGETS[self.quality][0]
+        key = self._key(width, height, threads, crf)
+        # Held while calibrating so concurrent plans don't repeat the measurement
+        with self._lock:
+            if key not in self._table:
+                self._table[key] = self.calibrate(width, height, threads, crf)
+                self._save()
+            return dict(self._table[key])
+
+    def plan(self, frames, width, height, deadline=None, quality=None):
+        """Choose threads, CRF and the best-compressing preset whose predicted time for ``frames`` fits the deadline."""
+        deadline = deadline or self.deadline
+        crf, max_crf, slowest = QUALITY_TARGETS[quality or self.quality]
+        threads = self.encode_threads()
+        allowed = PRESETS[:PRESETS.index(slowest) + 1]
+        # Presets change file size, CRF changes quality: give up compression before quality
+        for candidate in range(crf, max_crf + 1, CRF_STEP):
+            fps = self.throughput(width, height, threads, candidate)
+            for preset in reversed(allowed):
+                if frames / fps[preset] * SAFETY <= deadline:
+                    return EncodeProfile(preset, candidate, threads, fps[preset])
+            allowed = PRESETS[:1]
+        # Nothing fits: the fastest settings the quality target allows
+        return EncodeProfile(PRESETS[0], candidate, threads, fps[PRESETS[0]])
+
+    def record(self, profile, frames, seconds, width, height):
+        """Log the fps an encode achieved end to end; returns the fps.
+
+        The throughput table isn't updated: the time includes decoding,
+        frame processing and contention, not just x264.
+        """
+        achieved = frames / seconds if seconds > 0 else 0.0
+        logger.info("Encoded %d frames at %dx%d with %s in %.1fs: %.0f fps", frames, width, height, profile.describe(), seconds, achieved)
+        return achieved
+
+
+_planner = None
+_planner_lock = threading.Lock()
+
+
+def get_planner():
+    global _planner
+    with _planner_lock:
+        if _planner is None:
+            _planner = EncoderPlanner()
+        return _planner
@@ -0,0 +1,274 @@
+"""Thin wrappers around the ffmpeg binary bundled with imageio-ffmpeg.
+
+Used for the stream-copy assembly fast path: probing inputs, joining
+compatible segments with the concat demuxer and muxing in a finished audio
+track, all without decoding or re-encoding the video. Inputs can also be
+piped in straight from a download, and video decoded to raw frames.
+"""
+import os
+import re
+import subprocess
+import tempfile
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+
+class FFmpegError(Exception):
+    pass
+
+
+def ffmpeg_exe():
+    # Same binary moviepy uses, unless FFMPEG_BINARY overrides it
+    exe = os.environ.get("FFMPEG_BINARY")
+    if exe and exe != "ffmpeg-imageio":
+        return exe
+    import imageio_ffmpeg
+    return imageio_ffmpeg.get_ffmpeg_exe()
+
+
+def run_ffmpeg(args, input=None):
+    cmd = [ffmpeg_exe(), "-hide_banner", "-loglevel", "error", "-y"] + list(args)
+    proc = subprocess.run(cmd, input=input, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise FFmpegError(f"ffmpeg failed ({proc.returncode}): {proc.stderr.decode(errors='replace').strip()[-500:]}")
+    return proc.stdout
+
+
+def run_ffmpeg_stream(args, chunks):
+    """Run ffmpeg reading ``pipe:0`` from ``chunks`` (an iterable of bytes) as they arrive.
+
+    ffmpeg may stop reading once it has what it needs (e.g. ``-t``); the
+    rest of the input is then dropped. An error from ``chunks`` kills
+    ffmpeg and propagates.
+    """
+    cmd = [ffmpeg_exe(), "-hide_banner", "-loglevel", "error", "-y"] + list(args)
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = []
+    # Drain stderr on the side so a chatty ffmpeg can't block on a full pipe
+    reader = threading.Thread(target=lambda: stderr.append(proc.stderr.read()), daemon=True)
+    reader.start()
+    try:
+        for chunk in chunks:
+            try:
+                proc.stdin.write(chunk)
+            except BrokenPipeError:
+                break  # ffmpeg is done with its input
+    except BaseException:
+        proc.kill()
+        raise
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+        try:
+            proc.stdin.close()
+        except OSError:
+            pass
+        proc.wait()
+        reader.join()
+    if proc.returncode != 0:
+        message = b"".join(stderr).decode(errors="replace").strip()[-500:]
+        raise FFmpegError(f"ffmpeg failed ({proc.returncode}): {message}")
+
+
+def trim_copy(source, output_path, seconds):
+    """Cut the first ``seconds`` of the video stream into ``output_path`` without re-encoding.
+
+    ``source`` is a file path, or an iterable of bytes (e.g. a download
+    stream) that is piped in so the input never lands on disk.
+    """
+    args = ["-map", "0:v:0", "-t", str(seconds), "-c", "copy", "-an", "-movflags", "+faststart", output_path]
+    if isinstance(source, (str, os.PathLike)):
+        run_ffmpeg(["-i", source] + args)
+    else:
+        run_ffmpeg_stream(["-i", "pipe:0"] + args, source)
+    return output_path
+
+
+def decode_frames(path, out, filters=None):
+    """Decode up to ``len(out)`` rgb24 frames of ``path`` into ``out``; returns how many were read.
+
+    ``out`` is a preallocated uint8 array of shape (frames, height, width, 3)
+    and ``filters`` must produce that size. Decoding stops once ``out`` is
+    full.
+    """
+    frames, height, width, _ = out.shape
+    vf = ",".join(filter(None, [filters, "format=rgb24"]))
+    cmd = [ffmpeg_exe(), "-hide_banner", "-loglevel", "error", "-i", path, "-map", "0:v:0", "-vf", vf,
+           "-frames:v", str(frames), "-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1"]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stderr = []
+    reader = threading.Thread(target=lambda: stderr.append(proc.stderr.read()), daemon=True)
+    reader.start()
+    count = 0
+    try:
+        # Read straight into the buffer, one frame at a time
+        while count < frames:
+            view = memoryview(out[count]).cast("B")
+            filled = 0
+            while filled < len(view):
+                n = proc.stdout.readinto(view[filled:])
+                if not n:
+                    break
+                filled += n
+            if filled < len(view):
+                break
+            count += 1
+    finally:
+        proc.stdout.close()
+        proc.wait()
+        reader.join()
+    if proc.returncode != 0:
+        message = b"".join(stderr).decode(errors="replace").strip()[-500:]
+        raise FFmpegError(f"ffmpeg failed ({proc.returncode}): {message}")
+    return count
+
+
+@dataclass
+class MediaInfo:
+    path: str
+    duration: float = 0.0
+    video_codec: Optional[str] = None
+    width: int = 0
+    height: int = 0
+    fps: float = 0.0
+    pix_fmt: Optional[str] = None
+    audio_codec: Optional[str] = None
+    sample_rate: int = 0
+    channels: int = 0
+
+    @property
+    def has_video(self):
+        return self.video_codec is not None
+
+    @property
+    def has_audio(self):
+        return self.audio_codec is not None
+
+
+_DURATION_RE = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+_VIDEO_RE = re.compile(r"Stream #\d+:\d+.*?: Video: (\w+)[^,]*, (\w+)(?:\([^)]*\))?, (\d+)x(\d+)")
+_FPS_RE = re.compile(r"(\d+(?:\.\d+)?) fps")
+_AUDIO_RE = re.compile(r"Stream #\d+:\d+.*?: Audio: (\w+)[^,]*, (\d+) Hz, ([^,]+)")
+
+_CHANNELS = {"mono": 1, "stereo": 2, "2.1": 3, "quad": 4, "5.0": 5, "5.1": 6, "7.1": 8}
+
+
+def probe(path):
+    """Read duration and stream parameters from ``ffmpeg -i`` (no ffprobe needed)."""
+    proc = subprocess.run([ffmpeg_exe(), "-hide_banner", "-i", path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    text = proc.stderr.decode(errors="replace")
+    if "Invalid data found" in text or "No such file" in text:
+        raise FFmpegError(f"Cannot read media file {path}: {text.strip().splitlines()[-1]}")
+
+    info = MediaInfo(path=path)
+    m = _DURATION_RE.search(text)
+    if m:
+        hours, minutes, seconds = m.groups()
+        info.duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    for line in text.splitlines():
+        if info.video_codec is None:
+            m = _VIDEO_RE.search(line)
+            if m:
+                info.video_codec, info.pix_fmt = m.group(1), m.group(2)
+                info.width, info.height = int(m.group(3)), int(m.group(4))
+                fps = _FPS_RE.search(line)
+                info.fps = float(fps.group(1)) if fps else 0.0
+        if info.audio_codec is None:
+            m = _AUDIO_RE.search(line)
+            if m:
+                info.audio_codec, info.sample_rate = m.group(1), int(m.group(2))
+                layout = m.group(3).strip()
+                # Named layouts ("stereo") or a raw count ("3 channels")
+                count = layout.split()[0]
+                info.channels = _CHANNELS.get(layout) or (int(count) if count.isdigit() else 0)
+    return info
+
+
+def parameter_sets(path):
+    """The H.264 SPS and PPS NAL units of ``path``'s video, or None if they can't be read (e.g. not H.264).
+
+    Streams can only be joined by stream copy when these match: an mp4
+    carries one set for the whole track.
+    """
+    try:
+        data = run_ffmpeg(["-i", path, "-map", "0:v:0", "-c:v", "copy", "-frames:v", "1",
+                           "-bsf:v", "h264_mp4toannexb", "-f", "h264", "pipe:1"])
+    except FFmpegError:
+        return None
+    # Annex B start codes are 00 00 01 (or 00 00 00 01, whose leading zero trails the previous unit)
+    units = [unit.rstrip(b"\x00") for unit in data.split(b"\x00\x00\x01")]
+    sets = [unit for unit in units if unit and unit[0] & 0x1F in (7, 8)]
+    return tuple(dict.fromkeys(sets)) or None
+
+
+def can_stream_copy(infos, segment_seconds):
+    """True when every segment shares codec, size, fps and pixel format and is long enough to cut."""
+    if not infos or not all(i.has_video for i in infos):
+        return False
+    first = infos[0]
+    for info in infos:
+        if (info.video_codec, info.width, info.height, info.pix_fmt) != (first.video_codec, first.width, first.height, first.pix_fmt):
+            return False
+        if abs(info.fps - first.fps) > 0.01:
+            return False
+        if info.duration + 0.05 < segment_seconds:
+            return False
+    return True
+
+
+def concat_copy(paths, output_path, segment_seconds=None):
+    """Join segments with the concat demuxer, cutting each at ``segment_seconds`` without re-encoding.
+
+    Every segment is read from its start (a keyframe), so only the tail is
+    trimmed and no frame depends on a dropped reference.
+    """
+    # Written next to the output, i.e. inside the job's workspace
+    list_file = tempfile.NamedTemporaryFile("w", delete=False, suffix=".txt", dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        with list_file:
+            list_file.write("ffconcat version 1.0\n")
+            for path in paths:
+                escaped = os.path.abspath(path).replace("'", r"'\''")
+                list_file.write(f"file '{escaped}'\n")
+                if segment_seconds:
+                    list_file.write(f"outpoint {segment_seconds}\n")
+        run_ffmpeg([
+            "-f", "concat", "-safe", "0", "-i", list_file.name,
+            "-map", "0:v:0", "-c", "copy", "-an",
+            "-movflags", "+faststart",
+            output_path,
+        ])
+    finally:
+        os.remove(list_file.name)
+    return output_path
+
+
+def mux_audio(video_path, audio_path, output_path, duration=None, audio_codec="aac", audio_bitrate="192k"):
+    """Copy the video stream and encode only the given audio track next to it."""
+    args = ["-i", video_path]
+    if audio_path:
+        args += ["-i", audio_path, "-map", "0:v:0", "-map", "1:a:0", "-c:a", audio_codec, "-b:a", audio_bitrate]
+    else:
+        args += ["-map", "0:v:0", "-an"]
+    args += ["-c:v", "copy"]
+    if duration:
+        args += ["-t", f"{duration:.3f}"]
+    args += ["-movflags", "+faststart", output_path]
+    run_ffmpeg(args)
+    return output_path
+
+
+def mux_pcm(video_path, pcm, sample_rate, channels, output_path, duration=None, audio_codec="aac", audio_bitrate="192k"):
+    """Like mux_audio, but the soundtrack is raw s16le PCM piped over stdin."""
+    args = [
+        "-i", video_path,
+        "-f", "s16le", "-ar", str(sample_rate), "-ac", str(channels), "-i", "pipe:0",
+        "-map", "0:v:0", "-map", "1:a:0",
+        "-c:v", "copy", "-c:a", audio_codec, "-b:a", audio_bitrate,
+    ]
+    if duration:
+        args += ["-t", f"{duration:.3f}"]
+    args += ["-movflags", "+faststart", output_path]
+    run_ffmpeg(args, input=pcm)
+    return output_path
@@ -0,0 +1,293 @@
+"""Replicate generation layer shared by the apps and the batch engine."""
+import copy
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import replicate
+
+from asset_cache import cache_key, get_cache
+from downloader import download_to_file, stream_download
+from ffmpeg_tools import FFmpegError
+from hedging import get_hedge_policy
+from predictions import PredictionCanceled, PredictionManager, WebhookReceiver
+from rate_limits import get_rate_limiter
+from scheduler import current_session, get_scheduler, session
+from tracing import NULL_TRACER
+
+logger = logging.getLogger(__name__)
+
+# Optional webhook endpoint: Replicate calls GPT_VOLCA_WEBHOOK_URL, which must reach
+# the local receiver on GPT_VOLCA_WEBHOOK_PORT (e.g. through a tunnel)
+WEBHOOK_URL = os.environ.get("GPT_VOLCA_WEBHOOK_URL")
+WEBHOOK_PORT = int(os.environ.get("GPT_VOLCA_WEBHOOK_PORT", 8765))
+
+_receiver = None
+_receiver_lock = threading.Lock()
+
+# Models whose outputs ffmpeg couldn't read from a pipe (e.g. an mp4 index at the end of the file),
+# mapped to when streaming is tried again: a model may change its output, and one bad
+# prediction shouldn't cost every later job the streamed ingest
+UNSTREAMABLE_TTL = float(os.environ.get("GPT_VOLCA_UNSTREAMABLE_TTL", 3600))
+_unstreamable = {}
+_unstreamable_lock = threading.Lock()
+
+
+def _streamable(model_path):
+    with _unstreamable_lock:
+        retry_at = _unstreamable.get(model_path)
+        if retry_at is not None and time.monotonic() >= retry_at:
+            del _unstreamable[model_path]
+            retry_at = None
+        return retry_at is None
+
+
+def _mark_unstreamable(model_path):
+    with _unstreamable_lock:
+        _unstreamable[model_path] = time.monotonic() + UNSTREAMABLE_TTL
+
+
+def get_webhook_receiver():
+    global _receiver
+    if not WEBHOOK_URL:
+        return None
+    with _receiver_lock:
+        if _receiver is None:
+            _receiver = WebhookReceiver(port=WEBHOOK_PORT)
+        return _receiver
+
+
+class Generator:
+    def __init__(self, api_token, use_cache=True, max_concurrent=None, limiter=None, owner=None, tracer=None, hedge=None, workspace=None):
+        self.client = replicate.Client(api_token=api_token)
+        self.cache = get_cache() if use_cache else None
+        # Cap on in-flight predictions: the batch's own cap, or the server-wide fair-share pool
+        self.limiter = limiter or (threading.BoundedSemaphore(max_concurrent) if max_concurrent else get_scheduler().pool("remote"))
+        self.owner = owner
+        self.tracer = tracer or NULL_TRACER
+        # Optional workspace.Workspace that downloads land in (the system temp dir otherwise)
+        self.workspace = workspace
+        # Optional hedging.HedgePolicy for straggling predictions
+        self.hedge = hedge or get_hedge_policy()
+        # Per-model creation rate and adaptive concurrency, shared by every generator in the process
+        self.rate_limiter = get_rate_limiter()
+        self.predictions = PredictionManager(self.client, webhook_url=WEBHOOK_URL, rate_limiter=self.rate_limiter)
+        # Set by abort(): stages still running after their job is abandoned start no new predictions
+        self.aborted = False
+        receiver = get_webhook_receiver()
+        if receiver:
+            receiver.attach(self.predictions)
+
+    def for_owner(self, owner, tracer=None, workspace=None):
+        """A view sharing this generator's client, cache, limits and poller, tagged with ``owner``."""
+        view = copy.copy(self)
+        view.owner = owner
+        if tracer is not None:
+            view.tracer = tracer
+        if workspace is not None:
+            view.workspace = workspace
+        return view
+
+    def run_replicate(self, model_path, input_data):
+        with self.tracer.span("predict", model=model_path) as span:
+            if self.limiter is None:
+                return self._predict(model_path, input_data, span)
+            with self.limiter:
+                return self._predict(model_path, input_data, span)
+
+    def _check_aborted(self):
+        if self.aborted:
+            raise PredictionCanceled(f"Generation for {self.owner or 'this job'} was aborted")
+
+    def _predict(self, model_path, input_data, span):
+        self._check_aborted()
+        if not (self.hedge and self.hedge.applies(model_path)):
+            return self.predictions.run(model_path, input_data, owner=self.owner)
+        # Past the model's latency percentile, race a duplicate and cancel the loser
+        self.hedge.started()
+        started = {self.predictions.submit(model_path, input_data, owner=self.owner): time.monotonic()}
+        deadline = self.hedge.deadline(model_path)
+        hedge_slot = False
+        try:
+            if deadline is not None:
+                done, _ = wait(started, timeout=deadline)
+                # The hedge needs its own limiter slot; skip it rather than wait for one
+                if not done and (self.limiter is None or self.limiter.acquire(blocking=False)):
+                    hedge_slot = self.limiter is not None
+                    if self.hedge.try_hedge():
+                        span.attrs["hedged_after"] = round(deadline, 2)
+                        try:
+                            started[self.predictions.submit(model_path, input_data, owner=self.owner)] = time.monotonic()
+                        except Exception as e:
+                            # The primary is still running; carry on without the hedge
+                            logger.warning("Hedge for %s could not be started: %s", model_path, e)
+                    if len(started) == 1 and hedge_slot:
+                        # No hedge is running; give its slot back now
+                        self.limiter.release()
+                        hedge_slot = False
+            pending = set(started)
+            while True:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                winner = next((f for f in done if not f.exception()), None)
+                if winner is not None or not pending:
+                    break
+        finally:
+            if hedge_slot:
+                self.limiter.release()
+            losers = [f.prediction_id for f in started if not f.done()]
+            if losers:
+                self.predictions.cancel(losers)
+        if winner is None:
+            # Every attempt failed; surface the primary's error
+            return next(iter(started)).result()
+        primary = next(iter(started))
+        hedge_won = winner is not primary
+        if hedge_won:
+            span.attrs["hedge_won"] = True
+        # Time from the primary's submission: a hedge's own latency would be
+        # shorter by the deadline and drag the percentile down each time it wins
+        self.hedge.finished(model_path, time.monotonic() - started[primary], hedge_won)
+        return winner.result()
+
+    def run_replicate_text(self, model_path, input_data):
+        # Text models stream back a list of tokens; join them before caching
+        def produce():
+            output = self.run_replicate(model_path, input_data)
+            return "".join(str(t) for t in output) if isinstance(output, list) else str(output)
+        with self.tracer.span("text", model=model_path) as span:
+            text = self.cache.fetch_text(model_path, input_data, produce) if self.cache else produce()
+            span.bytes = len(text.encode())
+        return text
+
+    def stream_replicate_text(self, model_path, input_data):
+        """Yield a text model's output as it streams in; a cached response arrives in one piece.
+
+        Shares cache entries with ``run_replicate_text``; only complete responses are stored.
+        """
+        key = cache_key(model_path, input_data)
+        cached = self.cache.get_text(key) if self.cache else None
+        if cached is not None:
+            yield cached
+            return
+        chunks = []
+        with self.tracer.span("text", model=model_path, streamed=True) as span:
+            with self.tracer.span("predict", model=model_path):
+                if self.limiter is not None:
+                    self.limiter.acquire()
+                # The consumer may close this generator (or drop it to GC) from another
+                # session; the slot goes back to the one that took it
+                holder = current_session()
+                try:
+                    self._check_aborted()
+                    for chunk in self.predictions.stream(model_path, input_data, owner=self.owner):
+                        chunks.append(chunk)
+                        yield chunk
+                finally:
+                    if self.limiter is not None:
+                        with session(holder):
+                            self.limiter.release()
+            text = "".join(chunks)
+            span.bytes = len(text.encode())
+        if self.cache:
+            self.cache.put_text(key, text, model_path)
+
+    def run_replicate_to_file(self, model_path, input_data, suffix):
+        dest = self.workspace.file(suffix) if self.workspace else None
+
+        def produce():
+            output = self.run_replicate(model_path, input_data)
+            if isinstance(output, list):
+                output = output[0]
+            with self.tracer.span("download", model=model_path) as span:
+                path = download_to_file(output, suffix=suffix, dest=dest)
+                span.bytes = os.path.getsize(path)
+            return path
+        with self.tracer.span("asset", model=model_path) as span:
+            path = self.cache.fetch_file(model_path, input_data, suffix, produce, dest=dest) if self.cache else produce()
+            span.bytes = os.path.getsize(path)
+        if self.workspace:
+            self.workspace.check()
+        return path
+
+    def run_replicate_ingest(self, model_path, input_data, suffix, ingest, variant=""):
+        """Like run_replicate_to_file, but the output is piped straight into ``ingest(source, dest)``.
+
+        ``source`` is an iterable over the response body, so the raw
+        download never lands on disk; only what ``ingest`` writes to
+        ``dest`` does, and that is what gets cached (under ``variant``).
+        Models whose output can't be read from a pipe are downloaded to a
+        file first and ``source`` is its path; streaming is tried again
+        after GPT_VOLCA_UNSTREAMABLE_TTL seconds.
+        """
+        dest = self.workspace.file(suffix) if self.workspace else tempfile.NamedTemporaryFile(delete=False, suffix=suffix).name
+
+        def produce():
+            output = self.run_replicate(model_path, input_data)
+            if isinstance(output, list):
+                output = output[0]
+            streamed = _streamable(model_path)
+            if streamed:
+                with self.tracer.span("ingest", model=model_path, streamed=True) as span:
+                    try:
+                        ingest(stream_download(output, label=dest), dest)
+                        span.bytes = os.path.getsize(dest)
+                        return dest
+                    except FFmpegError as e:
+                        logger.warning("Streaming ingest of %s output failed, downloading instead: %s", model_path, e)
+                        _mark_unstreamable(model_path)
+            with self.tracer.span("download", model=model_path) as span:
+                raw = download_to_file(output, suffix=suffix, dest=self.workspace.file(suffix, prefix="raw") if self.workspace else None)
+                span.bytes = os.path.getsize(raw)
+            try:
+                with self.tracer.span("ingest", model=model_path, streamed=False) as span:
+                    ingest(raw, dest)
+                    span.bytes = os.path.getsize(dest)
+            except FFmpegError:
+                if streamed:
+                    # The output itself is unreadable, so the pipe wasn't to blame
+                    with _unstreamable_lock:
+                        _unstreamable.pop(model_path, None)
+                raise
+            finally:
+                os.remove(raw)
+            return dest
+        with self.tracer.span("asset", model=model_path) as span:
+            path = self.cache.fetch_file(model_path, input_data, suffix, produce, variant=variant, dest=dest) if self.cache else produce()
+            span.bytes = os.path.getsize(path)
+        if self.workspace:
+            self.workspace.check()
+        return path
+
+    def cancel_all(self):
+        """Cancel this owner's in-flight predictions (all of them if no owner is set)."""
+        return self.predictions.cancel_all(self.owner)
+
+    def abort(self):
+        """Cancel this owner's in-flight predictions and refuse new ones, e.g. for a cancelled job."""
+        self.aborted = True
+        return self.cancel_all()
+
+    def close(self):
+        self.predictions.cancel_all()
+        self.predictions.close()
+        receiver = get_webhook_receiver()
+        if receiver:
+            receiver.detach(self.predictions)
+
+    def rate_summary(self):
+        return self.rate_limiter.describe()
+
+    def hedge_summary(self):
+        if not self.hedge:
+            return None
+        stats = self.hedge.stats()
+        return f"Hedging: {stats['hedges']} duplicates for {stats['primaries']} predictions, {stats['wins']} won"
+
+    def cache_summary(self):
+        if not self.cache:
+            return None
+        stats = self.cache.stats()
+        return f"Cache: {stats['hits']} hits, {stats['misses']} misses, {stats['bytes'] / 1e6:.0f} MB stored"
@@ -0,0 +1,138 @@
+"""Hedged predictions: cut tail latency when one straggler holds up a job.
+
+Every segment of a video sits on the critical path, so a single slow
+prediction sets the job's latency. For hedged models the generator waits
+until the prediction passes a latency percentile observed for that model,
+then starts a duplicate and takes whichever finishes first; the other one
+is cancelled. Extra predictions are capped at a fraction of the primary
+ones, so hedging can't run away with the bill.
+
+Configured with GPT_VOLCA_HEDGE_MODELS (comma-separated model paths, off
+when empty), GPT_VOLCA_HEDGE_PERCENTILE and GPT_VOLCA_HEDGE_BUDGET.
+Observed latencies are kept on disk next to the encoder calibration.
+"""
+import json
+import logging
+import os
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODELS = [m.strip() for m in os.environ.get("GPT_VOLCA_HEDGE_MODELS", "").split(",") if m.strip()]
+DEFAULT_PERCENTILE = float(os.environ.get("GPT_VOLCA_HEDGE_PERCENTILE", 90))
+DEFAULT_BUDGET = float(os.environ.get("GPT_VOLCA_HEDGE_BUDGET", 0.1))
+DEFAULT_LATENCY_PATH = os.path.join(
+    os.environ.get("GPT_VOLCA_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "gpt-volca")),
+    "prediction_latency.json",
+)
+
+WINDOW = 200  # Recent latencies kept per model
+MIN_SAMPLES = 10  # Below this the percentile is too noisy to hedge on
+
+
+class LatencyTracker:
+    """Sliding window of successful prediction latencies per model."""
+
+    def __init__(self, path=DEFAULT_LATENCY_PATH, window=WINDOW):
+        self.path = path
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples = {model: deque(values, maxlen=window) for model, values in self._load().items()}
+
+    def _load(self):
+        if not self.path:
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + f".{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({model: list(values) for model, values in self._samples.items()}, f)
+        os.replace(tmp, self.path)
+
+    def record(self, model_path, seconds):
+        with self._lock:
+            self._samples.setdefault(model_path, deque(maxlen=self.window)).append(round(seconds, 3))
+            self._save()
+
+    def percentile(self, model_path, q, min_samples=MIN_SAMPLES):
+        """The ``q``-th percentile latency in seconds, or None with fewer than ``min_samples`` samples."""
+        with self._lock:
+            values = sorted(self._samples.get(model_path, ()))
+        if len(values) < max(min_samples, 1):
+            return None
+        # Nearest-rank percentile
+        rank = min(len(values) - 1, max(0, int(round(q / 100 * len(values))) - 1))
+        return values[rank]
+
+
+class HedgePolicy:
+    """Decides when a prediction of a hedged model gets a duplicate, within a spend budget.
+
+    ``budget`` is the largest ratio of extra predictions to primary ones,
+    e.g. 0.1 allows one hedge per ten predictions.
+    """
+
+    def __init__(self, models=None, percentile=DEFAULT_PERCENTILE, budget=DEFAULT_BUDGET,
+                 min_samples=MIN_SAMPLES, tracker=None):
+        self.models = set(DEFAULT_MODELS if models is None else models)
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.tracker = tracker or LatencyTracker()
+        self._lock = threading.Lock()
+        self.primaries = 0
+        self.hedges = 0
+        self.wins = 0
+
+    def applies(self, model_path):
+        return model_path in self.models
+
+    def started(self):
+        with self._lock:
+            self.primaries += 1
+
+    def deadline(self, model_path):
+        """Seconds to wait before hedging ``model_path``, or None until enough latencies are known."""
+        return self.tracker.percentile(model_path, self.percentile, self.min_samples)
+
+    def try_hedge(self):
+        """Reserve budget for one duplicate prediction; False when the budget is spent."""
+        with self._lock:
+            if self.hedges + 1 > self.budget * self.primaries:
+                return False
+            self.hedges += 1
+            return True
+
+    def finished(self, model_path, seconds, hedge_won=False):
+        self.tracker.record(model_path, seconds)
+        if hedge_won:
+            with self._lock:
+                self.wins += 1
+
+    def stats(self):
+        with self._lock:
+            return {"primaries": self.primaries, "hedges": self.hedges, "wins": self.wins}
+
+
+_policy = None
+_policy_lock = threading.Lock()
+
+
+def get_hedge_policy():
+    """The process-wide policy from the environment, or None when no model is hedged."""
+    global _policy
+    if not DEFAULT_MODELS:
+        return None
+    with _policy_lock:
+        if _policy is None:
+            _policy = HedgePolicy()
+        return _policy
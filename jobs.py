@@ -0,0 +1,391 @@
+"""Background video jobs that outlive Streamlit reruns.
+
+The UI only submits a job and polls its record; a server-wide executor
+runs it through the engine. Jobs and their per-stage states are persisted
+in SQLite next to their assets, so a rerun from any widget or a browser
+refresh simply reattaches to the job by id. Jobs left queued or running by
+a process that no longer exists are marked interrupted on startup.
+
+Finished jobs are pruned at startup and then every GPT_VOLCA_PRUNE_INTERVAL
+seconds. A job goes, with its assets, trace files and rows, once it is older
+than GPT_VOLCA_JOB_TTL_DAYS, or earlier, oldest first, while the jobs
+directory is over GPT_VOLCA_JOBS_MAX_MB.
+"""
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROOT = os.environ.get("GPT_VOLCA_JOBS_DIR", os.path.join(os.path.expanduser("~"), ".cache", "gpt-volca", "jobs"))
+MAX_JOBS = int(os.environ.get("GPT_VOLCA_MAX_JOBS", 2))
+JOB_TTL = float(os.environ.get("GPT_VOLCA_JOB_TTL_DAYS", 7)) * 86400
+JOBS_MAX_BYTES = int(os.environ.get("GPT_VOLCA_JOBS_MAX_MB", 10 * 1024)) * 1024 ** 2
+PRUNE_INTERVAL = float(os.environ.get("GPT_VOLCA_PRUNE_INTERVAL", 3600))
+
+ACTIVE_STATUSES = ("queued", "running")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+@dataclass
+class JobRecord:
+    id: str
+    kind: str
+    params: dict
+    status: str
+    owner: Optional[str] = None
+    created: float = 0.0
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    error: Optional[str] = None
+    output: Optional[str] = None
+    preview: Optional[str] = None
+    trace: Optional[str] = None
+    notes: Optional[str] = None
+    stages: dict = field(default_factory=dict)  # name -> {"status", "result", "error", "detail"}
+
+    @property
+    def active(self):
+        return self.status in ACTIVE_STATUSES
+
+    @property
+    def seconds(self):
+        if not self.started:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+
+class JobStore:
+    def __init__(self, root=DEFAULT_ROOT):
+        self.root = root
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(root, "jobs.sqlite"), check_same_thread=False, timeout=30)
+        with self._lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT, params TEXT, status TEXT, owner TEXT, pid INTEGER, "
+                "created REAL, started REAL, finished REAL, error TEXT, output TEXT, preview TEXT, "
+                "trace TEXT, notes TEXT)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS stages ("
+                "job_id TEXT, name TEXT, position INTEGER, status TEXT, result TEXT, error TEXT, "
+                "detail TEXT, updated REAL, PRIMARY KEY (job_id, name))"
+            )
+
+    def job_dir(self, job_id):
+        path = os.path.join(self.root, job_id)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def create(self, kind, params, stage_names, owner=None):
+        job_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO jobs (id, kind, params, status, owner, pid, created) VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                (job_id, kind, json.dumps(params), owner, os.getpid(), now),
+            )
+            self._db.executemany(
+                "INSERT INTO stages (job_id, name, position, status, updated) VALUES (?, ?, ?, 'pending', ?)",
+                [(job_id, name, i, now) for i, name in enumerate(stage_names)],
+            )
+        return job_id
+
+    def update(self, job_id, **fields):
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._db:
+            self._db.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def set_stage(self, job_id, name, status, result=None, error=None, detail=None):
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE stages SET status = ?, result = ?, error = ?, detail = ?, updated = ? WHERE job_id = ? AND name = ?",
+                (status, json.dumps(result), error, detail, time.time(), job_id, name),
+            )
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, kind, params, status, owner, created, started, finished, error, output, preview, trace, notes "
+                "FROM jobs WHERE id = ?", (job_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            stages = self._db.execute(
+                "SELECT name, status, result, error, detail FROM stages WHERE job_id = ? ORDER BY position", (job_id,),
+            ).fetchall()
+        record = JobRecord(*row[:2], json.loads(row[2]), *row[3:])
+        record.stages = {
+            name: {"status": status, "result": json.loads(result) if result else None, "error": error, "detail": detail}
+            for name, status, result, error, detail in stages
+        }
+        return record
+
+    def list(self, owner=None, limit=20):
+        with self._lock:
+            if owner is None:
+                ids = self._db.execute("SELECT id FROM jobs ORDER BY created DESC LIMIT ?", (limit,)).fetchall()
+            else:
+                ids = self._db.execute("SELECT id FROM jobs WHERE owner = ? ORDER BY created DESC LIMIT ?", (owner, limit)).fetchall()
+        return [self.get(job_id) for (job_id,) in ids]
+
+    def recover(self):
+        """Mark jobs whose owning process is gone as interrupted; returns how many."""
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT id, pid FROM jobs WHERE status IN ({', '.join('?' * len(ACTIVE_STATUSES))})", ACTIVE_STATUSES,
+            ).fetchall()
+        dead = [job_id for job_id, pid in rows if not _pid_alive(pid)]
+        for job_id in dead:
+            self.update(job_id, status="interrupted", finished=time.time(), error="The server restarted while this job was running")
+        return len(dead)
+
+    def prune(self, ttl=JOB_TTL, max_bytes=JOBS_MAX_BYTES, now=None):
+        """Delete finished jobs older than ``ttl`` seconds, then the oldest while the jobs use over ``max_bytes``.
+
+        Returns the ids of the deleted jobs. Queued and running jobs are never touched.
+        """
+        now = now or time.time()
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT id, COALESCE(finished, created), trace FROM jobs "
+                f"WHERE status NOT IN ({', '.join('?' * len(ACTIVE_STATUSES))}) ORDER BY COALESCE(finished, created)",
+                ACTIVE_STATUSES,
+            ).fetchall()
+        sizes = {job_id: _tree_size(os.path.join(self.root, job_id)) for job_id, _, _ in rows}
+        total = _tree_size(self.root)
+        pruned = []
+        for job_id, finished, trace in rows:
+            if finished >= now - ttl and total <= max_bytes:
+                break
+            self._delete(job_id, trace)
+            total -= sizes[job_id]
+            pruned.append(job_id)
+        return pruned
+
+    def _delete(self, job_id, trace):
+        shutil.rmtree(os.path.join(self.root, job_id), ignore_errors=True)
+        # Tracer.export writes <job_id>.trace.json and <job_id>.prom side by side
+        traces = [trace, trace[:-len(".trace.json")] + ".prom"] if trace and trace.endswith(".trace.json") else [trace]
+        for path in filter(None, traces):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM stages WHERE job_id = ?", (job_id,))
+            self._db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+
+def _tree_size(path):
+    total = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(directory, name))
+            except OSError:
+                pass
+    return total
+
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobManager:
+    """Runs submitted jobs on a bounded executor shared by every session of the server."""
+
+    def __init__(self, store=None, max_jobs=MAX_JOBS):
+        self.store = store or JobStore()
+        recovered = self.store.recover()
+        if recovered:
+            logger.info("Marked %d orphaned jobs as interrupted", recovered)
+        self.prune()
+        self._pool = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="gpt-volca-job")
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._generators = {}
+        self._cancelled = set()
+        # Finished jobs keep every asset; a long-running server must let them go eventually
+        self._pruner = threading.Thread(target=self._prune_loop, name="gpt-volca-job-pruner", daemon=True)
+        self._pruner.start()
+
+    def prune(self):
+        try:
+            pruned = self.store.prune()
+        except (OSError, sqlite3.Error) as e:
+            logger.warning("Pruning finished jobs failed: %s", e)
+            return []
+        if pruned:
+            logger.info("Pruned %d finished jobs", len(pruned))
+        return pruned
+
+    def _prune_loop(self):
+        while True:
+            time.sleep(PRUNE_INTERVAL)
+            self.prune()
+
+    def submit_video(self, job, api_token, use_cache=True, owner=None):
+        """Queue a video_engine.VideoJob; the API token is kept in memory only."""
+        from dataclasses import asdict
+        stages = ["script", "music"] + [f"segment_{i+1}" for i in range(job.num_segments)]
+        if job.include_voiceover:
+            stages += [f"voice_{i+1}" for i in range(job.num_segments)] + ["voiceover"]
+        job_id = self.store.create("video", asdict(job), stages, owner=owner)
+        with self._lock:
+            self._futures[job_id] = self._pool.submit(self._run_video, job_id, api_token, use_cache)
+        logger.info("Queued job %s", job_id)
+        return job_id
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def queue_position(self, job_id):
+        """1-based place of a queued job among this server's queued jobs, or None once it has started."""
+        with self._lock:
+            queued = [jid for jid, future in self._futures.items() if not future.running() and not future.done()]
+        return queued.index(job_id) + 1 if job_id in queued else None
+
+    def wait_status(self, job_id):
+        """What a running job is waiting for in the shared scheduler, e.g. its place in the encode queue."""
+        from scheduler import get_scheduler
+        record = self.store.get(job_id)
+        return get_scheduler().describe_wait(record.owner or job_id) if record else None
+
+    def cancel(self, job_id):
+        with self._lock:
+            self._cancelled.add(job_id)
+            future = self._futures.get(job_id)
+            generator = self._generators.get(job_id)
+        if future is not None and future.cancel():
+            self.store.update(job_id, status="cancelled", finished=time.time())
+            with self._lock:
+                self._futures.pop(job_id, None)
+                self._cancelled.discard(job_id)
+        elif generator is not None:
+            # Failing the in-flight predictions, and refusing new ones, unwinds the running stages
+            generator.abort()
+
+    def _check_cancelled(self, job_id):
+        with self._lock:
+            if job_id in self._cancelled:
+                raise JobCancelled(f"Job {job_id} was cancelled")
+
+    def _run_video(self, job_id, api_token, use_cache):
+        from downloader import download_stats
+        from generation import Generator
+        from media_resources import LeakDetector
+        from scheduler import session
+        from stages import StageSkipped
+        from tracing import Tracer
+        from video_engine import SEGMENT_SECONDS, VideoJob, make_assembler, run_job
+        from workspace import get_workspaces
+
+        store = self.store
+        record = store.get(job_id)
+        job_dir = store.job_dir(job_id)
+        tracer = Tracer(job_id)
+        leaks = LeakDetector(job_id)
+        generator = workspace = assembler = None
+        produced = {}
+
+        def on_done(name, result, error):
+            # Runs on this job's thread; the UI picks the state up on its next poll
+            if error is not None:
+                store.set_stage(job_id, name, "skipped" if isinstance(error, StageSkipped) else "failed", error=str(error))
+            else:
+                stats = download_stats(result) if isinstance(result, str) else None
+                store.set_stage(job_id, name, "done", result=result, detail=stats.describe() if stats else None)
+                if isinstance(result, str):
+                    produced[name] = result
+            if assembler.preview_path:
+                store.update(job_id, preview=assembler.preview_path, notes=f"{assembler.prefix * SEGMENT_SECONDS} of {job.length} seconds assembled")
+            self._check_cancelled(job_id)
+
+        store.update(job_id, status="running", started=time.time())
+        try:
+            self._check_cancelled(job_id)
+            # Setup failures (bad params, no scratch space, a bad token) fail the job instead of leaving it queued
+            job = VideoJob(**record.params)
+            # Downloads and intermediates go to the job's own scratch directory, removed however the job ends
+            workspace = get_workspaces().create(job_id)
+            generator = Generator(api_token, use_cache=use_cache, owner=job_id, tracer=tracer, workspace=workspace)
+            with self._lock:
+                self._generators[job_id] = generator
+            assembler = make_assembler(job, tracer=tracer, workspace=workspace)
+            # Predictions and encodes share the server's pools fairly with other sessions' jobs
+            with session(record.owner or job_id):
+                output_path, _, errors = run_job(generator, job, os.path.join(job_dir, "final_video.mp4"),
+                                                 on_done=on_done, logger=None, assembler=assembler)
+            store.update(job_id, status="succeeded", output=output_path,
+                         notes=f"Left out: {', '.join(sorted(errors))}" if errors else None)
+        except Exception as e:
+            with self._lock:
+                cancelled = job_id in self._cancelled
+            store.update(job_id, status="cancelled" if cancelled else "failed", error=f"{type(e).__name__}: {e}")
+            logger.info("Job %s %s: %s", job_id, "cancelled" if cancelled else "failed", e)
+        finally:
+            if generator is not None:
+                generator.close()
+            # Keep every generated asset with the job so it can still be downloaded later
+            for name, path in produced.items():
+                try:
+                    if os.path.exists(path):
+                        dst = os.path.join(job_dir, name + os.path.splitext(path)[1])
+                        shutil.move(path, dst)
+                        stage = store.get(job_id).stages.get(name, {})
+                        store.set_stage(job_id, name, stage.get("status", "done"), result=dst, detail=stage.get("detail"))
+                except OSError as e:
+                    logger.warning("Could not keep %s of job %s: %s", name, job_id, e)
+            if workspace is not None:
+                workspace.cleanup()
+            trace_path, _ = tracer.export()
+            leak_report = leaks.check()
+            summaries = [generator.cache_summary(), generator.hedge_summary(), generator.rate_summary()] if generator else []
+            store.update(job_id, finished=time.time(), preview=None, trace=trace_path,
+                         notes=_join(store.get(job_id).notes, *summaries,
+                                     workspace.describe() if workspace else None, leak_report.describe()))
+            with self._lock:
+                self._generators.pop(job_id, None)
+                self._futures.pop(job_id, None)
+                self._cancelled.discard(job_id)
+
+
+def _join(*parts):
+    return " · ".join(p for p in parts if p)
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    """The server-wide manager; Streamlit keeps this module (and so the executor) alive across reruns."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager()
+        return _manager
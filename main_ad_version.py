@@ -1,18 +1,17 @@
 import streamlit as st
-import replicate
-import tempfile
-import os
-import requests
-import re
-from moviepy.editor import (
-    VideoFileClip,
-    concatenate_videoclips,
-    AudioFileClip,
-    CompositeAudioClip,
-)
+import time
 
 st.title("AI Multi-Agent Ad Creator")
 
+# A rerun or stop abandons the previous run's job: cancel its predictions so they stop billing
+previous_generator = st.session_state.pop("active_generator", None)
+if previous_generator is not None:
+    previous_generator.close()
+# ...and remove its scratch files, which st.stop() or an error may have left behind
+previous_workspace = st.session_state.pop("active_workspace", None)
+if previous_workspace is not None:
+    previous_workspace.cleanup()
+
 replicate_api_key = st.text_input("Enter your Replicate API Key", type="password")
 
 # Ad-specific inputs
@@ -42,14 +41,39 @@ with col2:
 key_benefits = st.text_area("Key Benefits/Features (1-3 main points)", 
                            placeholder="e.g., '99% effective cleaning, eco-friendly, saves time'")
 
-if replicate_api_key and product_name and key_benefits and st.button("Generate 20s Ad"):
-    replicate_client = replicate.Client(api_token=replicate_api_key)
+reuse_cached = st.checkbox("Reuse cached generations", value=True,
+                           help="Return saved results for identical model requests instead of generating them again")
 
-    def run_replicate(model_path, input_data):
-        return replicate_client.run(model_path, input=input_data)
+if replicate_api_key and product_name and key_benefits and st.button("Generate 20s Ad"):
+    # The API and media layers load only once generation starts, so form reruns stay cheap
+    from stages import StageGraph
+    from script_stream import add_script_stages, stream_script
+    from downloader import download_stats
+    from generation import Generator
+    from ffmpeg_tools import FFmpegError
+    from audio_engine import mix_tracks
+    from video_engine import assemble_video_fast, fetch_segment
+    from tracing import Tracer
+    from media_resources import LeakDetector
+    from preflight import PreflightError, preflight
+    from scheduler import get_scheduler, set_session
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    from workspace import get_workspaces
+
+    # Every stage, model call, download and encode step is timed into one trace per ad
+    tracer = Tracer(f"ad-{time.strftime('%Y%m%d-%H%M%S')}")
+    # Reports ffmpeg readers and memory this job leaves behind in the server process
+    leak_detector = LeakDetector(tracer.job_id)
+    # Predictions and encodes share the server's pools fairly with every other session
+    ctx = get_script_run_ctx()
+    set_session(ctx.session_id if ctx else tracer.job_id)
+    # All of this ad's downloads and intermediates live in its own scratch directory
+    workspace = get_workspaces().create(tracer.job_id)
+    st.session_state["active_workspace"] = workspace
+    generator = Generator(replicate_api_key, use_cache=reuse_cached, tracer=tracer, workspace=workspace)
+    st.session_state["active_generator"] = generator
+    run_replicate_to_file = generator.run_replicate_to_file
 
-    st.info("Step 1: Writing compelling ad script")
-    
     # Enhanced ad script prompt
     ad_script_prompt = f"""You are an expert advertising copywriter. Write a compelling, persuasive 20-second video ad script for '{product_name}'.
 
@@ -67,43 +91,9 @@ Create a 4-segment script (5 seconds each) that follows this structure:
 Keep each segment to 6-8 words maximum for clear delivery. Make it persuasive and memorable.
 Label each section as '1:', '2:', '3:', and '4:'."""
 
-    full_script = run_replicate(
-        "anthropic/claude-4-sonnet",
-        {"prompt": ad_script_prompt}
-    )
-
-    script_text = "".join(full_script) if isinstance(full_script, list) else full_script
-    script_segments = re.findall(r"\d+:\s*(.+)", script_text)
-
-    if len(script_segments) < 4:
-        st.error("Failed to extract 4 clear script segments. Try adjusting your inputs.")
-        st.stop()
-
-    st.success("Ad script written successfully")
-    st.write("**Generated Script:**")
-    for i, segment in enumerate(script_segments):
-        st.write(f"**Segment {i+1}:** {segment}")
-    
-    script_file_path = tempfile.NamedTemporaryFile(delete=False, suffix=".txt").name
-    with open(script_file_path, "w") as f:
-        f.write(f"Ad Script for: {product_name}\n")
-        f.write(f"Target: {target_audience}\n")
-        f.write(f"Tone: {ad_tone}\n\n")
-        f.write("\n\n".join([f"Segment {i+1}: {seg}" for i, seg in enumerate(script_segments)]))
-    st.download_button("📜 Download Ad Script", script_file_path, "ad_script.txt")
-
-    temp_video_paths = []
-
-    def download_to_file(url: str, suffix: str):
-        resp = requests.get(url, stream=True)
-        resp.raise_for_status()
-        tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
-        with open(tmp.name, "wb") as f:
-            for chunk in resp.iter_content(1024 * 32):
-                f.write(chunk)
-        return tmp.name
-
-    segment_clips = []
+    def write_script(on_segment):
+        # Segments start rendering as their lines stream in; missing ones are re-prompted
+        return stream_script(generator, "anthropic/claude-4-sonnet", ad_script_prompt, 4, on_segment)
 
     # Step 2: Generate ad visuals with commercial style
     visual_styles = {
@@ -117,9 +107,7 @@ Label each section as '1:', '2:', '3:', and '4:'."""
     
     style_description = visual_styles.get(ad_tone, "professional, appealing")
 
-    for i, segment in enumerate(script_segments):
-        st.info(f"Step 2.{i+1}: Generating commercial visuals for segment {i+1}")
-        
+    def generate_segment(i, segment):
         # Ad-specific visual prompts
         if i == 0:  # Hook/Problem
             video_prompt = f"Commercial ad opening scene: {style_description}. Scene showing the problem or hook for {product_name}. {segment}"
@@ -129,36 +117,11 @@ Label each section as '1:', '2:', '3:', and '4:'."""
             video_prompt = f"Commercial ad scene: {style_description}. Demonstrating benefits of {product_name} in action. {segment}"
         else:  # Call to Action
             video_prompt = f"Commercial ad finale: {style_description}. Strong call-to-action scene for {product_name}. {segment}"
-            
-        try:
-            video_uri = run_replicate(
-                "luma/ray-flash-2-540p",
-                {"prompt": video_prompt, "num_frames": 120, "fps": 24},
-            )
-            video_path = download_to_file(video_uri, suffix=".mp4")
-            temp_video_paths.append(video_path)
-
-            # Ensure exactly 5s per segment with proper handling
-            clip = VideoFileClip(video_path)
-            if clip.duration >= 5:
-                clip = clip.subclip(0, 5)
-            else:
-                # If clip is shorter than 5s, loop it to reach 5s
-                loops_needed = int(5 / clip.duration) + 1
-                clip = concatenate_videoclips([clip] * loops_needed).subclip(0, 5)
-            
-            segment_clips.append(clip)
-
-            st.video(video_path)
-            st.download_button(f"🎥 Download Segment {i+1}", video_path, f"ad_segment_{i+1}.mp4")
-        except Exception as e:
-            st.error(f"Failed to generate segment {i+1} visuals: {e}")
-            st.stop()
+
+        # Piped straight from the download into a 5s trim
+        return fetch_segment(generator, "luma/ray-flash-2-540p", {"prompt": video_prompt, "num_frames": 120, "fps": 24})
 
     # Step 4: Generate professional voiceover
-    st.info("Step 4: Generating professional ad voiceover")
-    full_narration = " ".join(script_segments)
-    
     # Add voiceover direction based on tone
     voice_direction = {
         "Exciting & Energetic": "enthusiastic, high-energy",
@@ -168,25 +131,19 @@ Label each section as '1:', '2:', '3:', and '4:'."""
         "Luxury & Premium": "sophisticated, smooth",
         "Urgent & Action-Driven": "urgent, compelling"
     }.get(ad_tone, "professional")
-    
-    try:
-        voiceover_uri = run_replicate(
+
+    def generate_voiceover(script_segments):
+        full_narration = " ".join(script_segments)
+        return run_replicate_to_file(
             "minimax/speech-02-hd",
             {
                 "text": f"[{voice_direction} tone] {full_narration}",
                 "voice": "default"
             },
+            ".mp3",
         )
-        voice_path = download_to_file(voiceover_uri, suffix=".mp3")
-        st.audio(voice_path)
-        st.download_button("🎙 Download Ad Voiceover", voice_path, "ad_voiceover.mp3")
-    except Exception as e:
-        st.error(f"Failed to generate voiceover: {e}")
-        st.stop()
 
     # Step 5: Generate commercial background music
-    st.info("Step 5: Creating commercial background music")
-    
     music_styles = {
         "Exciting & Energetic": "upbeat electronic, driving beat, energetic",
         "Warm & Friendly": "acoustic, warm, feel-good melody",
@@ -197,20 +154,86 @@ Label each section as '1:', '2:', '3:', and '4:'."""
     }
     
     music_style = music_styles.get(ad_tone, "commercial, professional")
-    
-    try:
-        music_uri = run_replicate(
+
+    def generate_music():
+        return run_replicate_to_file(
             "google/lyria-2",
             {
                 "prompt": f"Commercial ad background music: {music_style}. 20-second instrumental track for {product_name} advertisement. Professional quality, suitable for TV commercial."
             },
+            ".mp3",
         )
-        music_path = download_to_file(music_uri, suffix=".mp3")
-        st.audio(music_path)
-        st.download_button("🎵 Download Ad Music", music_path, "ad_background_music.mp3")
-    except Exception as e:
-        st.error(f"Failed to generate background music: {e}")
-        st.stop()
+
+    # Music only needs the ad inputs; each segment starts on its script line, the voiceover on the whole script
+    graph = StageGraph(max_workers=6, tracer=tracer)
+    graph.add("music", generate_music)
+    add_script_stages(graph, write_script, 4, generate_segment)
+    graph.add("voiceover", generate_voiceover, deps=["script"])
+
+    waiting = sum(pool["waiting"] for pool in get_scheduler().stats().values())
+    if waiting:
+        st.caption(f"The server is busy: {waiting} generations and encodes are queued; this ad takes its fair share of turns")
+    st.info("Step 1: Writing compelling ad script")
+    st.info("Step 5: Creating commercial background music")
+
+    def on_stage_done(name, result, error):
+        if not error and isinstance(result, str):
+            # Report per-asset download throughput
+            stats = download_stats(result)
+            if stats:
+                st.caption(f"⬇️ {name}: {stats.describe()}")
+        if name == "script":
+            if error:
+                st.error(str(error))
+                st.stop()
+            st.success("Ad script written successfully")
+            st.write("**Generated Script:**")
+            for i, segment in enumerate(result):
+                st.write(f"**Segment {i+1}:** {segment}")
+
+            script_file_path = workspace.file(".txt", prefix="script")
+            with open(script_file_path, "w") as f:
+                f.write(f"Ad Script for: {product_name}\n")
+                f.write(f"Target: {target_audience}\n")
+                f.write(f"Tone: {ad_tone}\n\n")
+                f.write("\n\n".join([f"Segment {i+1}: {seg}" for i, seg in enumerate(result)]))
+            st.download_button("📜 Download Ad Script", script_file_path, "ad_script.txt")
+            st.info("Step 2: Generating commercial visuals for 4 segments")
+            st.info("Step 4: Generating professional ad voiceover")
+        elif name.startswith("segment_"):
+            i = int(name.split("_")[1])
+            if error:
+                st.error(f"Failed to generate segment {i} visuals: {error}")
+                st.stop()
+            st.video(result)
+            st.download_button(f"🎥 Download Segment {i}", result, f"ad_segment_{i}.mp4")
+        elif name == "voiceover":
+            if error:
+                st.error(f"Failed to generate voiceover: {error}")
+                st.stop()
+            st.audio(result)
+            st.download_button("🎙 Download Ad Voiceover", result, "ad_voiceover.mp3")
+        elif name == "music":
+            if error:
+                st.error(f"Failed to generate background music: {error}")
+                st.stop()
+            st.audio(result)
+            st.download_button("🎵 Download Ad Music", result, "ad_background_music.mp3")
+
+    try:
+        results, errors = graph.run(on_done=on_stage_done)
+    except BaseException:
+        # A failed stage's st.stop(), a rerun or an error abandoned the ad: stop the stages
+        # still running before the script ends, so none outlives the session's workspace
+        generator.abort()
+        graph.join()
+        raise
+    finally:
+        generator.cancel_all()
+    if generator.cache:
+        st.caption(generator.cache_summary())
+    voice_path = results["voiceover"]
+    music_path = results["music"]
 
     # Step 6: Create final commercial with improved audio/video sync
     st.info("Step 6: Assembling final commercial")
@@ -218,214 +241,68 @@ Label each section as '1:', '2:', '3:', and '4:'."""
     # Progress tracking
     progress_bar = st.progress(0)
     status_text = st.empty()
+    target_duration = 20.0
+    # Conformed segments from the pre-flight repair, removed with the workspace
+    preflight_dir = workspace.subdir("preflight")
     
     try:
-        # Step 6a: Concatenate video clips
-        status_text.text("Concatenating video segments...")
+        # Step 6a: Probe every asset up front and repair off-spec segments
+        status_text.text("Checking generated media...")
         progress_bar.progress(10)
-        
-        final_video = concatenate_videoclips(segment_clips, method="compose")
-        target_duration = 20.0
-        
-        status_text.text("Adjusting video duration...")
-        progress_bar.progress(20)
-        
-        if final_video.duration > target_duration:
-            final_video = final_video.subclip(0, target_duration)
-        elif final_video.duration < target_duration:
-            final_video = final_video.set_duration(target_duration)
-
-        # Step 6b: Load audio clips
-        status_text.text("Loading audio files...")
-        progress_bar.progress(30)
-        
-        voice_clip = AudioFileClip(voice_path)
-        music_clip = AudioFileClip(music_path)
-        
-        voice_duration = voice_clip.duration
-        music_duration = music_clip.duration
-        video_duration = final_video.duration
-        
-        st.write(f"Debug info - Video: {video_duration:.2f}s, Voice: {voice_duration:.2f}s, Music: {music_duration:.2f}s")
-        
-        # Step 6c: Sync audio durations with proper padding
-        status_text.text("Synchronizing audio durations...")
-        progress_bar.progress(40)
-        
-        from moviepy.audio.AudioClip import AudioArrayClip
-        import numpy as np
-        
-        # Handle voice clip duration
-        if voice_duration > video_duration:
-            voice_clip = voice_clip.subclip(0, video_duration)
-        elif voice_duration < video_duration:
-            # Create silence to pad the voice clip
-            silence_duration = video_duration - voice_duration
-            silence_array = np.zeros((int(silence_duration * 22050), 2))  # 22050 Hz stereo silence
-            silence_clip = AudioArrayClip(silence_array, fps=22050)
-            
-            # Concatenate voice with silence
-            from moviepy.audio.io.AudioFileClip import concatenate_audioclips
-            voice_clip = concatenate_audioclips([voice_clip, silence_clip])
-            
-        # Handle music clip duration  
-        if music_duration > video_duration:
-            music_clip = music_clip.subclip(0, video_duration)
-        elif music_duration < video_duration:
-            # Loop music to fill duration
-            loops_needed = int(video_duration / music_duration) + 1
-            music_clip = concatenate_audioclips([music_clip] * loops_needed)
-            music_clip = music_clip.subclip(0, video_duration)
-        
-        # Step 6d: Create composite audio with explicit duration control
+
+        segment_paths = [results[f"segment_{i+1}"] for i in range(4)]
+        # Short clips are looped from one decode, crossfading their end into their start
+        report = preflight(segment_paths, voice_path, music_path, 5, preflight_dir, tracer=tracer, loop_mode="crossfade")
+        st.caption(report.describe())
+
+        # Step 6b: Decode and mix the soundtrack in one vectorized pass
         status_text.text("Mixing audio tracks...")
-        progress_bar.progress(50)
-        
-        # Ensure exact durations before mixing
-        voice_clip = voice_clip.subclip(0, video_duration)
-        music_clip = music_clip.subclip(0, video_duration).volumex(0.25)
-        
-        final_audio = CompositeAudioClip([voice_clip, music_clip])
-        # Force exact duration with subclip instead of set_duration
-        final_audio = final_audio.subclip(0, video_duration)
-        
-        # Step 6e: Combine video and audio
-        status_text.text("Combining video and audio...")
-        progress_bar.progress(60)
-        
-        final_video = final_video.set_audio(final_audio)
-        
-        # Step 6f: Try multiple encoding approaches
-        output_path = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4").name
-        
-        # First try: Standard encoding
-        status_text.text("Encoding final video (attempt 1/3)...")
-        progress_bar.progress(70)
-        
-        try:
-            final_video.write_videofile(
-                output_path,
-                codec="libx264",
-                audio_codec="aac",
-                temp_audiofile="temp-audio.m4a",
-                remove_temp=True,
-                fps=24,
-                bitrate="2000k",
-                verbose=False,
-                logger=None,
-                preset='ultrafast'  # Faster encoding
+        progress_bar.progress(40)
+
+        # Voice starts at 0 and is padded with silence; music loops at 25% and ducks under the voice
+        with tracer.span("audio_mix") as span:
+            soundtrack = mix_tracks(
+                voice_path,
+                music_path,
+                target_duration,
+                music_gain=0.25,
+                music_fade=0,
+                voice_placement="start",
+                loop_cache=generator.cache,
             )
-            encoding_success = True
-        except Exception as encoding_error:
-            st.warning(f"Standard encoding failed: {str(encoding_error)[:100]}...")
-            encoding_success = False
-        
-        # Second try: Simpler encoding if first failed
-        if not encoding_success:
-            status_text.text("Encoding final video (attempt 2/3)...")
-            progress_bar.progress(80)
-            
-            try:
-                output_path2 = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4").name
-                final_video.write_videofile(
-                    output_path2,
-                    codec="libx264",
-                    audio_codec="aac",
-                    fps=24,
-                    verbose=False,
-                    logger=None,
-                    preset='ultrafast',
-                    threads=1  # Single thread to avoid conflicts
-                )
-                output_path = output_path2
-                encoding_success = True
-            except Exception as encoding_error2:
-                st.warning(f"Simplified encoding failed: {str(encoding_error2)[:100]}...")
-        
-        # Third try: Create audio file separately first (most robust)
-        if not encoding_success:
-            status_text.text("Encoding final video (attempt 3/3 - audio-first method)...")
-            progress_bar.progress(90)
-            
-            try:
-                # Step 1: Create the final audio file separately
-                temp_audio_path = tempfile.NamedTemporaryFile(delete=False, suffix=".wav").name
-                final_audio.write_audiofile(temp_audio_path, verbose=False, logger=None)
-                
-                # Step 2: Create video without audio
-                video_only = final_video.without_audio()
-                temp_video_path = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4").name
-                video_only.write_videofile(
-                    temp_video_path,
-                    codec="libx264",
-                    fps=24,
-                    verbose=False,
-                    logger=None,
-                    preset='ultrafast'
-                )
-                
-                # Step 3: Load the audio file and combine
-                final_audio_loaded = AudioFileClip(temp_audio_path)
-                temp_video_loaded = VideoFileClip(temp_video_path)
-                
-                # Ensure durations match exactly
-                final_audio_loaded = final_audio_loaded.subclip(0, temp_video_loaded.duration)
-                
-                final_combined = temp_video_loaded.set_audio(final_audio_loaded)
-                
-                output_path3 = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4").name
-                final_combined.write_videofile(
-                    output_path3,
-                    codec="libx264",
-                    audio_codec="aac",
-                    verbose=False,
-                    logger=None,
-                    preset='ultrafast'
-                )
-                
-                output_path = output_path3
-                encoding_success = True
-                
-                # Cleanup temp files
-                video_only.close()
-                temp_video_loaded.close()
-                final_audio_loaded.close()
-                final_combined.close()
-                os.remove(temp_audio_path)
-                os.remove(temp_video_path)
-                
-            except Exception as encoding_error3:
-                st.error(f"Audio-first encoding failed: {str(encoding_error3)[:200]}...")
-                encoding_success = False
+            span.bytes = soundtrack.samples.nbytes
+
+        st.write(f"Debug info - Video: {target_duration:.2f}s, Voice: {report.voice.duration:.2f}s, Music: {report.music.duration:.2f}s")
+
+        # Step 6c: Join the segments by stream copy and encode only the mixed audio, exactly once
+        status_text.text("Assembling final commercial...")
+        progress_bar.progress(70)
+
+        output_path = workspace.file(".mp4", prefix="final")
+        if assemble_video_fast(report.segments, soundtrack, target_duration, output_path, tracer=tracer) is None:
+            raise FFmpegError("Segments still differ after pre-flight repair")
 
         progress_bar.progress(100)
+        status_text.text("✅ Commercial assembly complete!")
+        st.success("🎬 Your 20-second commercial is ready!")
+        st.video(output_path)
         
-        if encoding_success:
-            status_text.text("✅ Commercial assembly complete!")
-            st.success("🎬 Your 20-second commercial is ready!")
-            st.video(output_path)
-            
-            # Summary of created ad
-            st.write("**Ad Summary:**")
-            st.write(f"**Product:** {product_name}")
-            st.write(f"**Target Audience:** {target_audience}")
-            st.write(f"**Tone:** {ad_tone}")
-            st.write(f"**Key Message:** {key_benefits}")
-            
-            st.download_button("📽 Download Final Commercial", output_path, f"{product_name.replace(' ', '_')}_ad.mp4")
-        else:
-            st.error("❌ Final video encoding failed after multiple attempts.")
-            st.info("💡 You can still download the individual components and combine them manually using video editing software.")
-
-        # Clean up clips to free memory
-        try:
-            final_video.close()
-            voice_clip.close()
-            music_clip.close()
-            for clip in segment_clips:
-                clip.close()
-        except:
-            pass  # Ignore cleanup errors
+        # Summary of created ad
+        st.write("**Ad Summary:**")
+        st.write(f"**Product:** {product_name}")
+        st.write(f"**Target Audience:** {target_audience}")
+        st.write(f"**Tone:** {ad_tone}")
+        st.write(f"**Key Message:** {key_benefits}")
+        
+        st.download_button("📽 Download Final Commercial", output_path, f"{product_name.replace(' ', '_')}_ad.mp4")
+
+    except PreflightError as e:
+        # Unusable inputs are reported before any encoding starts
+        status_text.text("❌ Generated media failed pre-flight checks")
+        progress_bar.progress(0)
+        for problem in e.problems:
+            st.error(problem)
+        st.info("💡 You can still download the individual components above and regenerate the broken ones.")
 
     except Exception as e:
         status_text.text("❌ Assembly failed")
@@ -448,12 +325,21 @@ Label each section as '1:', '2:', '3:', and '4:'."""
     progress_bar.empty()
     status_text.empty()
 
-    # Cleanup temporary files
-    for path in (*temp_video_paths, voice_path, music_path, script_file_path):
-        try:
-            os.remove(path)
-        except OSError:
-            pass
+    # Per-stage timings, exported as a JSON trace and a Prometheus textfile
+    trace_path, metrics_path = tracer.export()
+    with st.expander("⏱ Stage timings"):
+        st.dataframe(tracer.summary_rows(), use_container_width=True)
+        st.caption(f"Trace: {trace_path} · Metrics: {metrics_path}")
+        leak_report = leak_detector.check()
+        if leak_report.leaked:
+            st.warning(f"Possible leak: {leak_report.describe()}")
+        else:
+            st.caption(leak_report.describe())
+        st.download_button("Download Trace", open(trace_path).read(), f"{tracer.job_id}.trace.json", mime="application/json")
+
+    # Remove every temporary file of this ad at once
+    workspace.cleanup()
+    st.session_state.pop("active_workspace", None)
 
 # Add helpful tips section
 with st.expander("💡 Tips for Better Ads"):
@@ -0,0 +1,133 @@
+"""Scoped moviepy clip handles and a per-job leak detector.
+
+Every VideoFileClip/AudioFileClip keeps an ffmpeg reader subprocess and
+its frame buffers alive until ``close()``; in the long-lived Streamlit
+server, clips that are merely dropped pile up. ``ClipScope`` closes every
+clip it opened when the ``with`` block exits, including on exceptions
+and ``st.stop()``. ``LeakDetector`` compares ffmpeg children and RSS
+before and after a job and logs what was left behind. Both checks are
+process-wide, so concurrent jobs show up in each other's reports.
+"""
+import gc
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+
+from tracing import current_rss
+
+logger = logging.getLogger(__name__)
+
+RSS_GROWTH_WARN = int(os.environ.get("GPT_VOLCA_RSS_GROWTH_WARN_MB", 100)) * 1024 * 1024
+
+
+class ClipScope:
+    """Opens moviepy clips and closes all of them, newest first, when the scope ends."""
+
+    def __init__(self):
+        self._clips = []
+
+    def track(self, clip):
+        self._clips.append(clip)
+        return clip
+
+    def video(self, path, **kwargs):
+        from moviepy.editor import VideoFileClip
+        return self.track(VideoFileClip(path, **kwargs))
+
+    def audio(self, path, **kwargs):
+        from moviepy.editor import AudioFileClip
+        return self.track(AudioFileClip(path, **kwargs))
+
+    def close(self):
+        while self._clips:
+            clip = self._clips.pop()
+            try:
+                clip.close()
+            except Exception as e:
+                logger.warning("Failed to close %r: %s", clip, e)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def ffmpeg_children():
+    """Live (non-zombie) ffmpeg processes started by this process, as {pid: command line}."""
+    children = {}
+    me = os.getpid()
+    for entry in os.listdir("/proc") if os.path.isdir("/proc") else []:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; fields resume after the last ')'
+                state, ppid = f.read().rsplit(")", 1)[1].split()[:2]
+            if int(ppid) != me or state == "Z":
+                continue
+            with open(f"/proc/{entry}/cmdline", "rb") as f:
+                cmdline = f.read().replace(b"\0", b" ").decode(errors="replace").strip()
+        except (OSError, ValueError, IndexError):
+            continue  # Exited while we were looking
+        if "ffmpeg" in cmdline:
+            children[int(entry)] = cmdline
+    return children
+
+
+@dataclass
+class LeakReport:
+    label: str
+    rss_start: int
+    rss_end: int = 0
+    leaked_children: dict = field(default_factory=dict)
+    seconds: float = 0.0
+
+    @property
+    def rss_growth(self):
+        return self.rss_end - self.rss_start
+
+    @property
+    def leaked(self):
+        return bool(self.leaked_children) or self.rss_growth > RSS_GROWTH_WARN
+
+    def describe(self):
+        text = f"{self.label}: RSS {self.rss_start / 1e6:.0f} -> {self.rss_end / 1e6:.0f} MB ({self.rss_growth / 1e6:+.0f} MB)"
+        if self.leaked_children:
+            text += f", {len(self.leaked_children)} ffmpeg process(es) still open: " + ", ".join(str(pid) for pid in self.leaked_children)
+        return text
+
+
+class LeakDetector:
+    """Snapshot ffmpeg children and RSS now; ``check()`` reports what the job left behind.
+
+    Usable as a context manager, which checks on exit.
+    """
+
+    def __init__(self, label):
+        self.label = label
+        self._start = time.perf_counter()
+        self._children = set(ffmpeg_children())
+        self.report = LeakReport(label, current_rss())
+
+    def check(self):
+        # Collect unreachable clips first: their readers are closed by __del__, not leaked
+        gc.collect()
+        report = self.report
+        report.rss_end = current_rss()
+        report.leaked_children = {pid: cmd for pid, cmd in ffmpeg_children().items() if pid not in self._children}
+        report.seconds = time.perf_counter() - self._start
+        if report.leaked:
+            logger.warning("Possible leak after %s", report.describe())
+        else:
+            logger.debug(report.describe())
+        return report
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.check()
+        return False
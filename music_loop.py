@@ -0,0 +1,143 @@
+"""Seamless looping of a music bed that is shorter than the video.
+
+Tiling the decoded track restarts it audibly at every repeat. Instead the
+track is analysed once: the beat period comes from the autocorrelation of
+an onset envelope, the loop spans a whole number of bars starting on a
+strong onset, and its end is nudged to the sample offset whose waveform
+best matches the loop start. The bed is then rendered to the exact target
+length in one vectorized pass, with a linear crossfade over every seam.
+Loop points are cached per music file (by content hash) in the asset
+cache.
+"""
+import hashlib
+import json
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ENVELOPE_RATE = 100  # Onset envelope blocks per second
+MIN_BEAT, MAX_BEAT = 0.3, 1.5  # Beat periods considered, in seconds
+BEATS_PER_BAR = 4
+CROSSFADE = 0.25  # Seconds
+MATCH_WINDOW = 0.05  # Seconds of waveform compared when refining the loop end
+
+LOOP_POINTS_VERSION = 1
+
+
+def onset_envelope(x, sample_rate):
+    """Half-wave rectified change in block energy, one value per 1/ENVELOPE_RATE s."""
+    hop = max(1, sample_rate // ENVELOPE_RATE)
+    blocks = len(x) // hop
+    mono = x[:blocks * hop].mean(axis=1).reshape(blocks, hop)
+    energy = np.log1p(1000 * np.mean(mono ** 2, axis=1))
+    return np.maximum(0.0, np.diff(energy, prepend=energy[:1]))
+
+
+def beat_period(envelope):
+    """Most likely beat period in envelope blocks, or None if the track has no clear pulse."""
+    n = len(envelope)
+    lo, hi = int(MIN_BEAT * ENVELOPE_RATE), int(MAX_BEAT * ENVELOPE_RATE)
+    if n < 2 * hi:
+        return None
+    centered = envelope - envelope.mean()
+    spectrum = np.fft.rfft(centered, 2 * n)
+    ac = np.fft.irfft(spectrum * np.conj(spectrum))[:n]
+    if ac[0] <= 0:
+        return None
+    lag = lo + int(np.argmax(ac[lo:hi]))
+    # A weak peak means no steady beat to cut on
+    return lag if ac[lag] / ac[0] > 0.1 else None
+
+
+def _refine_end(mono, start, end, search, window):
+    # Slide the end over +-search samples; keep the offset whose waveform best matches the start
+    lo, hi = max(start + window, end - search), min(len(mono) - window, end + search)
+    if hi <= lo:
+        return end
+    ref = mono[start:start + window]
+    candidates = np.lib.stride_tricks.sliding_window_view(mono[lo:hi + window], window)[:hi - lo]
+    # Normalizing by the louder window's energy penalizes level mismatches as well as phase
+    energy = np.maximum(np.einsum("ij,ij->i", candidates, candidates), ref @ ref) + 1e-12
+    return lo + int(np.argmax(candidates @ ref / energy))
+
+
+def find_loop_points(x, sample_rate, crossfade=CROSSFADE):
+    """Return (start, end) sample frames of a loop inside ``x`` that leaves room for the crossfade tail."""
+    fade = int(crossfade * sample_rate)
+    usable = len(x) - fade
+    if usable <= fade:
+        return 0, len(x)
+    envelope = onset_envelope(x, sample_rate)
+    hop = max(1, sample_rate // ENVELOPE_RATE)
+    period = beat_period(envelope)
+    if period is None:
+        return 0, usable
+    bar = period * BEATS_PER_BAR
+    # Start on the strongest onset of the first bar, loop over as many whole bars as fit
+    start_block = int(np.argmax(envelope[:bar])) if len(envelope) > bar else 0
+    bars = (usable // hop - start_block) // bar
+    if bars < 1:
+        return 0, usable
+    start = start_block * hop
+    end = min(usable, (start_block + bars * bar) * hop)
+    mono = x.mean(axis=1)
+    end = _refine_end(mono, start, end, search=period * hop // 4, window=int(MATCH_WINDOW * sample_rate))
+    return start, min(end, usable)
+
+
+def render_loop(x, frames, start, end, sample_rate, crossfade=CROSSFADE):
+    """Play ``x`` up to ``end``, then repeat ``x[start:end]`` until ``frames``; seams are crossfaded."""
+    if frames <= len(x):
+        return x[:frames]
+    n = np.arange(frames)
+    length = end - start
+    k = np.maximum(n - end, 0) % length  # Offset into the loop body after the first pass
+    looped = n >= end
+    out = x[np.where(looped, start + k, np.minimum(n, len(x) - 1))].astype(np.float32)
+    fade = min(int(crossfade * sample_rate), length, len(x) - end)
+    if fade > 0:
+        # Over the first ``fade`` frames of each repeat, fade out the natural continuation past ``end``
+        seam = looped & (k < fade)
+        t = (k[seam] + 0.5) / fade
+        tail = x[end + k[seam]]
+        # Equal gain, not equal power: the loop end was chosen to match the start, so the two
+        # sides are correlated and an equal-power fade would swell by ~3 dB at every seam
+        out[seam] = out[seam] * t[:, None] + tail * (1 - t)[:, None]
+    return out
+
+
+def _file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def loop_points(path, x, sample_rate, cache=None):
+    """Loop points for the music file at ``path`` (decoded as ``x``), from ``cache`` when known."""
+    key = None
+    if cache is not None:
+        from asset_cache import cache_key
+        key = cache_key("music-loop", {"sha256": _file_digest(path), "rate": sample_rate}, f"v{LOOP_POINTS_VERSION}")
+        cached = cache.get_text(key)
+        if cached:
+            points = json.loads(cached)
+            return points["start"], points["end"]
+    start, end = find_loop_points(x, sample_rate)
+    logger.info("Music loop for %s: %.2fs-%.2fs of %.2fs", path, start / sample_rate, end / sample_rate, len(x) / sample_rate)
+    if key is not None:
+        cache.put_text(key, json.dumps({"start": int(start), "end": int(end)}), "music-loop")
+    return start, end
+
+
+def loop_to_length(path, x, frames, sample_rate, cache=None):
+    """Extend the decoded music ``x`` to exactly ``frames`` frames with a seamless loop."""
+    if len(x) >= frames:
+        return x[:frames]
+    if len(x) == 0:
+        return np.zeros((frames, x.shape[1]), dtype=np.float32)
+    start, end = loop_points(path, x, sample_rate, cache)
+    return render_loop(x, frames, start, end, sample_rate)
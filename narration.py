@@ -0,0 +1,87 @@
+"""Per-segment narration aligned to each segment's time slot.
+
+Each script line is voiced by its own short TTS call, all in parallel.
+This module renders the clips into one voice track: every clip is
+trimmed of leading/trailing silence and placed at the start of its
+segment's window after a short lead-in. A clip that runs long is sped up
+by a vectorized linear resampler, by at most MAX_STRETCH; whatever still
+doesn't fit is faded out at the window's end. Narration therefore stays
+with its visuals by construction.
+"""
+import logging
+
+import numpy as np
+
+from audio_engine import MIX_RATE, Track, decode_audio
+
+logger = logging.getLogger(__name__)
+
+LEAD_IN = 0.15  # Seconds of silence before each line
+MAX_STRETCH = 1.2  # Fastest speed-up before a line is cut instead
+TAIL_FADE = 0.08  # Seconds of fade-out on a line that is cut
+SILENCE_DB = -45.0
+BLOCK_SECONDS = 0.01
+
+
+def trim_silence(x, sample_rate, threshold_db=SILENCE_DB):
+    """Drop leading and trailing blocks quieter than ``threshold_db``."""
+    hop = max(1, int(sample_rate * BLOCK_SECONDS))
+    blocks = len(x) // hop
+    if blocks == 0:
+        return x
+    mono = x[:blocks * hop].mean(axis=1).reshape(blocks, hop)
+    level_db = 10 * np.log10(np.mean(mono ** 2, axis=1) + 1e-12)
+    loud = np.flatnonzero(level_db > threshold_db)
+    if len(loud) == 0:
+        return x[:0]
+    return x[loud[0] * hop:min(len(x), (loud[-1] + 1) * hop)]
+
+
+def time_stretch(x, frames):
+    """Linearly resample ``x`` to exactly ``frames`` frames (all channels at once)."""
+    if frames <= 0 or len(x) == 0:
+        return np.zeros((max(frames, 0), x.shape[1]), dtype=np.float32)
+    if len(x) == 1:
+        return np.repeat(x, frames, axis=0)
+    pos = np.linspace(0, len(x) - 1, frames, dtype=np.float64)
+    i0 = np.floor(pos).astype(np.int64)
+    i1 = np.minimum(i0 + 1, len(x) - 1)
+    frac = (pos - i0).astype(np.float32)[:, None]
+    return (x[i0] * (1 - frac) + x[i1] * frac).astype(np.float32)
+
+
+def fit_window(clip, frames, sample_rate, lead_in=LEAD_IN, max_stretch=MAX_STRETCH):
+    """Place ``clip`` in a window of ``frames`` frames; returns (window, stretch factor)."""
+    window = np.zeros((frames, clip.shape[1]), dtype=np.float32)
+    lead = min(int(lead_in * sample_rate), frames // 4)
+    room = frames - lead
+    factor = 1.0
+    if len(clip) > room:
+        factor = min(len(clip) / room, max_stretch)
+        clip = time_stretch(clip, int(len(clip) / factor))
+        if len(clip) > room:
+            clip = clip[:room].copy()
+            fade = min(int(TAIL_FADE * sample_rate), room)
+            clip[room - fade:] *= np.linspace(1.0, 0.0, fade, dtype=np.float32)[:, None]
+    window[lead:lead + len(clip)] = clip
+    return window, factor
+
+
+def align_voice(paths, slot_seconds, sample_rate=MIX_RATE):
+    """Render one voice clip per slot into a single Track of ``len(paths) * slot_seconds``.
+
+    A None path leaves its slot silent.
+    """
+    frames = int(round(slot_seconds * sample_rate))
+    windows = []
+    for n, path in enumerate(paths, 1):
+        if path is None:
+            windows.append(np.zeros((frames, 2), dtype=np.float32))
+            continue
+        clip = trim_silence(decode_audio(path, sample_rate), sample_rate)
+        window, factor = fit_window(clip, frames, sample_rate)
+        spoken = len(clip) / sample_rate
+        if factor > 1.0:
+            logger.info("Narration for segment %d runs %.2fs; sped up %.0f%% to fit its %gs slot", n, spoken, (factor - 1) * 100, slot_seconds)
+        windows.append(window)
+    return Track(np.concatenate(windows) if windows else np.zeros((0, 2), dtype=np.float32), sample_rate)
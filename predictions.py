@@ -0,0 +1,245 @@
+"""Non-blocking Replicate predictions with backoff polling and cancellation.
+
+Instead of ``client.run`` (which blocks a thread per prediction), the
+manager creates predictions and hands back futures. A single poller thread
+reloads every in-flight prediction with exponential backoff; an optional
+local webhook receiver short-circuits the wait when Replicate can reach us.
+Predictions are tagged with an owner (e.g. a Streamlit session) so
+everything a session started can be cancelled when it reruns or stops.
+"""
+import json
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from rate_limits import error_status, retry_after
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("succeeded", "failed", "canceled")
+
+
+class PredictionFailed(Exception):
+    pass
+
+
+class PredictionCanceled(Exception):
+    pass
+
+
+class _Tracked:
+    def __init__(self, prediction, owner, interval):
+        self.prediction = prediction
+        self.owner = owner
+        self.future = Future()
+        self.interval = interval
+        self.next_poll = time.monotonic() + interval
+        self.created = time.monotonic()
+
+
+class PredictionManager:
+    def __init__(self, client, poll_initial=0.5, poll_max=8.0, backoff=1.5, webhook_url=None, rate_limiter=None):
+        self.client = client
+        # Optional rate_limits.RateLimiter; holds a model slot from creation until the prediction settles
+        self.rate_limiter = rate_limiter
+        self.poll_initial = poll_initial
+        self.poll_max = poll_max
+        self.backoff = backoff
+        self.webhook_url = webhook_url
+        self._tracked = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self._poller = threading.Thread(target=self._poll_loop, name="replicate-poller", daemon=True)
+        self._poller.start()
+
+    def submit(self, model_path, input_data, owner=None):
+        """Create a prediction and return a Future for its output."""
+        return self._create(model_path, input_data, owner).future
+
+    def _create(self, model_path, input_data, owner):
+        params = {}
+        if self.webhook_url:
+            params = {"webhook": self.webhook_url, "webhook_events_filter": ["completed"]}
+        def create():
+            if ":" in model_path:
+                # Pinned "owner/name:version" reference
+                return self.client.predictions.create(version=model_path.split(":", 1)[1], input=input_data, **params)
+            return self.client.models.predictions.create(model=model_path, input=input_data, **params)
+
+        if self.rate_limiter is None:
+            prediction, limit = create(), None
+        else:
+            prediction, limit = self.rate_limiter.call(model_path, create)
+
+        tracked = _Tracked(prediction, owner, self.poll_initial)
+        if limit is not None:
+            tracked.future.add_done_callback(lambda future: limit.release(_outcome(future)))
+        # Lets callers cancel a single prediction by its future
+        tracked.future.prediction_id = prediction.id
+        with self._cond:
+            self._tracked[prediction.id] = tracked
+            self._cond.notify()
+        logger.debug("Created prediction %s for %s", prediction.id, model_path)
+        return tracked
+
+    def stream(self, model_path, input_data, owner=None):
+        """Create a prediction and yield its text output as the model produces it.
+
+        Models without a stream URL yield their whole output once it is
+        ready. The prediction is tracked like any other, so ``cancel_all``
+        ends the stream; closing the generator early cancels it.
+        """
+        tracked = self._create(model_path, input_data, owner)
+        prediction = tracked.prediction
+        finished = False
+        try:
+            if not (prediction.urls or {}).get("stream"):
+                output = tracked.future.result()
+                yield "".join(str(t) for t in output) if isinstance(output, list) else str(output)
+                finished = True
+                return
+            for event in prediction.stream():
+                kind = event.event.value
+                if kind == "output":
+                    yield event.data
+                elif kind == "error":
+                    raise PredictionFailed(f"Prediction {prediction.id} failed: {event.data}")
+                elif kind == "done":
+                    if "cancel" in event.data:
+                        raise PredictionCanceled(f"Prediction {prediction.id} was cancelled")
+                    break
+            if tracked.future.done() and tracked.future.exception():
+                # Cancelled locally while streaming
+                raise tracked.future.exception()
+            finished = True
+        finally:
+            if not finished:
+                self.cancel([prediction.id])
+
+    def run(self, model_path, input_data, owner=None, timeout=None):
+        """Blocking convenience wrapper: submit and wait for the output."""
+        return self.submit(model_path, input_data, owner=owner).result(timeout=timeout)
+
+    def in_flight(self, owner=None):
+        with self._cond:
+            return [pid for pid, t in self._tracked.items() if owner is None or t.owner == owner]
+
+    def cancel(self, prediction_ids):
+        for pid in prediction_ids:
+            with self._cond:
+                tracked = self._tracked.pop(pid, None)
+            if tracked is None:
+                continue
+            try:
+                tracked.prediction.cancel()
+            except Exception as e:
+                logger.warning("Failed to cancel prediction %s: %s", pid, e)
+            if not tracked.future.done():
+                tracked.future.set_exception(PredictionCanceled(f"Prediction {pid} was cancelled"))
+            logger.info("Cancelled prediction %s", pid)
+
+    def cancel_all(self, owner=None):
+        """Cancel every in-flight prediction (of ``owner``, if given); returns how many."""
+        ids = self.in_flight(owner)
+        self.cancel(ids)
+        return len(ids)
+
+    def notify_update(self, prediction_id):
+        # Called by the webhook receiver: poll this prediction right away
+        with self._cond:
+            tracked = self._tracked.get(prediction_id)
+            if tracked:
+                tracked.next_poll = 0
+                self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    def _poll_loop(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    now = time.monotonic()
+                    due = [t for t in self._tracked.values() if t.next_poll <= now]
+                    if due:
+                        break
+                    wake = min((t.next_poll for t in self._tracked.values()), default=None)
+                    self._cond.wait(None if wake is None else wake - now)
+                if self._closed:
+                    return
+            for tracked in due:
+                self._poll(tracked)
+
+    def _poll(self, tracked):
+        prediction = tracked.prediction
+        try:
+            prediction.reload()
+        except Exception as e:
+            # Transient API hiccup: keep backing off and try again
+            logger.warning("Polling prediction %s failed: %s", prediction.id, e)
+            if error_status(e) == 429:
+                # Don't poll again before the server says we may
+                with self._cond:
+                    tracked.interval = max(tracked.interval, min(retry_after(e) or self.poll_max, self.poll_max))
+        if prediction.status not in TERMINAL_STATUSES:
+            with self._cond:
+                tracked.interval = min(tracked.interval * self.backoff, self.poll_max)
+                tracked.next_poll = time.monotonic() + tracked.interval
+            return
+
+        with self._cond:
+            if self._tracked.pop(prediction.id, None) is None:
+                return  # Already cancelled
+        if prediction.status == "succeeded":
+            tracked.future.set_result(prediction.output)
+        elif prediction.status == "canceled":
+            tracked.future.set_exception(PredictionCanceled(f"Prediction {prediction.id} was cancelled"))
+        else:
+            tracked.future.set_exception(PredictionFailed(f"Prediction {prediction.id} failed: {prediction.error}"))
+
+
+def _outcome(future):
+    # Only successes grow a model's window; failures and cancels say nothing about rate limits
+    return "success" if not future.cancelled() and future.exception() is None else "neutral"
+
+
+class WebhookReceiver:
+    """Tiny local HTTP endpoint for Replicate's ``completed`` webhooks.
+
+    ``public_url`` is what Replicate should call (e.g. a tunnel to
+    ``host:port``); pass it to PredictionManager as ``webhook_url``.
+    """
+
+    def __init__(self, host="0.0.0.0", port=8765):
+        self.managers = []
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    payload = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    payload = {}
+                if payload.get("id"):
+                    for manager in receiver.managers:
+                        manager.notify_update(payload["id"])
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, name="replicate-webhooks", daemon=True).start()
+
+    def attach(self, manager):
+        self.managers.append(manager)
+
+    def detach(self, manager):
+        if manager in self.managers:
+            self.managers.remove(manager)
@@ -0,0 +1,160 @@
+"""Pre-flight validation and repair of generated media before the final assembly.
+
+Every segment, the voiceover and the music are probed up front (in
+parallel, no decoding). Unusable files fail the job immediately with every
+problem listed. Segments that are merely off-spec (a different size, frame
+rate, pixel format or set of H.264 parameters, or too short) are repaired
+by conforming to the majority format, so the final assembly is a single
+stream-copy join plus one audio encode. A stream-copy join needs identical
+parameter sets, so once any segment is repaired, every segment is
+re-encoded with the same profile. Audio sample rates and channel layouts need no repair:
+audio_engine resamples every track while decoding it for the mix.
+"""
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional
+
+import ffmpeg_tools
+from assembler import conform_segment
+from encoder_planner import get_planner
+from tracing import NULL_TRACER
+
+
+class PreflightError(Exception):
+    """The generated media can't be assembled; ``problems`` lists every reason."""
+
+    def __init__(self, problems):
+        super().__init__("; ".join(problems))
+        self.problems = problems
+
+
+@dataclass
+class PreflightReport:
+    segments: list  # Paths that can be joined by stream copy, in order
+    infos: list  # MediaInfo of each original segment
+    voice: Optional[ffmpeg_tools.MediaInfo] = None
+    music: Optional[ffmpeg_tools.MediaInfo] = None
+    repaired: dict = field(default_factory=dict)  # Segment number -> what was wrong (or that it was re-encoded to match)
+    seconds: float = 0.0
+
+    def describe(self):
+        ref = self.infos[0] if self.infos else None
+        text = f"Pre-flight: {len(self.segments)} segments"
+        if ref:
+            text += f" at {ref.width}x{ref.height} {ref.fps:g} fps"
+        if self.repaired:
+            text += ", repaired " + ", ".join(f"#{n} ({reason})" for n, reason in sorted(self.repaired.items()))
+        for label, info in (("voice", self.voice), ("music", self.music)):
+            if info:
+                text += f"; {label} {info.duration:.1f}s {info.sample_rate} Hz {info.channels}ch"
+        return text + f" in {self.seconds * 1000:.0f} ms"
+
+
+def _probe(path):
+    if not path or not os.path.exists(path):
+        return None, "file is missing"
+    try:
+        return ffmpeg_tools.probe(path), None
+    except ffmpeg_tools.FFmpegError as e:
+        return None, str(e)
+
+
+def _signature(info):
+    return (info.video_codec, info.width, info.height, round(info.fps, 2), info.pix_fmt)
+
+
+def _mismatch(info, ref, segment_seconds, sets=None, ref_sets=None):
+    # Why a segment can't be stream-copied next to the reference, or None
+    reasons = []
+    if sets is None or sets != ref_sets:
+        reasons.append("different encoder settings")
+    if (info.width, info.height) != (ref.width, ref.height):
+        reasons.append(f"{info.width}x{info.height}")
+    if abs(info.fps - ref.fps) > 0.01:
+        reasons.append(f"{info.fps:g} fps")
+    if (info.video_codec, info.pix_fmt) != (ref.video_codec, ref.pix_fmt):
+        reasons.append(f"{info.video_codec}/{info.pix_fmt}")
+    if info.duration + 0.05 < segment_seconds:
+        reasons.append(f"{info.duration:.1f}s long")
+    return ", ".join(reasons) or None
+
+
+def preflight(segment_paths, voice_path, music_path, segment_seconds, work_dir, fps=24, tracer=None, loop_mode=None):
+    """Validate and repair the job's media; returns a PreflightReport or raises PreflightError.
+
+    ``voice_path`` and ``music_path`` may be None when the job has no such
+    track. Conformed segments are written to ``work_dir``; short ones are
+    looped with ``loop_mode`` (see video_loop) when it is given.
+    """
+    tracer = tracer or NULL_TRACER
+    start = time.perf_counter()
+    with tracer.span("preflight_probe", files=len(segment_paths) + 2):
+        paths = list(segment_paths) + [voice_path, music_path]
+        with ThreadPoolExecutor(max_workers=len(paths)) as pool:
+            probed = list(pool.map(_probe, paths))
+
+    problems = []
+    infos = []
+    for n, (info, error) in enumerate(probed[:len(segment_paths)], 1):
+        if error:
+            problems.append(f"Segment {n}: {error}")
+        elif not info.has_video:
+            problems.append(f"Segment {n}: no video stream")
+        elif info.duration <= 0 or not info.width:
+            problems.append(f"Segment {n}: empty or unreadable video")
+        infos.append(info)
+    audio = {}
+    for label, path, (info, error) in (("Voiceover", voice_path, probed[-2]), ("Music", music_path, probed[-1])):
+        if path is None:
+            continue
+        if error:
+            problems.append(f"{label}: {error}")
+        elif not info.has_audio:
+            problems.append(f"{label}: no audio stream")
+        elif info.duration <= 0:
+            problems.append(f"{label}: empty audio")
+        audio[label] = info
+    if problems:
+        raise PreflightError(problems)
+
+    with tracer.span("preflight_parameter_sets", segments=len(segment_paths)):
+        with ThreadPoolExecutor(max_workers=len(segment_paths)) as pool:
+            sets = list(pool.map(ffmpeg_tools.parameter_sets, segment_paths))
+
+    # Conform to the format most segments already share, so the fewest need re-encoding
+    common = Counter(_signature(info) for info in infos).most_common(1)[0][0]
+    reference = next(n for n, info in enumerate(infos) if _signature(info) == common)
+    ref, ref_sets = infos[reference], sets[reference]
+    repaired = {}
+    for n, (info, segment_sets) in enumerate(zip(infos, sets), 1):
+        reason = _mismatch(info, ref, segment_seconds, segment_sets, ref_sets)
+        if reason:
+            repaired[n] = reason
+    if not repaired:
+        ready = list(segment_paths)
+    else:
+        planner = get_planner()
+        frames = int(segment_seconds * (ref.fps or fps))
+        # Each segment gets its share of the encode deadline
+        profile = planner.plan(frames, ref.width, ref.height, deadline=planner.deadline / len(segment_paths))
+        ready = []
+        for n, (path, info) in enumerate(zip(segment_paths, infos), 1):
+            reason = repaired.setdefault(n, "re-encoded to match")
+            with tracer.span("preflight_conform", segment=n, reason=reason) as span:
+                short = info.duration + 0.05 < segment_seconds
+                out = conform_segment(path, ref, segment_seconds, os.path.join(work_dir, f"conformed_{n:02d}.mp4"), fps=fps,
+                                      loop_mode=loop_mode if short else None, profile=profile)
+                span.bytes = os.path.getsize(out)
+            ready.append(out)
+
+    return PreflightReport(
+        segments=ready,
+        infos=infos,
+        voice=audio.get("Voiceover"),
+        music=audio.get("Music"),
+        repaired=repaired,
+        seconds=time.perf_counter() - start,
+    )
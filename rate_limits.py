@@ -0,0 +1,215 @@
+"""Client-side rate limiting for Replicate predictions, per model path.
+
+Every session and batch job in the process shares one account, so bursts
+of predictions run into 429s. Each model gets a token bucket for
+prediction creation and an AIMD concurrency window for in-flight
+predictions: the window grows by about one slot per window of successes
+and halves on a 429 or 5xx. A throttled model pauses its bucket for the
+server's Retry-After before anyone else creates a prediction for it.
+
+Defaults come from GPT_VOLCA_PREDICTION_RATE (creations per second per
+model), GPT_VOLCA_MODEL_CONCURRENCY (starting window) and
+GPT_VOLCA_MODEL_CONCURRENCY_MAX.
+"""
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RATE = float(os.environ.get("GPT_VOLCA_PREDICTION_RATE", 5))
+DEFAULT_CONCURRENCY = float(os.environ.get("GPT_VOLCA_MODEL_CONCURRENCY", 8))
+MAX_CONCURRENCY = float(os.environ.get("GPT_VOLCA_MODEL_CONCURRENCY_MAX", 32))
+
+# (creations per second, starting window) where a model needs less than the defaults
+MODEL_LIMITS = {
+    "luma/ray-flash-2-540p": (2, 6),
+}
+
+MAX_RETRIES = 5
+BACKOFF_INITIAL = 1.0  # Seconds, when the server gives no Retry-After
+BACKOFF_MAX = 30.0
+DECREASE_COOLDOWN = 1.0  # One burst of 429s halves the window once
+
+# Replicate reports throttling as "Request was throttled. Expected available in 2 seconds."
+_AVAILABLE_IN = re.compile(r"available in (\d+(?:\.\d+)?) second", re.IGNORECASE)
+
+
+def error_status(error):
+    """HTTP status of an API error (ReplicateError or httpx), or None."""
+    status = getattr(error, "status", None)
+    if status is None:
+        response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None)
+    try:
+        return int(status) if status is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after(error):
+    """Seconds the server asked us to wait, from the Retry-After header or the error detail."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+    match = _AVAILABLE_IN.search(str(getattr(error, "detail", None) or error))
+    return float(match.group(1)) if match else None
+
+
+def is_throttle(status):
+    return status == 429 or (status is not None and 500 <= status < 600)
+
+
+class ModelLimit:
+    """Token bucket plus AIMD concurrency window for one model."""
+
+    def __init__(self, model_path, rate, concurrency, max_concurrency=MAX_CONCURRENCY):
+        self.model_path = model_path
+        self.rate = rate
+        self.burst = max(1.0, rate)
+        self.limit = concurrency
+        self.max_concurrency = max_concurrency
+        self.tokens = self.burst
+        self.in_flight = 0
+        self.waiting = 0
+        self.paused_until = 0.0
+        self.throttled = 0
+        self.completed = 0
+        self._updated = time.monotonic()
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout=None):
+        """Block until a token and a concurrency slot are free; returns the seconds waited."""
+        start = time.monotonic()
+        with self._cond:
+            self.waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if now >= self.paused_until and self.tokens >= 1 and self.in_flight < int(self.limit):
+                        self.tokens -= 1
+                        self.in_flight += 1
+                        return now - start
+                    if timeout is not None and now - start >= timeout:
+                        raise TimeoutError(f"Timed out waiting for a {self.model_path} prediction slot")
+                    # Wake for the next token or the end of a pause; a freed slot notifies
+                    if now < self.paused_until:
+                        wake = self.paused_until - now
+                    elif self.tokens < 1:
+                        wake = (1 - self.tokens) / self.rate
+                    else:
+                        wake = None
+                    if timeout is not None:
+                        wake = min(wake if wake is not None else timeout, start + timeout - now)
+                    self._cond.wait(wake)
+            finally:
+                self.waiting -= 1
+
+    def release(self, outcome="neutral", pause=None):
+        """Free a slot. ``outcome`` is "success", "throttled" or "neutral" (model errors, cancels)."""
+        with self._cond:
+            self.in_flight = max(0, self.in_flight - 1)
+            now = time.monotonic()
+            if outcome == "success":
+                self.completed += 1
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            elif outcome == "throttled":
+                self.throttled += 1
+                if now - self._last_decrease >= DECREASE_COOLDOWN:
+                    self.limit = max(1.0, self.limit / 2)
+                    self._last_decrease = now
+                if pause:
+                    self.paused_until = max(self.paused_until, now + pause)
+                logger.info("%s throttled; window %.1f, paused %.1fs", self.model_path, self.limit, pause or 0)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "throttled": self.throttled,
+                "completed": self.completed,
+            }
+
+
+class RateLimiter:
+    """Per-model limits shared by every generator in the process."""
+
+    def __init__(self, rate=DEFAULT_RATE, concurrency=DEFAULT_CONCURRENCY, model_limits=None):
+        self.rate = rate
+        self.concurrency = concurrency
+        self.model_limits = MODEL_LIMITS if model_limits is None else model_limits
+        self._limits = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_path):
+        # Pinned "owner/name:version" references share the model's limit
+        model = model_path.split(":", 1)[0]
+        with self._lock:
+            if model not in self._limits:
+                rate, concurrency = self.model_limits.get(model, (self.rate, self.concurrency))
+                self._limits[model] = ModelLimit(model, rate, concurrency)
+            return self._limits[model]
+
+    def call(self, model_path, fn):
+        """Run ``fn()`` (one API request) inside a slot, retrying 429/5xx with backoff.
+
+        Returns ``(result, limit)``; the caller releases the slot on the
+        returned limit when the prediction settles.
+        """
+        limit = self.get(model_path)
+        backoff = BACKOFF_INITIAL
+        for attempt in range(MAX_RETRIES + 1):
+            limit.acquire()
+            try:
+                return fn(), limit
+            except Exception as e:
+                status = error_status(e)
+                if not is_throttle(status) or attempt == MAX_RETRIES:
+                    limit.release()
+                    raise
+                wait = retry_after(e)
+                limit.release("throttled", wait if wait is not None else backoff)
+                logger.info("Creating a %s prediction got HTTP %s; retry %d/%d", model_path, status, attempt + 1, MAX_RETRIES)
+                backoff = min(backoff * 2, BACKOFF_MAX)
+
+    def stats(self):
+        with self._lock:
+            limits = dict(self._limits)
+        return {model: limit.stats() for model, limit in limits.items()}
+
+    def describe(self):
+        stats = self.stats()
+        if not stats:
+            return None
+        return "Rate limits: " + ", ".join(
+            f"{model} {s['in_flight']}/{s['limit']:.0f} in flight, {s['waiting']} queued, {s['throttled']} throttled"
+            for model, s in sorted(stats.items())
+        )
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter()
+        return _limiter
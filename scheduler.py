@@ -0,0 +1,206 @@
+"""Process-wide fair scheduler for remote predictions and local encodes.
+
+Every Streamlit session (and every background job) shares two pools: a
+``remote`` pool of in-flight Replicate predictions and an ``encode`` pool
+of x264 encodes, which each use every core. When a pool is full, waiters
+are served fair-share: the session holding the fewest slots goes next,
+then the one served longest ago, so one user's 20-second video can't
+starve everyone else's.
+
+The session is taken from context: ``with session(owner):`` marks the
+work below it, and StageGraph carries the context into its stage threads.
+Pool sizes come from GPT_VOLCA_REMOTE_SLOTS and GPT_VOLCA_ENCODE_SLOTS.
+"""
+import contextvars
+import itertools
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+REMOTE_SLOTS = int(os.environ.get("GPT_VOLCA_REMOTE_SLOTS", 16))
+ENCODE_SLOTS = int(os.environ.get("GPT_VOLCA_ENCODE_SLOTS", 2))
+
+DEFAULT_SESSION = "default"
+
+_session = contextvars.ContextVar("gpt_volca_session", default=DEFAULT_SESSION)
+
+
+def current_session():
+    return _session.get()
+
+
+@contextmanager
+def session(owner):
+    """Attribute the scheduled work in this block (and stages it starts) to ``owner``."""
+    token = _session.set(owner or DEFAULT_SESSION)
+    try:
+        yield
+    finally:
+        _session.reset(token)
+
+
+def set_session(owner):
+    """Attribute the rest of this context's work to ``owner``, e.g. for a whole Streamlit script run."""
+    _session.set(owner or DEFAULT_SESSION)
+
+
+class _Waiter:
+    __slots__ = ("ticket", "session")
+
+    def __init__(self, ticket, session):
+        self.ticket = ticket
+        self.session = session
+
+
+class SlotPool:
+    """A counting semaphore with fair-share queuing across sessions.
+
+    Usable wherever a ``threading.BoundedSemaphore`` is, e.g. as a
+    Generator's ``limiter``; acquire and release must happen in the same
+    session.
+    """
+
+    def __init__(self, name, slots):
+        self.name = name
+        self.slots = slots
+        self.in_use = 0
+        self.active = Counter()  # session -> slots held
+        self.granted = 0
+        self.waited = 0.0
+        self._last_grant = {}  # session -> grant number of its latest slot
+        self._waiters = []
+        self._tickets = itertools.count()
+        self._cond = threading.Condition()
+
+    def _order(self):
+        # Round-robin across sessions: a session's k-th waiter queues behind everyone's first,
+        # and among equals the session served longest ago goes first
+        seen = Counter()
+        keyed = []
+        for waiter in self._waiters:
+            share = self.active[waiter.session] + seen[waiter.session]
+            keyed.append((share, self._last_grant.get(waiter.session, -1), waiter.ticket, waiter))
+            seen[waiter.session] += 1
+        return [waiter for *_, waiter in sorted(keyed, key=lambda k: k[:3])]
+
+    def _grant(self, owner):
+        self.in_use += 1
+        self.active[owner] += 1
+        self.granted += 1
+        self._last_grant[owner] = self.granted
+        if len(self._last_grant) > 1024:
+            # Forget sessions that hold and wait for nothing
+            busy = set(self.active) | {waiter.session for waiter in self._waiters}
+            self._last_grant = {s: n for s, n in self._last_grant.items() if s in busy}
+
+    def acquire(self, blocking=True, timeout=None):
+        owner = current_session()
+        with self._cond:
+            if self.in_use < self.slots and not self._waiters:
+                self._grant(owner)
+                return True
+            if not blocking:
+                return False
+            waiter = _Waiter(next(self._tickets), owner)
+            self._waiters.append(waiter)
+            start = time.monotonic()
+            try:
+                while not (self.in_use < self.slots and self._order()[0] is waiter):
+                    remaining = None if timeout is None else timeout - (time.monotonic() - start)
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                self._grant(owner)
+                self.waited += time.monotonic() - start
+                return True
+            finally:
+                self._waiters.remove(waiter)
+                # The next waiter in line may be runnable now
+                self._cond.notify_all()
+
+    def release(self):
+        owner = current_session()
+        with self._cond:
+            if self.active[owner] <= 0:
+                raise ValueError(f"Session '{owner}' releases a '{self.name}' slot it doesn't hold")
+            self.in_use -= 1
+            self.active[owner] -= 1
+            if not self.active[owner]:
+                del self.active[owner]
+            self._cond.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def position(self, owner):
+        """1-based place of ``owner``'s next waiter in line, or None if it isn't waiting."""
+        with self._cond:
+            for i, waiter in enumerate(self._order(), 1):
+                if waiter.session == owner:
+                    return i
+        return None
+
+    def stats(self):
+        with self._cond:
+            return {
+                "slots": self.slots,
+                "in_use": self.in_use,
+                "waiting": len(self._waiters),
+                "sessions": len(self.active),
+                "granted": self.granted,
+                "waited_seconds": round(self.waited, 1),
+            }
+
+
+class Scheduler:
+    def __init__(self, remote_slots=REMOTE_SLOTS, encode_slots=ENCODE_SLOTS):
+        self.pools = {
+            "remote": SlotPool("remote", remote_slots),
+            "encode": SlotPool("encode", encode_slots),
+        }
+
+    def pool(self, name):
+        return self.pools[name]
+
+    @contextmanager
+    def slot(self, name):
+        """Hold one slot of pool ``name`` for the current session."""
+        with self.pools[name]:
+            yield
+
+    def positions(self, owner):
+        """{pool: place in line} for every pool where ``owner`` is waiting."""
+        positions = {}
+        for name, pool in self.pools.items():
+            place = pool.position(owner)
+            if place is not None:
+                positions[name] = place
+        return positions
+
+    def describe_wait(self, owner):
+        positions = self.positions(owner)
+        if not positions:
+            return None
+        labels = {"remote": "a generation slot", "encode": "an encode slot"}
+        return "Waiting for " + " and ".join(f"{labels.get(name, name)} (#{place} in line)" for name, place in positions.items())
+
+    def stats(self):
+        return {name: pool.stats() for name, pool in self.pools.items()}
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+        return _scheduler
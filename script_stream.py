@@ -0,0 +1,150 @@
+"""Streaming script generation: segments start rendering as their lines arrive.
+
+The script model's output is parsed line by line while it streams in. Each
+numbered line ("1: ...") completes one segment, and the segment's stage
+starts right away instead of waiting for the full response. Segments the
+response leaves out (or garbles) are requested again on their own, with
+the segments already written given as context, so one malformed line
+doesn't abort the whole job.
+"""
+import logging
+import re
+from concurrent.futures import Future
+
+from stages import StageSkipped
+
+logger = logging.getLogger(__name__)
+
+# Same labels the old whole-response parser accepted, e.g. "1: ..." or "Segment 1: ..."
+SEGMENT_LINE = re.compile(r"(\d+):\s*(.*)")
+
+# Re-prompts for missing segments before the script stage gives up
+REPAIR_ATTEMPTS = 2
+
+
+class ScriptParser:
+    """Incrementally extracts numbered segments from streamed text.
+
+    ``on_segment(i, text)`` is called once per segment, as soon as its line
+    is complete. A label on a line of its own takes the next line as its
+    text. Lines labeled out of range (or repeated) fill the next empty
+    segment, like the ordered ``re.findall`` this replaces.
+    """
+
+    def __init__(self, num_segments, on_segment=None):
+        self.segments = [None] * num_segments
+        self.on_segment = on_segment
+        self._buffer = ""
+        self._label = None
+
+    @property
+    def missing(self):
+        return [i for i, text in enumerate(self.segments) if text is None]
+
+    def feed(self, text):
+        *lines, self._buffer = (self._buffer + text).split("\n")
+        for line in lines:
+            self._line(line)
+
+    def close(self):
+        # The last line may end without a newline
+        if self._buffer:
+            self._line(self._buffer)
+        self._buffer = ""
+        self._label = None
+
+    def _line(self, line):
+        line = line.strip()
+        if not line:
+            return
+        match = SEGMENT_LINE.search(line)
+        if match:
+            label, text = int(match.group(1)), match.group(2).strip()
+        elif self._label is not None:
+            label, text = self._label, line
+        else:
+            return  # Preamble or commentary
+        self._label = None
+        if not text:
+            self._label = label
+            return
+        missing = self.missing
+        if not missing:
+            return
+        i = label - 1 if label - 1 in missing else missing[0]
+        self.segments[i] = text
+        if self.on_segment:
+            self.on_segment(i, text)
+
+
+def repair_prompt(prompt, segments):
+    """Ask for just the segments missing from ``segments``, with the written ones as context."""
+    written = "\n".join(f"{n}: {text}" for n, text in enumerate(segments, 1) if text is not None)
+    labels = ", ".join(f"'{n}:'" for n, text in enumerate(segments, 1) if text is None)
+    return (
+        f"{prompt}\n\n"
+        f"These segments are already written:\n{written}\n\n"
+        f"Write only the missing segment(s) {labels}, one per line, each starting with its label. "
+        f"Do not repeat the segments above."
+    )
+
+
+def stream_script(generator, model_path, prompt, num_segments, on_segment=None, attempts=REPAIR_ATTEMPTS):
+    """Stream a numbered script and return its ``num_segments`` segments.
+
+    ``on_segment(i, text)`` fires as each segment's line completes, across
+    the first response and any repair prompts. Raises ValueError when
+    segments are still missing after ``attempts`` re-prompts.
+    """
+    parser = ScriptParser(num_segments, on_segment)
+    request = prompt
+    for attempt in range(attempts + 1):
+        for chunk in generator.stream_replicate_text(model_path, {"prompt": request}):
+            parser.feed(chunk)
+        parser.close()
+        missing = parser.missing
+        if not missing:
+            return parser.segments
+        logger.info("Script response is missing segment(s) %s; re-prompting (%d/%d)",
+                    ", ".join(str(i + 1) for i in missing), attempt + 1, attempts)
+        request = repair_prompt(prompt, parser.segments)
+    raise ValueError(f"Failed to extract {num_segments} clear script segments. Try adjusting your topic or refining the prompt.")
+
+
+def add_script_stages(graph, write_script, num_segments, generate_segment, line_stages=None):
+    """Add a streaming ``script`` stage and ``segment_1``..``segment_N`` stages to ``graph``.
+
+    ``write_script(on_segment)`` must call ``on_segment(i, text)`` for each
+    segment as it is parsed and return the full list of segments (e.g. via
+    ``stream_script``). ``generate_segment(i, text)`` runs as soon as its
+    line is known, while the rest of the script is still streaming.
+    ``line_stages`` maps further prefixes to such callables, e.g.
+    ``{"voice": fn}`` adds ``voice_1``..``voice_N``. Line stages have no
+    graph dependencies, so the graph needs a worker for each of them plus
+    the script. If the script fails, stages whose line never arrived are
+    skipped.
+    """
+    lines = [Future() for _ in range(num_segments)]
+
+    def script_stage():
+        try:
+            segments = write_script(lambda i, text: lines[i].set_result(text))
+        except BaseException as e:
+            for line in lines:
+                if not line.done():
+                    line.set_exception(e)
+            raise
+        return segments
+
+    def line_stage(prefix, fn, i):
+        try:
+            text = lines[i].result()
+        except BaseException as e:
+            raise StageSkipped(f"Skipped '{prefix}_{i+1}' because the script failed") from e
+        return fn(i, text)
+
+    graph.add("script", script_stage)
+    stages = {"segment": generate_segment, **(line_stages or {})}
+    for prefix, fn in stages.items():
+        for i in range(num_segments):
+            graph.add(f"{prefix}_{i+1}", lambda prefix=prefix, fn=fn, i=i: line_stage(prefix, fn, i))
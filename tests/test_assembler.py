@@ -0,0 +1,143 @@
+import os
+
+import pytest
+
+import assembler
+import ffmpeg_tools
+from assembler import IncrementalAssembler
+from ffmpeg_tools import MediaInfo
+
+
+class FakePlanner:
+    deadline = 60.0
+
+    def plan(self, frames, width, height, deadline=None):
+        return ("profile", frames, width, height)
+
+
+class FakeMedia:
+    """Stands in for ffmpeg: files hold a text label, and joins concatenate the labels.
+
+    Sources are named ``<name>_<seconds>s_<parameter sets>.mp4``.
+    """
+
+    def __init__(self, monkeypatch, tmp_path):
+        self.dir = tmp_path
+        self.encodes = []
+        monkeypatch.setattr(ffmpeg_tools, "probe", self.probe)
+        monkeypatch.setattr(ffmpeg_tools, "parameter_sets", self.parameter_sets)
+        monkeypatch.setattr(ffmpeg_tools, "run_ffmpeg", self.trim)
+        monkeypatch.setattr(ffmpeg_tools, "concat_copy", self.concat)
+        monkeypatch.setattr(ffmpeg_tools, "mux_audio", self.mux)
+        monkeypatch.setattr(assembler, "conform_segment", self.conform)
+        monkeypatch.setattr(assembler, "get_planner", FakePlanner)
+
+    def source(self, name, seconds=5, sets="A"):
+        path = self.dir / f"{name}_{seconds}s_{sets}.mp4"
+        path.write_text(name)
+        return str(path)
+
+    @staticmethod
+    def _parts(path):
+        name, seconds, sets = os.path.basename(path)[:-4].split("_")
+        return name, float(seconds[:-1]), sets
+
+    def probe(self, path):
+        return MediaInfo(path=path, duration=self._parts(path)[1], video_codec="h264", width=64, height=64, fps=24, pix_fmt="yuv420p")
+
+    def parameter_sets(self, path):
+        return (self._parts(path)[2].encode(),)
+
+    def trim(self, args, input=None):
+        with open(args[-1], "w") as f:
+            f.write(open(args[args.index("-i") + 1]).read())
+
+    def conform(self, path, reference, seconds, out, fps=24, deadline=None, loop_mode=None, move=None, profile=None):
+        self.encodes.append((os.path.basename(path), loop_mode, move, profile))
+        with open(out, "w") as f:
+            f.write("enc:" + open(path).read())
+        return out
+
+    def concat(self, paths, out, segment_seconds=None):
+        with open(out, "w") as f:
+            f.write("|".join(open(p).read() for p in paths))
+        return out
+
+    def mux(self, video, audio, out, duration=None):
+        with open(out, "w") as f:
+            f.write(open(video).read())
+        return out
+
+
+@pytest.fixture
+def media(monkeypatch, tmp_path):
+    return FakeMedia(monkeypatch, tmp_path)
+
+
+def test_preview_grows_with_the_consecutive_prefix(media, tmp_path):
+    a = IncrementalAssembler(3, segment_seconds=5)
+    assert not a.add_segment(1, media.source("b"))
+    assert a.preview_path is None and a.prefix == 0
+    assert a.add_segment(0, media.source("a"))
+    assert a.prefix == 2 and open(a.preview_path).read() == "a|b"
+    with pytest.raises(RuntimeError, match=r"segments \[3\]"):
+        a.finalize(None, str(tmp_path / "final.mp4"))
+    assert a.add_segment(2, media.source("c", seconds=6))
+    assert a.complete and open(a.preview_path).read() == "a|b|c"
+    assert media.encodes == []
+    final = a.finalize(None, str(tmp_path / "final.mp4"))
+    assert open(final).read() == "a|b|c"
+    a.cleanup()
+    assert not os.path.exists(a.work_dir)
+
+
+def test_short_segments_are_looped_with_the_loop_mode(media):
+    a = IncrementalAssembler(2, segment_seconds=5, loop_mode="pingpong")
+    a.add_segment(0, media.source("a", seconds=5))
+    a.add_segment(1, media.source("b", seconds=3))
+    assert [(name, loop) for name, loop, *_ in media.encodes] == [("a_5s_A.mp4", None), ("b_3s_A.mp4", "pingpong")]
+
+
+def test_segments_without_video_are_rejected(media, monkeypatch):
+    monkeypatch.setattr(ffmpeg_tools, "probe", lambda path: MediaInfo(path=path, duration=5))
+    with pytest.raises(ffmpeg_tools.FFmpegError, match="no video"):
+        IncrementalAssembler(1).add_segment(0, media.source("a"))
+
+
+def test_copied_segments_are_re_encoded_once_one_has_to_be(media):
+    a = IncrementalAssembler(2, segment_seconds=5)
+    first = media.source("a")
+    a.add_segment(0, first)
+    assert a.copied == {0}
+    a.add_segment(1, media.source("b", sets="B"))
+    assert a.encode_all and not a.copied
+    assert [name for name, *_ in media.encodes] == ["a_5s_A.mp4", "b_5s_B.mp4"]
+    assert len({profile for *_, profile in media.encodes}) == 1
+    assert open(a.preview_path).read() == "enc:a|enc:b"
+    # The copy was a hard link to the source; encoding must not have written through it
+    assert open(first).read() == "a"
+
+
+def test_a_copy_overtaken_by_the_switch_to_encoding_leaves_its_source_alone(media, monkeypatch):
+    a = IncrementalAssembler(1, segment_seconds=5)
+    copy = a._copy
+
+    def copy_then_switch(path, info, out):
+        # Another segment switches the job to encoding while this one is being linked
+        copied = copy(path, info, out)
+        a.encode_all = True
+        return copied
+    monkeypatch.setattr(a, "_copy", copy_then_switch)
+    source = media.source("a")
+    out = a.normalize(0, source)
+    assert open(out).read() == "enc:a" and open(source).read() == "a"
+    assert sorted(os.listdir(a.work_dir)) == ["segment_01.mp4"]
+
+
+def test_a_camera_move_encodes_every_segment(media):
+    a = IncrementalAssembler(2, segment_seconds=5, moves=[None, "zoom"])
+    assert a.encode_all
+    a.add_segment(0, media.source("a"))
+    a.add_segment(1, media.source("b"))
+    assert [(name, move) for name, _, move, _ in media.encodes] == [("a_5s_A.mp4", None), ("b_5s_A.mp4", "zoom")]
+    assert not a.copied
@@ -0,0 +1,69 @@
+import itertools
+import os
+
+import pytest
+
+import asset_cache
+from asset_cache import AssetCache, cache_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # A strictly increasing time.time() so LRU order doesn't depend on timer resolution
+    ticks = itertools.count(1000)
+    monkeypatch.setattr(asset_cache.time, "time", lambda: float(next(ticks)))
+
+
+def _file(path, size):
+    path.write_bytes(b"x" * size)
+    return str(path)
+
+
+def test_key_ignores_dict_order_but_not_variant():
+    a = cache_key("owner/model", {"prompt": "hi", "fps": 24})
+    assert a == cache_key("owner/model", {"fps": 24, "prompt": "hi"})
+    assert a != cache_key("owner/model", {"prompt": "hi", "fps": 25})
+    assert a != cache_key("owner/model", {"prompt": "hi", "fps": 24}, variant="trim-5s")
+    assert a != cache_key("owner/other", {"prompt": "hi", "fps": 24})
+
+
+def test_text_is_produced_once_and_survives_a_restart(tmp_path):
+    calls = []
+    cache = AssetCache(root=str(tmp_path))
+    produce = lambda: calls.append(1) or "the script"
+    assert cache.fetch_text("m", {"prompt": "p"}, produce) == "the script"
+    assert AssetCache(root=str(tmp_path)).fetch_text("m", {"prompt": "p"}, produce) == "the script"
+    assert len(calls) == 1
+
+
+def test_file_hits_are_private_copies(tmp_path):
+    cache = AssetCache(root=str(tmp_path / "cache"))
+    first = cache.fetch_file("m", {"prompt": "p"}, ".mp4", lambda: _file(tmp_path / "out.mp4", 10))
+    dest = str(tmp_path / "hit.mp4")
+    hit = cache.fetch_file("m", {"prompt": "p"}, ".mp4", lambda: pytest.fail("should be cached"), dest=dest)
+    assert hit == dest and open(hit, "rb").read() == b"x" * 10
+    # Removing the working copies leaves the cached object
+    os.remove(first)
+    os.remove(hit)
+    assert cache.get_file(cache_key("m", {"prompt": "p"}), ".mp4") is not None
+    assert cache.stats()["hits"] == 2
+
+
+def test_a_vanished_object_is_a_miss(tmp_path):
+    cache = AssetCache(root=str(tmp_path / "cache"))
+    key = cache_key("m", {})
+    os.remove(cache.put_file(key, _file(tmp_path / "out.mp4", 10)))
+    assert cache.get_file(key) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    cache = AssetCache(root=str(tmp_path / "cache"), max_bytes=25)
+    keys = [cache_key("m", {"n": n}) for n in range(3)]
+    for n, key in enumerate(keys[:2]):
+        cache.put_file(key, _file(tmp_path / f"{n}.mp4", 10))
+    cache.get_file(keys[0])  # Now the most recently used
+    cache.put_file(keys[2], _file(tmp_path / "2.mp4", 10))
+    assert cache.get_file(keys[1]) is None
+    assert cache.get_file(keys[0]) and cache.get_file(keys[2])
+    assert cache.stats()["bytes"] == 20
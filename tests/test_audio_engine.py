@@ -0,0 +1,63 @@
+import wave
+
+import numpy as np
+import pytest
+
+import audio_engine
+from audio_engine import Track, duck_gain, fade_curve, fit_length, mix_tracks
+
+RATE = 1000
+
+
+def _ramp(frames, channels=2):
+    return np.repeat(np.arange(1, frames + 1, dtype=np.float32)[:, None], channels, axis=1)
+
+
+def test_fit_length_modes():
+    x = _ramp(3)
+    assert fit_length(_ramp(10), 4)[:, 0].tolist() == [1, 2, 3, 4]
+    assert fit_length(x, 7, "start")[:, 0].tolist() == [1, 2, 3, 0, 0, 0, 0]
+    assert fit_length(x, 7, "center")[:, 0].tolist() == [0, 0, 1, 2, 3, 0, 0]
+    assert fit_length(x, 7, "loop")[:, 0].tolist() == [1, 2, 3, 1, 2, 3, 1]
+    assert fit_length(np.zeros((0, 2), np.float32), 5).shape == (5, 2)
+
+
+def test_fade_curve_ramps_in_and_out():
+    gain = fade_curve(1000, RATE, fade_in=0.1, fade_out=0.2)[:, 0]
+    assert gain[0] == 0 and gain[50] == pytest.approx(0.5)
+    assert np.all(gain[100:800] == 1)
+    assert gain[-1] == pytest.approx(1 / 200, rel=1e-4)
+    assert np.all(np.diff(gain[:100]) > 0) and np.all(np.diff(gain[800:]) < 0)
+
+
+def test_music_ducks_only_while_the_voice_speaks():
+    rate = 8000
+    voice = np.zeros((rate * 3, 1), dtype=np.float32)
+    voice[rate:2 * rate] = 0.5 * np.sin(np.arange(rate) * 0.3)[:, None]
+    gain = duck_gain(voice, len(voice), rate, depth=0.5)[:, 0]
+    assert gain.shape == (len(voice),)
+    assert gain[rate // 4] == pytest.approx(1.0)
+    assert gain[int(1.5 * rate)] == pytest.approx(0.5)
+    assert gain[int(2.9 * rate)] == pytest.approx(1.0)
+    assert gain.min() >= 0.5 - 1e-6
+
+
+def test_mix_is_exactly_the_requested_length_and_never_clips(monkeypatch):
+    decoded = {"voice.mp3": np.full((500, 2), 0.9, np.float32), "music.mp3": np.full((300, 2), 0.9, np.float32)}
+    monkeypatch.setattr(audio_engine, "decode_audio", lambda path, rate: decoded[path])
+    monkeypatch.setattr(audio_engine.music_loop, "loop_to_length",
+                        lambda path, x, frames, rate, cache: fit_length(x, frames, "loop"))
+    track = mix_tracks("voice.mp3", "music.mp3", 2.0, music_gain=1.0, music_fade=0, duck=False, sample_rate=RATE)
+    assert track.samples.shape == (2000, 2)
+    assert np.abs(track.samples).max() == pytest.approx(1.0)
+    # Voice placed at the start, music under all of it
+    assert track.samples[1999, 0] == pytest.approx(0.5)
+    assert mix_tracks(None, None, 2.0) is None
+
+
+def test_pcm_and_wav_output(tmp_path):
+    track = Track(np.array([[1.5, -1.5], [0.5, 0.0]], dtype=np.float32), 8000)
+    assert np.frombuffer(track.to_pcm16(), "<i2").tolist() == [32767, -32767, 16383, 0]
+    path = track.write_wav(str(tmp_path / "out.wav"))
+    with wave.open(path) as w:
+        assert (w.getnchannels(), w.getframerate(), w.getnframes()) == (2, 8000, 2)
@@ -0,0 +1,91 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip("replicate")
+
+import batch
+from workspace import QuotaExceeded
+
+
+class FakeWorkspace:
+    peak = 0
+
+    def __init__(self):
+        self.cleaned = False
+
+    def cleanup(self):
+        self.cleaned = True
+
+
+class FakeWorkspaces:
+    def __init__(self, error=None):
+        self.error = error
+        self.created = []
+
+    def create(self, job_id):
+        if self.error:
+            raise self.error
+        self.created.append(job_id)
+        return FakeWorkspace()
+
+
+class FakeGenerator:
+    def for_owner(self, owner, tracer=None, workspace=None):
+        return self
+
+
+def test_load_jobs(tmp_path):
+    path = tmp_path / "jobs.jsonl"
+    path.write_text("\n".join([
+        json.dumps({"job_id": "earth", "topic": "Earth"}),
+        "# a comment",
+        "",
+        json.dumps({"request_id": "moon", "topic": "Moon"}),
+        json.dumps({"topic": "Sun"}),
+    ]))
+    jobs = batch.load_jobs(path)
+    assert [job_id for job_id, _ in jobs] == ["earth", "moon", "job-0005"]
+    assert jobs[0][1]["topic"] == "Earth"
+
+
+def test_safe_name_keeps_ids_inside_the_output_dir():
+    assert batch.safe_name("earth-01.v2") == "earth-01.v2"
+    assert batch.safe_name("../../etc/passwd") == "_.._etc_passwd"
+    assert batch.safe_name("..") == "job"
+    assert os.sep not in batch.safe_name("a/b\\c")
+
+
+def test_process_job_records_its_outputs(tmp_path, monkeypatch):
+    workspaces = FakeWorkspaces()
+    monkeypatch.setattr(batch, "get_workspaces", lambda: workspaces)
+
+    def run_job(generator, job, output_path, logger=None):
+        assert job.topic == "Earth" and job.length == 10
+        return output_path, {"script": ["one", "two"]}, {"music": RuntimeError("no music")}
+
+    monkeypatch.setattr(batch, "run_job", run_job)
+    result = batch.process_job(FakeGenerator(), "earth", {"topic": "Earth", "length": "10 seconds", "unknown": 1}, str(tmp_path))
+    assert result["status"] == "ok" and result["error"] is None
+    assert result["output"] == str(tmp_path / "earth" / "final_video.mp4")
+    assert result["skipped"] == ["music"]
+    assert (tmp_path / "earth" / "script.txt").read_text() == "one\n\ntwo"
+    assert os.path.exists(result["trace"])
+
+
+def test_a_failed_job_is_recorded_not_raised(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch, "get_workspaces", lambda: FakeWorkspaces())
+    result = batch.process_job(FakeGenerator(), "bad", {"topic": "Earth", "length": 7}, str(tmp_path))
+    assert result["status"] == "failed"
+    assert result["error"].startswith("ValueError: Unsupported video length")
+
+
+def test_no_scratch_space_fails_only_that_job(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch, "get_workspaces", lambda: FakeWorkspaces(QuotaExceeded("full")))
+    result = batch.process_job(FakeGenerator(), "../escape", {"topic": "Earth"}, str(tmp_path), metrics_dir=str(tmp_path))
+    assert result["status"] == "failed" and "QuotaExceeded" in result["error"]
+    assert result["job_id"] == "../escape"
+    # Everything the job wrote stayed under out_dir
+    assert os.path.dirname(result["trace"]) == str(tmp_path / "_escape")
+    assert (tmp_path / "_escape.prom").exists()
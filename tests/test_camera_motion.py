@@ -0,0 +1,39 @@
+import random
+
+import numpy as np
+
+from camera_motion import MOVES, CameraMove, MovePath, _sample_grid, assign_moves
+
+
+def test_moves_keep_zoom_and_offsets_in_range():
+    for name, spec in MOVES.items():
+        if spec is None:
+            continue
+        zoom, x, y = CameraMove(name, strength=0.8, seed=1).path(48)
+        assert len(zoom) == 48 and zoom.min() >= 1
+        assert np.abs(x).max() <= 1 and np.abs(y).max() <= 1
+
+
+def test_identity_move_leaves_frames_unchanged():
+    frames = np.random.default_rng(0).integers(0, 256, (3, 8, 10, 3), dtype=np.uint8)
+    move = CameraMove("zoom_in", strength=0.0).render(3)
+    assert np.array_equal(move.apply(frames, 0), frames)
+
+
+def test_assign_moves_alternates():
+    moves = assign_moves(["zoom_in", "pan_left"], 6, random.Random(1))
+    names = [m.name for m in moves]
+    assert all(a != b for a, b in zip(names, names[1:]))
+    assert assign_moves(["static"], 3) == [None, None, None]
+
+
+def test_warps_match_float_bilinear_interpolation():
+    frames = np.random.default_rng(0).integers(0, 256, (4, 9, 16, 3), dtype=np.uint8)
+    zoom, x, y = np.linspace(1.0, 1.5, 4), np.linspace(-1, 1, 4), np.linspace(0.5, -0.5, 4)
+    out = MovePath(zoom, x, y).apply(frames[1:], 1)
+    y0, y1, fy = _sample_grid(9, zoom[1:], y[1:])
+    x0, x1, fx = _sample_grid(16, zoom[1:], x[1:])
+    for i, frame in enumerate(frames[1:].astype(np.float64)):
+        rows = frame[y0[i]] * (1 - fy[i])[:, None, None] + frame[y1[i]] * fy[i][:, None, None]
+        expected = rows[:, x0[i]] * (1 - fx[i])[None, :, None] + rows[:, x1[i]] * fx[i][None, :, None]
+        assert np.abs(out[i] - expected).max() <= 1.5
@@ -0,0 +1,124 @@
+import hashlib
+
+import pytest
+
+pytest.importorskip("requests")
+
+import downloader
+from downloader import DownloadError, Downloader
+
+BODY = bytes(range(200)) * 50
+
+
+class FakeRaw:
+    def __init__(self, data, fail_after=None):
+        self.data = data
+        self.pos = 0
+        self.fail_after = fail_after
+
+    def read(self, n, decode_content=True):
+        if self.fail_after is not None and self.pos >= self.fail_after:
+            raise downloader.ProtocolError("Connection reset by peer")
+        limit = len(self.data) if self.fail_after is None else self.fail_after
+        chunk = self.data[self.pos:min(self.pos + n, limit)]
+        self.pos += len(chunk)
+        return chunk
+
+
+class FakeResponse:
+    def __init__(self, status_code, body, headers, fail_after=None):
+        self.status_code = status_code
+        self.headers = headers
+        self.raw = FakeRaw(body, fail_after)
+
+    def raise_for_status(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeSession:
+    """Serves BODY, dropping the connection after ``fail_after`` bytes of the first ``failures`` responses."""
+
+    def __init__(self, failures=1, fail_after=3000, honour_range=True):
+        self.failures = failures
+        self.fail_after = fail_after
+        self.honour_range = honour_range
+        self.ranges = []
+
+    def get(self, url, stream=True, headers=None, timeout=None):
+        header = (headers or {}).get("Range")
+        self.ranges.append(header)
+        fail_after = self.fail_after if self.failures > 0 else None
+        self.failures -= 1
+        if header and self.honour_range:
+            start = int(header.split("=")[1].rstrip("-"))
+            return FakeResponse(206, BODY[start:], {"Content-Range": f"bytes {start}-{len(BODY) - 1}/{len(BODY)}"}, fail_after)
+        return FakeResponse(200, BODY, {"Content-Length": str(len(BODY))}, fail_after)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(downloader.time, "sleep", lambda seconds: None)
+
+
+def _downloader(session, **kwargs):
+    d = Downloader(**kwargs)
+    d.session = session
+    return d
+
+
+def test_resumes_where_the_connection_dropped(tmp_path):
+    session = FakeSession(failures=2)
+    d = _downloader(session)
+    path = d.download("https://example.com/a.mp4", dest=str(tmp_path / "a.mp4"))
+    assert open(path, "rb").read() == BODY
+    assert session.ranges == [None, "bytes=3000-", "bytes=6000-"]
+    assert d.stats[path].resumes == 2 and d.stats[path].bytes == len(BODY)
+
+
+def test_starts_over_when_the_server_ignores_range(tmp_path):
+    session = FakeSession(failures=1, honour_range=False)
+    path = _downloader(session).download("https://example.com/a.mp4", dest=str(tmp_path / "a.mp4"))
+    assert open(path, "rb").read() == BODY
+
+
+def test_gives_up_and_removes_the_partial_file(tmp_path):
+    dest = tmp_path / "a.mp4"
+    with pytest.raises(DownloadError, match="Giving up"):
+        _downloader(FakeSession(failures=10), max_retries=2).download("https://example.com/a.mp4", dest=str(dest))
+    assert not dest.exists()
+
+
+def test_checksum_is_verified(tmp_path):
+    good = hashlib.sha256(BODY).hexdigest()
+    d = _downloader(FakeSession(failures=0))
+    assert d.download("https://example.com/a.mp4", dest=str(tmp_path / "a.mp4"), sha256=good)
+    with pytest.raises(DownloadError, match="Checksum"):
+        d.download("https://example.com/a.mp4", dest=str(tmp_path / "b.mp4"), sha256="0" * 64)
+    assert not (tmp_path / "b.mp4").exists()
+
+
+def test_stream_resumes_without_repeating_bytes():
+    d = _downloader(FakeSession(failures=1))
+    assert b"".join(d.stream("https://example.com/a.mp4", label="a")) == BODY
+    assert d.stats["a"].resumes == 1
+
+
+def test_stream_cannot_restart_what_it_already_handed_on():
+    stream = _downloader(FakeSession(failures=1, honour_range=False)).stream("https://example.com/a.mp4")
+    with pytest.raises(DownloadError, match="ignored the Range header"):
+        b"".join(stream)
+
+
+def test_stats_are_bounded_and_forgotten_with_their_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader, "MAX_STATS", 3)
+    d = _downloader(FakeSession(failures=0))
+    paths = [d.download("https://example.com/a.mp4", dest=str(tmp_path / f"{i}.mp4")) for i in range(5)]
+    assert list(d.stats) == paths[2:]
+    d.forget(str(tmp_path))
+    assert not d.stats
@@ -0,0 +1,67 @@
+import pytest
+
+import encoder_planner
+from encoder_planner import PRESETS, EncoderPlanner
+from scheduler import Scheduler
+
+# Synthetic x264 speeds: each slower preset halves the fps, each CRF step of 2 adds 10%
+BASE_FPS = 400.0
+
+
+def fake_calibrate(calls):
+    def calibrate(width, height, threads, crf):
+        calls.append((width, height, threads, crf))
+        return {preset: BASE_FPS / 2 ** i * (1 + 0.05 * (crf - 21)) for i, preset in enumerate(PRESETS)}
+    return calibrate
+
+
+@pytest.fixture
+def planner(tmp_path, monkeypatch):
+    monkeypatch.setattr(encoder_planner, "get_scheduler", lambda: Scheduler(remote_slots=1, encode_slots=2))
+    monkeypatch.setattr(encoder_planner.os, "cpu_count", lambda: 8)
+    planner = EncoderPlanner(deadline=10, quality="balanced", calibration_path=str(tmp_path / "calibration.json"))
+    planner.calls = []
+    monkeypatch.setattr(planner, "calibrate", fake_calibrate(planner.calls))
+    return planner
+
+
+def test_each_encode_gets_its_share_of_the_cores(planner):
+    assert planner.encode_threads() == 4
+    assert planner.plan(120, 960, 540).threads == 4
+    assert EncoderPlanner(threads=3, calibration_path=planner.calibration_path).encode_threads() == 3
+
+
+def test_slowest_preset_that_fits_the_deadline(planner):
+    # 120 frames in 10 s with 25% headroom needs 15 fps: "fast" (25 fps) is the slowest balanced preset
+    profile = planner.plan(120, 960, 540)
+    assert (profile.preset, profile.crf) == ("fast", 21)
+    # A looser deadline still stops at the quality's slowest preset
+    assert planner.plan(120, 960, 540, deadline=1000).preset == "fast"
+    assert planner.plan(1200, 960, 540).preset == "superfast"
+
+
+def test_crf_rises_only_when_the_fastest_preset_misses(planner):
+    # 3400 frames in 10 s need 425 fps; ultrafast does 400 at CRF 21 and 440 at 23.
+    # Nothing makes 10000 frames, so the fastest settings the quality allows
+    profile = planner.plan(3400, 960, 540)
+    assert (profile.preset, profile.crf) == ("ultrafast", 23)
+    profile = planner.plan(10000, 960, 540)
+    assert (profile.preset, profile.crf) == ("ultrafast", 25)
+    assert [call[3] for call in planner.calls] == [21, 23, 25]
+
+
+def test_calibration_is_cached_per_size_threads_and_crf(planner, monkeypatch):
+    planner.plan(120, 960, 540)
+    planner.plan(120, 960, 540)
+    planner.plan(120, 1280, 720)
+    assert planner.calls == [(960, 540, 4, 21), (1280, 720, 4, 21)]
+    reloaded = EncoderPlanner(calibration_path=planner.calibration_path)
+    monkeypatch.setattr(reloaded, "calibrate", lambda *args: pytest.fail("should load from disk"))
+    assert reloaded.throughput(960, 540, threads=4, crf=21)["fast"] == pytest.approx(25.0)
+
+
+def test_real_encodes_do_not_change_the_table(planner):
+    profile = planner.plan(120, 960, 540)
+    before = planner.throughput(960, 540)
+    assert planner.record(profile, 120, 60.0, 960, 540) == pytest.approx(2.0)
+    assert planner.throughput(960, 540) == before
@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+pytest.importorskip("replicate")
+
+import generation  # noqa: E402
+from ffmpeg_tools import FFmpegError  # noqa: E402
+from generation import Generator  # noqa: E402
+from tracing import NULL_TRACER  # noqa: E402
+
+
+class Ingest:
+    """Fails on a pipe (or always, when the output is broken) and records what it read."""
+
+    def __init__(self, broken=False):
+        self.broken = broken
+        self.sources = []
+
+    def __call__(self, source, dest):
+        streamed = not isinstance(source, str)
+        self.sources.append("stream" if streamed else "file")
+        if streamed or self.broken:
+            raise FFmpegError("moov atom not found")
+        with open(dest, "wb") as f:
+            f.write(b"video")
+
+
+class Workspace:
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+
+    def file(self, suffix="", prefix="asset"):
+        self.count += 1
+        return os.path.join(self.path, f"{prefix}-{self.count}{suffix}")
+
+    def check(self):
+        pass
+
+
+@pytest.fixture
+def generator(tmp_path, monkeypatch):
+    monkeypatch.setattr(generation, "_unstreamable", {})
+    monkeypatch.setattr(generation, "stream_download", lambda url, label=None: iter([b"chunk"]))
+
+    def download_to_file(url, suffix, dest=None):
+        with open(dest, "wb") as f:
+            f.write(b"raw")
+        return dest
+    monkeypatch.setattr(generation, "download_to_file", download_to_file)
+    gen = Generator.__new__(Generator)
+    gen.cache = None
+    gen.workspace = Workspace(str(tmp_path))
+    gen.tracer = NULL_TRACER
+    gen.run_replicate = lambda model_path, input_data: "https://example.com/out.mp4"
+    return gen
+
+
+def test_streaming_is_retried_once_the_ttl_expires(generator, monkeypatch):
+    ingest = Ingest()
+    generator.run_replicate_ingest("m", {}, ".mp4", ingest)
+    generator.run_replicate_ingest("m", {}, ".mp4", ingest)
+    assert ingest.sources == ["stream", "file", "file"]
+    monkeypatch.setattr(generation, "UNSTREAMABLE_TTL", 0)
+    generation._mark_unstreamable("m")
+    generator.run_replicate_ingest("m", {}, ".mp4", ingest)
+    assert ingest.sources[3:] == ["stream", "file"]
+
+
+def test_a_broken_output_doesnt_disable_streaming(generator):
+    with pytest.raises(FFmpegError):
+        generator.run_replicate_ingest("m", {}, ".mp4", Ingest(broken=True))
+    assert generation._streamable("m")
@@ -0,0 +1,72 @@
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+from hedging import HedgePolicy, LatencyTracker
+
+
+def test_percentile_needs_enough_samples(tmp_path):
+    tracker = LatencyTracker(path=str(tmp_path / "latency.json"))
+    for seconds in range(1, 10):
+        tracker.record("m", seconds)
+    assert tracker.percentile("m", 90) is None
+    tracker.record("m", 10)
+    assert tracker.percentile("m", 90) == 9
+    assert tracker.percentile("m", 100) == 10
+    # Samples survive a restart
+    assert LatencyTracker(path=str(tmp_path / "latency.json")).percentile("m", 50) == 5
+
+
+def test_hedges_stay_within_budget():
+    policy = HedgePolicy(models=["m"], budget=0.2, tracker=LatencyTracker(path=None))
+    assert policy.applies("m") and not policy.applies("other")
+    for _ in range(10):
+        policy.started()
+    assert [policy.try_hedge() for _ in range(3)] == [True, True, False]
+    policy.finished("m", 1.0, hedge_won=True)
+    assert policy.stats() == {"primaries": 10, "hedges": 2, "wins": 1}
+
+
+class FakePredictions:
+    """The primary never finishes on its own; a hedge finishes shortly after it is submitted."""
+
+    def __init__(self):
+        self.futures = []
+        self.canceled = []
+
+    def submit(self, model_path, input_data, owner=None):
+        future = Future()
+        future.prediction_id = len(self.futures)
+        if self.futures:
+            threading.Timer(0.05, future.set_result, ["hedge"]).start()
+        self.futures.append(future)
+        return future
+
+    def cancel(self, prediction_ids):
+        self.canceled.extend(prediction_ids)
+
+
+class Span:
+    attrs = {}
+
+
+def test_a_winning_hedge_records_the_latency_seen_by_the_caller():
+    pytest.importorskip("replicate")
+    from generation import Generator
+
+    tracker = LatencyTracker(path=None)
+    for _ in range(10):
+        tracker.record("m", 0.2)
+    generator = Generator.__new__(Generator)
+    generator.aborted = False
+    generator.limiter = None
+    generator.owner = None
+    generator.hedge = HedgePolicy(models=["m"], budget=1, min_samples=10, tracker=tracker)
+    generator.predictions = FakePredictions()
+
+    assert generator._predict("m", {}, Span()) == "hedge"
+    assert generator.predictions.canceled == [0]
+    assert generator.hedge.stats()["wins"] == 1
+    # Deadline plus the hedge's run, not the hedge's run alone
+    assert tracker._samples["m"][-1] >= 0.25
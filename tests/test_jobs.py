@@ -0,0 +1,71 @@
+import os
+import time
+
+import pytest
+
+import jobs
+from jobs import JobManager, JobStore
+
+DAY = 86400
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(root=str(tmp_path / "jobs"))
+
+
+def _finished(store, tmp_path, age_days, size=0, status="succeeded", now=1000 * DAY):
+    job_id = store.create("video", {"topic": "t"}, ["script", "music"])
+    with open(os.path.join(store.job_dir(job_id), "final_video.mp4"), "wb") as f:
+        f.write(b"x" * size)
+    trace = tmp_path / f"{job_id}.trace.json"
+    trace.write_text("{}")
+    (tmp_path / f"{job_id}.prom").write_text("")
+    store.update(job_id, status=status, finished=now - age_days * DAY, trace=str(trace))
+    return job_id
+
+
+def test_records_round_trip(store):
+    job_id = store.create("video", {"topic": "t"}, ["script", "segment_1"], owner="alice")
+    store.set_stage(job_id, "script", "done", result=["one"], detail="fast")
+    record = store.get(job_id)
+    assert record.status == "queued" and record.active and record.owner == "alice"
+    assert list(record.stages) == ["script", "segment_1"]
+    assert record.stages["script"] == {"status": "done", "result": ["one"], "error": None, "detail": "fast"}
+    assert [r.id for r in store.list(owner="alice")] == [job_id] and store.list(owner="bob") == []
+
+
+def test_jobs_of_a_dead_process_are_interrupted(store):
+    alive = store.create("video", {}, [])
+    dead = store.create("video", {}, [])
+    store.update(dead, pid=2 ** 22 + 1)
+    assert store.recover() == 1
+    assert store.get(dead).status == "interrupted" and store.get(alive).status == "queued"
+
+
+def test_expired_jobs_are_pruned_with_their_files(store, tmp_path):
+    old = _finished(store, tmp_path, age_days=10)
+    recent = _finished(store, tmp_path, age_days=1)
+    running = store.create("video", {}, [])
+    store.update(running, status="running", created=0)
+    assert store.prune(ttl=7 * DAY, max_bytes=10 ** 9, now=1000 * DAY) == [old]
+    assert store.get(old) is None and not os.path.exists(os.path.join(store.root, old))
+    assert not (tmp_path / f"{old}.trace.json").exists() and not (tmp_path / f"{old}.prom").exists()
+    assert store.get(recent) and store.get(running)
+    assert (tmp_path / f"{recent}.trace.json").exists()
+
+
+def test_oldest_jobs_go_first_when_over_the_size_cap(store, tmp_path):
+    ids = [_finished(store, tmp_path, age_days=age, size=1000) for age in (3, 2, 1)]
+    running = store.create("video", {}, [])
+    store.update(running, status="running")
+    pruned = store.prune(ttl=30 * DAY, max_bytes=2500 + os.path.getsize(os.path.join(store.root, "jobs.sqlite")), now=1000 * DAY)
+    assert pruned == ids[:1]
+    assert store.get(running)
+
+
+def test_the_manager_prunes_on_startup(store, tmp_path):
+    old = _finished(store, tmp_path, age_days=jobs.JOB_TTL / DAY + 1, now=time.time())
+    recent = _finished(store, tmp_path, age_days=0, now=time.time())
+    JobManager(store=store, max_jobs=1)
+    assert store.get(old) is None and store.get(recent)
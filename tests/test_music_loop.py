@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+import music_loop
+from asset_cache import AssetCache
+from music_loop import beat_period, find_loop_points, onset_envelope, render_loop
+
+RATE = 8000
+
+
+def clicks(seconds, beat=0.5):
+    """Decaying noise bursts every ``beat`` seconds, on stereo."""
+    x = np.zeros(int(seconds * RATE), dtype=np.float32)
+    burst = np.random.default_rng(0).standard_normal(400).astype(np.float32) * np.exp(-np.arange(400) / 80)
+    for start in range(0, len(x) - 400, int(beat * RATE)):
+        x[start:start + 400] += burst
+    return np.stack([x, x], axis=1)
+
+
+def test_the_beat_period_comes_from_the_onsets():
+    assert beat_period(onset_envelope(clicks(8), RATE)) == 50
+    assert beat_period(onset_envelope(np.zeros((8 * RATE, 2), np.float32), RATE)) is None
+
+
+def test_the_loop_spans_whole_bars():
+    x = clicks(9)
+    start, end = find_loop_points(x, RATE)
+    bar = 4 * 0.5 * RATE
+    assert end <= len(x) - music_loop.CROSSFADE * RATE
+    assert round((end - start) / bar) >= 1
+    assert abs((end - start) / bar - round((end - start) / bar)) < 0.05
+
+
+def test_rendering_repeats_the_loop_body():
+    x = np.stack([np.arange(10, dtype=np.float32)] * 2, axis=1)
+    out = render_loop(x, 20, 2, 8, RATE, crossfade=0)
+    assert out[:, 0].tolist() == [0, 1, 2, 3, 4, 5, 6, 7, 2, 3, 4, 5, 6, 7, 2, 3, 4, 5, 6, 7]
+    assert len(render_loop(x, 5, 2, 8, RATE)) == 5
+
+
+def test_seams_crossfade_at_equal_gain():
+    # Identical sides of a seam must come out unchanged, with no swell
+    x = np.full((RATE, 2), 0.5, dtype=np.float32)
+    out = render_loop(x, 3 * RATE, 0, RATE // 2, RATE, crossfade=0.1)
+    assert out == pytest.approx(np.full((3 * RATE, 2), 0.5), abs=1e-6)
+    # The fade blends from the natural continuation (ones) into the loop start (zeros)
+    x = np.concatenate([np.zeros((RATE // 2, 2)), np.ones((RATE // 2, 2))]).astype(np.float32)
+    end = RATE // 2 + 100
+    seam = render_loop(x, 2 * RATE, 0, end, RATE, crossfade=0.01)[end:end + 80, 0]
+    assert np.all(np.diff(seam) < 0) and seam[0] > 0.95 and seam[-1] < 0.05
+
+def test_loop_points_are_cached_per_file(tmp_path, monkeypatch):
+    path = tmp_path / "music.mp3"
+    path.write_bytes(b"encoded music")
+    cache = AssetCache(root=str(tmp_path / "cache"))
+    x = clicks(9)
+    points = music_loop.loop_points(str(path), x, RATE, cache)
+    monkeypatch.setattr(music_loop, "find_loop_points", lambda *args: pytest.fail("loop points were analysed again"))
+    assert music_loop.loop_points(str(path), x, RATE, cache) == points
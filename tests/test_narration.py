@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+import narration
+from narration import fit_window, time_stretch, trim_silence
+
+RATE = 1000
+
+
+def tone(seconds, amplitude=0.5):
+    t = np.arange(int(seconds * RATE)) / RATE
+    mono = (amplitude * np.sin(2 * np.pi * 50 * t)).astype(np.float32)
+    return np.stack([mono, mono], axis=1)
+
+
+def silence(seconds):
+    return np.zeros((int(seconds * RATE), 2), dtype=np.float32)
+
+
+def test_silence_is_trimmed_to_the_voiced_blocks():
+    clip = np.concatenate([silence(0.2), tone(0.5), silence(0.3)])
+    assert len(trim_silence(clip, RATE)) == 500
+    assert len(trim_silence(silence(1), RATE)) == 0
+
+
+def test_stretch_resamples_linearly():
+    ramp = np.stack([np.arange(5, dtype=np.float32)] * 2, axis=1)
+    out = time_stretch(ramp, 9)
+    assert out.shape == (9, 2)
+    assert out[:, 0] == pytest.approx(np.arange(9) / 2)
+
+
+def test_a_short_line_starts_after_the_lead_in():
+    window, factor = fit_window(tone(0.5), 2000, RATE)
+    lead = int(narration.LEAD_IN * RATE)
+    assert factor == 1.0 and window.shape == (2000, 2)
+    assert not window[:lead].any() and window[lead + 1:lead + 500].any()
+    assert not window[lead + 500:].any()
+
+
+def test_a_long_line_is_sped_up_then_cut_with_a_fade():
+    lead = int(narration.LEAD_IN * RATE)
+    window, factor = fit_window(tone(1.0), 1000 + lead, RATE)
+    assert factor == pytest.approx(1.0)
+    window, factor = fit_window(tone(1.1), 1000 + lead, RATE)
+    assert factor == pytest.approx(1.1) and window[-50:].any()
+    window, factor = fit_window(tone(2.0), 1000 + lead, RATE)
+    assert factor == narration.MAX_STRETCH
+    fade = int(narration.TAIL_FADE * RATE)
+    assert not window[-1].any() and np.abs(window[-fade // 2:]).max() < 0.5 * np.abs(window[lead:lead + 100]).max()
+
+
+def test_each_line_lands_in_its_own_slot(monkeypatch):
+    clips = {"one.wav": np.concatenate([silence(0.4), tone(0.5)]), "three.wav": tone(0.5)}
+    monkeypatch.setattr(narration, "decode_audio", lambda path, sample_rate: clips[path])
+    track = narration.align_voice(["one.wav", None, "three.wav"], 1.0, sample_rate=RATE)
+    slots = track.samples.reshape(3, RATE, 2)
+    lead = int(narration.LEAD_IN * RATE)
+    # Leading silence is trimmed, so the line still starts right after the lead-in
+    assert slots[0, lead + 1:lead + 10].any() and not slots[0, :lead].any()
+    assert not slots[1].any()
+    assert slots[2, lead + 1:lead + 10].any()
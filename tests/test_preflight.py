@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+import ffmpeg_tools
+import preflight
+from ffmpeg_tools import MediaInfo
+from preflight import PreflightError
+
+
+class FakePlanner:
+    deadline = 60.0
+
+    def plan(self, frames, width, height, deadline=None):
+        return object()
+
+
+@pytest.fixture
+def media(tmp_path, monkeypatch):
+    """Files named ``<name>_<seconds>_<width>_<parameter sets>.<ext>``; .mp3 files are audio."""
+    conformed = []
+
+    def probe(path):
+        name, seconds, width, _ = os.path.basename(path).rsplit(".", 1)[0].split("_")
+        if path.endswith(".mp3"):
+            return MediaInfo(path=path, duration=float(seconds), audio_codec="mp3", sample_rate=32000, channels=1)
+        return MediaInfo(path=path, duration=float(seconds), video_codec="h264", width=int(width), height=540, fps=24, pix_fmt="yuv420p")
+
+    def conform(path, ref, seconds, out, fps=24, loop_mode=None, profile=None):
+        conformed.append((os.path.basename(path), ref.width, loop_mode, profile))
+        open(out, "w").close()
+        return out
+
+    monkeypatch.setattr(ffmpeg_tools, "probe", probe)
+    monkeypatch.setattr(ffmpeg_tools, "parameter_sets", lambda path: (os.path.basename(path).rsplit(".", 1)[0].split("_")[3],))
+    monkeypatch.setattr(preflight, "conform_segment", conform)
+    monkeypatch.setattr(preflight, "get_planner", FakePlanner)
+
+    def make(name, seconds=5, width=960, sets="A", ext="mp4"):
+        path = tmp_path / f"{name}_{seconds}_{width}_{sets}.{ext}"
+        path.write_bytes(b"x")
+        return str(path)
+
+    make.conformed = conformed
+    make.dir = str(tmp_path)
+    return make
+
+
+def test_matching_segments_are_joined_as_they_are(media):
+    segments = [media(f"s{i}") for i in range(4)]
+    report = preflight.preflight(segments, media("voice", ext="mp3"), None, 5, media.dir)
+    assert report.segments == segments and not report.repaired and not media.conformed
+    assert report.voice.sample_rate == 32000 and report.music is None
+
+
+def test_one_repair_reencodes_every_segment_with_one_profile(media):
+    segments = [media("s0"), media("s1", width=640), media("s2", seconds=3), media("s3", sets="B")]
+    report = preflight.preflight(segments, None, None, 5, media.dir, loop_mode="crossfade")
+    # The majority format is the reference
+    assert {width for _, width, _, _ in media.conformed} == {960}
+    assert len({id(profile) for *_, profile in media.conformed}) == 1
+    assert [loop for _, _, loop, _ in media.conformed] == [None, None, "crossfade", None]
+    assert report.repaired == {1: "re-encoded to match", 2: "640x540", 3: "3.0s long", 4: "different encoder settings"}
+    assert all(path.startswith(media.dir) and "conformed" in path for path in report.segments)
+
+
+def test_unusable_media_fails_with_every_problem(media):
+    with pytest.raises(PreflightError) as raised:
+        preflight.preflight([media("s0"), os.path.join(media.dir, "missing.mp4")], media("voice", ext="mp4"), None, 5, media.dir)
+    assert raised.value.problems == ["Segment 2: file is missing", "Voiceover: no audio stream"]
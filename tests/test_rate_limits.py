@@ -0,0 +1,102 @@
+import pytest
+
+import rate_limits
+from rate_limits import ModelLimit, RateLimiter, error_status, retry_after
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class FakeAPIError(Exception):
+    def __init__(self, status, detail="", headers=None):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+        self.response = FakeResponse(status, headers)
+
+
+def test_status_and_retry_after_from_errors():
+    assert error_status(FakeAPIError(429)) == 429
+    assert error_status(ValueError("no status")) is None
+    assert retry_after(FakeAPIError(429, headers={"retry-after": "3"})) == 3.0
+    assert retry_after(FakeAPIError(429, "Request was throttled. Expected available in 2 seconds.")) == 2.0
+    assert retry_after(FakeAPIError(429)) is None
+
+
+def test_window_grows_additively_and_halves_once_per_burst():
+    limit = ModelLimit("owner/model", rate=100, concurrency=4, max_concurrency=8)
+    limit.acquire()
+    limit.release("success")
+    assert limit.limit == pytest.approx(4.25)
+    for _ in range(3):
+        limit.acquire()
+        limit.release("throttled")
+    # Within the cooldown the burst counts as one decrease
+    assert limit.limit == pytest.approx(2.125)
+    assert limit.stats()["throttled"] == 3
+
+
+def test_window_caps_concurrency():
+    limit = ModelLimit("owner/model", rate=100, concurrency=2)
+    limit.acquire()
+    limit.acquire()
+    with pytest.raises(TimeoutError):
+        limit.acquire(timeout=0.05)
+    limit.release()
+    assert limit.acquire(timeout=1) >= 0
+
+
+def test_throttle_pauses_the_bucket():
+    limit = ModelLimit("owner/model", rate=100, concurrency=4)
+    limit.acquire()
+    limit.release("throttled", pause=0.2)
+    assert limit.acquire() >= 0.15
+
+
+def test_call_retries_throttled_requests():
+    limiter = RateLimiter(rate=100, concurrency=4, model_limits={})
+    attempts = []
+
+    def create():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise FakeAPIError(429, headers={"retry-after": "0"})
+        return "prediction"
+
+    result, limit = limiter.call("owner/model:version", create)
+    assert result == "prediction" and len(attempts) == 3
+    # The caller still holds the successful attempt's slot; pinned versions share the model's limit
+    assert limit is limiter.get("owner/model") and limit.in_flight == 1
+    assert limit.throttled == 2
+
+
+def test_call_gives_up_after_max_retries(monkeypatch):
+    monkeypatch.setattr(rate_limits, "MAX_RETRIES", 2)
+    limiter = RateLimiter(rate=100, concurrency=4, model_limits={})
+    attempts = []
+
+    def create():
+        attempts.append(1)
+        raise FakeAPIError(503, headers={"retry-after": "0"})
+
+    with pytest.raises(FakeAPIError):
+        limiter.call("owner/model", create)
+    assert len(attempts) == 3
+    assert limiter.get("owner/model").in_flight == 0
+
+
+def test_call_does_not_retry_other_errors():
+    limiter = RateLimiter(rate=100, concurrency=4, model_limits={})
+    attempts = []
+
+    def create():
+        attempts.append(1)
+        raise FakeAPIError(422, "invalid input")
+
+    with pytest.raises(FakeAPIError):
+        limiter.call("owner/model", create)
+    assert len(attempts) == 1
+    assert limiter.get("owner/model").stats()["throttled"] == 0
@@ -0,0 +1,101 @@
+import threading
+import time
+
+import pytest
+
+from scheduler import SlotPool, session
+
+
+def _wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def _queue(pool, owner, name, granted):
+    def run():
+        with session(owner):
+            with pool:
+                granted.append(name)
+
+    waiting = pool.stats()["waiting"]
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    _wait_for(lambda: pool.stats()["waiting"] == waiting + 1)
+    return thread
+
+
+def test_session_holding_fewest_slots_goes_first():
+    pool = SlotPool("test", 1)
+    granted = []
+    with session("a"):
+        pool.acquire()
+        threads = [_queue(pool, "a", "a1", granted), _queue(pool, "a", "a2", granted), _queue(pool, "b", "b1", granted)]
+        assert pool.position("b") == 1
+        pool.release()
+    for thread in threads:
+        thread.join(5)
+    assert granted == ["b1", "a1", "a2"]
+
+
+def test_sessions_take_turns():
+    pool = SlotPool("test", 1)
+    granted = []
+    with session("holder"):
+        pool.acquire()
+        threads = [_queue(pool, owner, name, granted)
+                   for owner, name in [("a", "a1"), ("a", "a2"), ("b", "b1"), ("b", "b2")]]
+        pool.release()
+    for thread in threads:
+        thread.join(5)
+    assert granted == ["a1", "b1", "a2", "b2"]
+
+
+def test_acquire_without_blocking_or_past_timeout():
+    pool = SlotPool("test", 1)
+    with session("a"):
+        assert pool.acquire()
+    with session("b"):
+        assert not pool.acquire(blocking=False)
+        assert not pool.acquire(timeout=0.05)
+    assert pool.stats()["waiting"] == 0
+
+
+def test_release_by_another_session_is_rejected():
+    pool = SlotPool("test", 2)
+    with session("a"):
+        pool.acquire()
+    with session("b"), pytest.raises(ValueError):
+        pool.release()
+    with session("a"):
+        pool.release()
+    assert pool.stats()["in_use"] == 0
+
+
+class StreamingPredictions:
+    def stream(self, model_path, input_data, owner=None):
+        yield from ["Hello", " world"]
+
+
+def test_a_streamed_text_slot_is_released_by_the_session_that_took_it():
+    pytest.importorskip("replicate")
+    from generation import Generator
+    from tracing import NULL_TRACER
+
+    pool = SlotPool("remote", 1)
+    generator = Generator.__new__(Generator)
+    generator.aborted = False
+    generator.cache = None
+    generator.limiter = pool
+    generator.owner = "a"
+    generator.tracer = NULL_TRACER
+    generator.predictions = StreamingPredictions()
+    with session("a"):
+        stream = generator.stream_replicate_text("m", {})
+        assert next(stream) == "Hello"
+    assert pool.stats()["in_use"] == 1
+    # e.g. a later Streamlit rerun of another session dropping the half-read stream
+    with session("b"):
+        stream.close()
+    assert pool.stats() == {**pool.stats(), "in_use": 0, "sessions": 0}
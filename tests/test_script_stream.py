@@ -0,0 +1,59 @@
+import pytest
+
+from script_stream import ScriptParser, repair_prompt, stream_script
+
+
+def test_segments_arrive_as_their_lines_complete():
+    seen = []
+    parser = ScriptParser(3, lambda i, text: seen.append((i, text)))
+    parser.feed("Here is your script:\n1: A quiet ")
+    assert seen == []
+    parser.feed("harbor at dawn\n2:")
+    assert seen == [(0, "A quiet harbor at dawn")]
+    parser.feed(" Gulls over the water\nSegment 3: Boats")
+    parser.close()
+    assert seen[1:] == [(1, "Gulls over the water"), (2, "Boats")]
+    assert parser.missing == []
+
+
+def test_label_on_its_own_line_takes_the_next_line():
+    parser = ScriptParser(2)
+    parser.feed("1:\nFirst line\n2: Second line\n")
+    assert parser.segments == ["First line", "Second line"]
+
+
+def test_out_of_range_and_repeated_labels_fill_the_next_gap():
+    parser = ScriptParser(3)
+    parser.feed("1: one\n1: again\n7: seven\n")
+    assert parser.segments == ["one", "again", "seven"]
+    parser.feed("2: ignored\n")
+    assert parser.segments == ["one", "again", "seven"]
+
+
+class FakeGenerator:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.prompts = []
+
+    def stream_replicate_text(self, model_path, params):
+        self.prompts.append(params["prompt"])
+        response = self.responses.pop(0)
+        # Chunk boundaries fall mid-line, as they do when streaming
+        return (response[i:i + 5] for i in range(0, len(response), 5))
+
+
+def test_missing_segments_are_requested_again():
+    generator = FakeGenerator(["1: one\n3: three\n", "2: two"])
+    seen = []
+    segments = stream_script(generator, "model", "Write it", 3, lambda i, text: seen.append(i))
+    assert segments == ["one", "two", "three"]
+    assert sorted(seen) == [0, 1, 2]
+    assert generator.prompts[1] == repair_prompt("Write it", ["one", None, "three"])
+    assert "'2:'" in generator.prompts[1] and "1: one" in generator.prompts[1]
+
+
+def test_gives_up_after_repair_attempts():
+    generator = FakeGenerator(["1: one\n", "nothing useful", "still nothing"])
+    with pytest.raises(ValueError):
+        stream_script(generator, "model", "Write it", 2, attempts=2)
+    assert len(generator.prompts) == 3
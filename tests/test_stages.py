@@ -0,0 +1,91 @@
+import threading
+
+import pytest
+
+from scheduler import current_session, session
+from stages import StageGraph, StageSkipped
+
+
+def test_stages_receive_their_dependencies_results():
+    graph = StageGraph()
+    graph.add("a", lambda: 2)
+    graph.add("b", lambda: 3)
+    graph.add("sum", lambda a, b: a + b, deps=("a", "b"))
+    results, errors = graph.run()
+    assert results == {"a": 2, "b": 3, "sum": 5} and errors == {}
+
+
+def test_failure_skips_dependents_only():
+    def fail():
+        raise RuntimeError("boom")
+
+    graph = StageGraph()
+    graph.add("bad", fail)
+    graph.add("after_bad", lambda x: x, deps=("bad",))
+    graph.add("later", lambda x: x, deps=("after_bad",))
+    graph.add("good", lambda: "ok")
+    results, errors = graph.run()
+    assert results == {"good": "ok"}
+    assert isinstance(errors["bad"], RuntimeError)
+    assert isinstance(errors["after_bad"], StageSkipped) and isinstance(errors["later"], StageSkipped)
+
+
+def test_independent_stages_run_concurrently():
+    barrier = threading.Barrier(2, timeout=5)
+    graph = StageGraph(max_workers=2)
+    graph.add("a", barrier.wait)
+    graph.add("b", barrier.wait)
+    results, errors = graph.run()
+    assert errors == {}
+
+
+def test_stages_inherit_the_session():
+    graph = StageGraph()
+    graph.add("owner", current_session)
+    with session("alice"):
+        results, _ = graph.run()
+    assert results["owner"] == "alice"
+
+
+def test_stages_added_while_running():
+    graph = StageGraph()
+    graph.add("first", lambda: 1)
+
+    def on_done(name, result, error):
+        if name == "first":
+            graph.add("second", lambda x: x + 1, deps=("first",))
+
+    results, _ = graph.run(on_done)
+    assert results["second"] == 2
+
+
+def test_cycles_and_unknown_dependencies_raise():
+    graph = StageGraph()
+    graph.add("a", lambda b: b, deps=("b",))
+    graph.add("b", lambda a: a, deps=("a",))
+    with pytest.raises(ValueError):
+        graph.run()
+    graph = StageGraph()
+    graph.add("a", lambda x: x, deps=("missing",))
+    with pytest.raises(KeyError):
+        graph.run()
+
+
+def test_join_waits_for_running_stages_after_an_abort():
+    started, finished = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        finished.wait(0.2)
+        finished.set()
+
+    def on_done(name, result, error):
+        raise KeyboardInterrupt
+
+    graph = StageGraph(max_workers=2)
+    graph.add("fast", lambda: started.wait(5))
+    graph.add("slow", slow)
+    with pytest.raises(KeyboardInterrupt):
+        graph.run(on_done)
+    graph.join()
+    assert finished.is_set()
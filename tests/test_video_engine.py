@@ -0,0 +1,79 @@
+import threading
+import time
+
+import pytest
+
+import video_engine
+from tracing import NULL_TRACER
+from video_engine import VideoJob, run_job
+
+
+class FakeGenerator:
+    """Stands in for generation.Generator: scripted text, instant segments, and music that runs until aborted."""
+
+    def __init__(self, script="1: one\n2: two\n", fail_segment=None):
+        self.script = script
+        self.fail_segment = fail_segment
+        self.tracer = NULL_TRACER
+        self.workspace = None
+        self.aborted = threading.Event()
+
+    def stream_replicate_text(self, model_path, params):
+        if self.script is None:
+            raise RuntimeError("script model is down")
+        yield self.script
+
+    def run_replicate_to_file(self, model_path, input_data, suffix):
+        if model_path == video_engine.MUSIC_MODEL:
+            # A slow paid prediction: only an abort ends it early
+            if not self.aborted.wait(5):
+                return "music.mp3"
+            raise RuntimeError("aborted")
+        if self.fail_segment and self.fail_segment in input_data["prompt"]:
+            raise RuntimeError("segment failed")
+        return "segment.mp4"
+
+    def abort(self):
+        self.aborted.set()
+
+    def cancel_all(self):
+        return []
+
+
+@pytest.fixture(autouse=True)
+def offline(monkeypatch):
+    monkeypatch.setattr(video_engine, "STREAM_INGEST", False)
+    monkeypatch.setattr(video_engine.IncrementalAssembler, "add_segment", lambda self, i, path: False)
+
+
+def _job():
+    return VideoJob(topic="Tides", length=10, include_voiceover=False)
+
+
+@pytest.mark.parametrize("generator", [FakeGenerator(script=None), FakeGenerator(fail_segment="two")])
+def test_a_failed_required_stage_aborts_the_rest_of_the_job(generator):
+    settled = []
+    start = time.monotonic()
+    with pytest.raises(RuntimeError, match="Stage '(script|segment_2)' failed"):
+        run_job(generator, _job(), "out.mp4", on_done=lambda name, result, error: settled.append(name), logger=None)
+    assert generator.aborted.is_set()
+    # Music was still generating; it was cut short instead of run to completion
+    assert time.monotonic() - start < 4
+    assert "music" not in settled
+
+
+def test_optional_failures_are_left_out(monkeypatch):
+    merged = {}
+
+    def finish_video(assembler, segment_paths, voice_path, music_path, total_duration, output_path, logger=None, tracer=None):
+        merged.update(segments=segment_paths, music=music_path, duration=total_duration)
+        return output_path
+
+    monkeypatch.setattr(video_engine, "finish_video", finish_video)
+    generator = FakeGenerator()
+    generator.abort()  # Music fails at once
+    output, results, errors = run_job(generator, _job(), "out.mp4", logger=None)
+    assert output == "out.mp4"
+    assert results["script"] == ["one", "two"]
+    assert sorted(errors) == ["music"]
+    assert merged == {"segments": ["segment.mp4", "segment.mp4"], "music": None, "duration": 10}
@@ -0,0 +1,25 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from video_job import VideoJob
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_the_apps_first_paint_imports_stay_light():
+    # What main.py imports before the generate button is pressed
+    code = "import sys, jobs, video_job; print(' '.join(m for m in ('numpy', 'video_engine', 'audio_engine') if m in sys.modules))"
+    loaded = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True).stdout.split()
+    assert loaded == []
+
+
+def test_job_options_are_validated():
+    job = VideoJob(topic="Tides", length="15 seconds", camera_movements=["zoom_in"])
+    assert job.length == 15 and job.num_segments == 3 and job.segment_loop is None
+    assert VideoJob(topic="Tides", enable_loop=True, loop_mode="pingpong").segment_loop == "pingpong"
+    for bad in [{"length": 12}, {"voice": "Nobody"}, {"emotion": "bored"}, {"camera_movements": ["spin"]}, {"loop_mode": "reverse"}]:
+        with pytest.raises(ValueError):
+            VideoJob(topic="Tides", **bad)
@@ -0,0 +1,26 @@
+import numpy as np
+
+from video_loop import crossfade_weights, loop_indices, render_frames
+
+
+def test_loop_indices():
+    assert loop_indices(3, 7, "forward").tolist() == [0, 1, 2, 0, 1, 2, 0]
+    assert loop_indices(3, 7, "pingpong").tolist() == [0, 1, 2, 1, 0, 1, 2]
+    assert loop_indices(5, 8, "crossfade", fade=1).tolist() == [0, 1, 2, 3, 0, 1, 2, 3]
+    assert loop_indices(9, 4, "pingpong").tolist() == [0, 1, 2, 3]
+    assert loop_indices(1, 3, "forward").tolist() == [0, 0, 0]
+
+
+def test_crossfade_blends_the_tail_into_each_seam():
+    tail, weight = crossfade_weights(6, 12, 2)
+    # Body is frames 0-3; frames 4 and 5 fade out over the start of each repeat
+    assert np.flatnonzero(weight < 1).tolist() == [4, 5, 8, 9]
+    assert tail[[4, 5]].tolist() == [4, 5]
+    assert weight[4] < weight[5] < 1
+
+
+def test_render_frames_fills_the_slot():
+    buffer = np.arange(4, dtype=np.uint8)[:, None, None, None].repeat(2, 1).repeat(2, 2).repeat(3, 3) * 60
+    frames = np.concatenate(list(render_frames(buffer.copy(), 4, 30, "pingpong")))
+    assert frames.shape == (30, 2, 2, 3)
+    assert frames[:7, 0, 0, 0].tolist() == [0, 60, 120, 180, 120, 60, 0]
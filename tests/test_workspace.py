@@ -0,0 +1,59 @@
+import os
+import threading
+
+import pytest
+
+from workspace import QuotaExceeded, WorkspaceManager
+
+MB = 1024 ** 2
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return WorkspaceManager(root=str(tmp_path / "scratch"), tmpfs="0", job_quota=2 * MB, total_quota=4 * MB)
+
+
+def test_workspaces_hand_out_fresh_paths(manager):
+    workspace = manager.create("job")
+    first, second = workspace.file(".mp4"), workspace.file(".mp4")
+    assert first != second and os.path.dirname(first) == workspace.path
+    assert os.path.isdir(workspace.subdir("frames"))
+    assert not workspace.tmpfs and manager.stats()["reserved"] == 2 * MB
+
+
+def test_a_job_over_its_quota_is_stopped(manager):
+    workspace = manager.create("job")
+    with open(workspace.file(".bin"), "wb") as f:
+        f.write(b"x" * MB)
+    assert workspace.check() >= MB
+    with open(workspace.file(".bin"), "wb") as f:
+        f.write(b"x" * 2 * MB)
+    with pytest.raises(QuotaExceeded):
+        workspace.check()
+    assert workspace.peak > 2 * MB
+
+
+def test_creation_waits_for_room_under_the_total(manager):
+    pytest.importorskip("requests")  # cleanup forgets the downloader's records
+    with pytest.raises(QuotaExceeded):
+        manager.create("huge", quota=8 * MB)
+    held = [manager.create("a"), manager.create("b")]
+    with pytest.raises(QuotaExceeded):
+        manager.create("c", timeout=0.05)
+    created = []
+    waiter = threading.Thread(target=lambda: created.append(manager.create("c")))
+    waiter.start()
+    held[0].cleanup()
+    waiter.join(5)
+    assert created and not os.path.exists(held[0].path)
+    assert manager.stats()["workspaces"] == 2
+
+
+def test_abandoned_workspaces_are_swept_on_startup(tmp_path):
+    root = tmp_path / "scratch"
+    dead, live = root / "dead-1", root / "live-1"
+    for path, pid in ((dead, 2 ** 22 + 1), (live, os.getpid())):
+        path.mkdir(parents=True)
+        (path / ".owner").write_text(str(pid))
+    WorkspaceManager(root=str(root), tmpfs="0")
+    assert not dead.exists() and live.exists()
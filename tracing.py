@@ -0,0 +1,254 @@
+"""Per-stage timing and resource spans for a video job.
+
+``tracer.span(name)`` records wall time, bytes moved, and process RSS
+around a block. The peak RSS of the process and of its ffmpeg children is
+sampled while the span is open, so it belongs to that span rather than
+being the server's lifetime high-water mark.
+A finished job can be exported as a JSON trace and as a Prometheus
+textfile for node_exporter's textfile collector.
+"""
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+
+DEFAULT_TRACE_DIR = os.environ.get("GPT_VOLCA_TRACE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "gpt-volca", "traces"))
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss():
+    # Resident set size in bytes; /proc is cheap and exact on Linux
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return peak_rss()
+
+
+def peak_rss(children=False):
+    # Lifetime high-water mark; ru_maxrss is in KiB on Linux
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    return resource.getrusage(who).ru_maxrss * 1024
+
+
+def children_rss():
+    """Summed RSS in bytes of this process's running children (ffmpeg), or 0 where /proc can't tell."""
+    total = 0
+    try:
+        tasks = os.listdir("/proc/self/task")
+    except OSError:
+        return 0
+    for tid in tasks:
+        try:
+            with open(f"/proc/self/task/{tid}/children") as f:
+                pids = f.read().split()
+        except OSError:
+            continue
+        for pid in pids:
+            try:
+                with open(f"/proc/{pid}/statm") as f:
+                    total += int(f.read().split()[1]) * _PAGE_SIZE
+            except (OSError, IndexError, ValueError):
+                pass  # Exited while we were looking
+    return total
+
+
+class _RssSampler:
+    """Samples process and children RSS into every open span's peak while any span is open."""
+
+    INTERVAL = 0.05
+
+    def __init__(self):
+        self._open = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, span):
+        with self._lock:
+            self._open.add(span)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+                self._thread.start()
+
+    def remove(self, span):
+        with self._lock:
+            self._open.discard(span)
+
+    def _run(self):
+        while True:
+            rss, child = current_rss(), children_rss()
+            with self._lock:
+                if not self._open:
+                    self._thread = None
+                    return
+                for span in self._open:
+                    span.peak_rss = max(span.peak_rss, rss)
+                    span.peak_child_rss = max(span.peak_child_rss, child)
+            time.sleep(self.INTERVAL)
+
+
+_sampler = _RssSampler()
+
+
+@dataclass(eq=False)
+class Span:
+    name: str
+    start: float
+    parent: Optional[str] = None
+    thread: str = ""
+    attrs: dict = field(default_factory=dict)
+    wall_seconds: float = 0.0
+    bytes: int = 0
+    rss_start: int = 0
+    rss_end: int = 0
+    peak_rss: int = 0  # Sampled while the span is open
+    peak_child_rss: int = 0
+    error: Optional[str] = None
+
+
+class _NullSpan:
+    # Absorbs attribute writes when tracing is disabled
+    bytes = 0
+
+    @property
+    def attrs(self):
+        return {}
+
+    def __setattr__(self, name, value):
+        pass
+
+
+class Tracer:
+    def __init__(self, job_id, enabled=True):
+        self.job_id = job_id
+        self.enabled = enabled
+        self.started = time.time()
+        self.spans = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def span(self, name, **attrs):
+        if not self.enabled:
+            yield _NullSpan()
+            return
+        stack = self._local.__dict__.setdefault("stack", [])
+        sp = Span(
+            name=name,
+            start=time.time(),
+            parent=stack[-1].name if stack else None,
+            thread=threading.current_thread().name,
+            attrs=attrs,
+            rss_start=current_rss(),
+        )
+        sp.peak_rss = sp.rss_start
+        stack.append(sp)
+        _sampler.add(sp)
+        t0 = time.perf_counter()
+        try:
+            yield sp
+        except BaseException as e:
+            sp.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            sp.wall_seconds = time.perf_counter() - t0
+            _sampler.remove(sp)
+            sp.rss_end = current_rss()
+            sp.peak_rss = max(sp.peak_rss, sp.rss_end)
+            stack.pop()
+            with self._lock:
+                self.spans.append(sp)
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        return {
+            "job_id": self.job_id,
+            "started": self.started,
+            "wall_seconds": max((s.start + s.wall_seconds for s in spans), default=self.started) - self.started,
+            "spans": [asdict(s) for s in spans],
+        }
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2, default=str)
+        return path
+
+    def write_prometheus(self, path):
+        """Write a Prometheus textfile; written atomically so the collector never sees half a file.
+
+        Spans are aggregated per (stage, parent), since e.g. every segment
+        stage has its own ``predict`` and ``download`` children.
+        """
+        data = self.to_dict()
+        totals = {}
+        for s in data["spans"]:
+            t = totals.setdefault((s["name"], s["parent"] or ""), {"seconds": 0.0, "bytes": 0, "rss": 0, "count": 0, "errors": 0})
+            t["seconds"] += s["wall_seconds"]
+            t["bytes"] += s["bytes"]
+            t["rss"] = max(t["rss"], s["peak_rss"])
+            t["count"] += 1
+            t["errors"] += bool(s["error"])
+
+        metrics = [
+            ("gpt_volca_stage_seconds", "Total wall time of a pipeline stage.", "seconds", "{:.6f}"),
+            ("gpt_volca_stage_bytes", "Bytes moved by a pipeline stage.", "bytes", "{}"),
+            ("gpt_volca_stage_peak_rss_bytes", "Peak process RSS sampled while a stage ran.", "rss", "{}"),
+            ("gpt_volca_stage_spans", "Number of spans recorded for a stage.", "count", "{}"),
+            ("gpt_volca_stage_errors", "Number of spans of a stage that raised.", "errors", "{}"),
+        ]
+        job = _escape(self.job_id)
+        lines = []
+        for metric, help_text, key, fmt in metrics:
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge"]
+            for (stage, parent), t in totals.items():
+                labels = f'job="{job}",stage="{_escape(stage)}",parent="{_escape(parent)}"'
+                lines.append(f"{metric}{{{labels}}} {fmt.format(t[key])}")
+        lines += [
+            "# HELP gpt_volca_job_seconds Wall time of the whole job.",
+            "# TYPE gpt_volca_job_seconds gauge",
+            f'gpt_volca_job_seconds{{job="{job}"}} {data["wall_seconds"]:.6f}',
+        ]
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp, path)
+        return path
+
+    def export(self, directory=DEFAULT_TRACE_DIR):
+        """Write ``<job_id>.trace.json`` and ``<job_id>.prom`` into ``directory``; returns both paths."""
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, self.job_id)
+        return self.write_json(base + ".trace.json"), self.write_prometheus(base + ".prom")
+
+    def summary_rows(self):
+        """One row per span, for st.dataframe / st.table."""
+        return summary_rows(self.to_dict())
+
+
+def summary_rows(trace):
+    """Table rows for a trace dict, e.g. one loaded back from ``write_json``."""
+    rows = []
+    for s in trace["spans"]:
+        rows.append({
+            "stage": s["name"],
+            "parent": s["parent"] or "",
+            "start (s)": round(s["start"] - trace["started"], 2),
+            "wall (s)": round(s["wall_seconds"], 2),
+            "MB": round(s["bytes"] / 1e6, 2),
+            "peak RSS (MB)": round(s["peak_rss"] / 1e6, 1),
+            "error": s["error"] or "",
+        })
+    return rows
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+NULL_TRACER = Tracer("disabled", enabled=False)
@@ -0,0 +1,359 @@
+"""Importable video pipeline: script -> segments -> voice -> music -> merge.
+
+main.py drives this engine from Streamlit widgets and batch.py drives it
+from a JSONL file of jobs; neither needs the other to run.
+"""
+import logging
+import os
+import re
+import tempfile
+import time
+
+import audio_engine
+import camera_motion
+import ffmpeg_tools
+import narration
+from asset_cache import get_cache
+from assembler import IncrementalAssembler
+from encoder_planner import get_planner
+from media_resources import ClipScope
+from scheduler import get_scheduler
+from script_stream import add_script_stages, stream_script
+from stages import StageGraph, StageSkipped
+from tracing import NULL_TRACER
+# Job options live in a module without the media stack, so the app's first paint doesn't load it
+from video_job import (
+    ASPECT_RATIOS, CAMERA_CONCEPTS, EMOTION_OPTIONS, LOOP_MODES, SEGMENT_SECONDS,
+    VIDEO_LENGTHS, VIDEO_STYLES, VOICE_OPTIONS, VideoJob,
+)
+
+logger = logging.getLogger(__name__)
+
+SCRIPT_MODEL = "anthropic/claude-4-sonnet"
+VIDEO_MODEL = "luma/ray-flash-2-540p"
+VOICE_MODEL = "minimax/speech-02-hd"
+MUSIC_MODEL = "google/lyria-2"
+
+# Pipe segment downloads straight into ffmpeg's trim, so only the trimmed clip is written
+STREAM_INGEST = os.environ.get("GPT_VOLCA_STREAM_INGEST", "1") != "0"
+
+
+def script_prompt(job):
+    num_segments = job.num_segments
+    # Shorter videos get fewer words per segment
+    words = "5-8" if num_segments == 2 else "6-10"
+    labels = [f"'{n}:'" for n in range(1, num_segments + 1)]
+    label_text = ", ".join(labels[:-1]) + f", and {labels[-1]}"
+    return (
+        f"You are an expert video scriptwriter. Write a clear, engaging, thematically consistent voiceover script for a {job.length}-second educational video titled '{job.topic}'. "
+        f"The video will be {job.length} seconds long; divide your script into {num_segments} segments of approximately 5 seconds each. "
+        f"Each segment should be {words} words. "
+        f"Make sure the {num_segments} segments tell a cohesive, progressive story that builds toward a compelling conclusion. "
+        f"Use vivid, concrete language that translates well to visuals. Include specific details, numbers, or comparisons when relevant. "
+        f"Label each section clearly as {label_text}. "
+        f"Write in an engaging, conversational tone that keeps viewers hooked. Avoid generic statements."
+    )
+
+
+def shot_type(i, num_segments):
+    # Determine shot type based on segment index for cinematic variety
+    if i == 0:
+        return "establishing wide shot"
+    elif i == 1 and num_segments > 2: # Only apply if there are more than 2 segments
+        return "medium shot with focus on key elements"
+    elif i == 2 and num_segments > 3: # Only apply if there are more than 3 segments
+        return "close-up shot showing important details"
+    else: # For the last segment or if fewer segments, make it a concluding shot
+        return "dynamic concluding shot"
+
+
+def segment_input(job, i, segment):
+    video_prompt = f"Cinematic {shot_type(i, job.num_segments)} for educational video about '{job.topic}'. Visual content: {segment}. Style: {job.style.lower()}, clean, professional, well-lit. Camera movement: smooth, purposeful. No text overlays."
+    return {
+        "prompt": video_prompt,
+        "num_frames": job.num_frames,
+        "fps": 24,
+        "guidance": 3.0,  # Higher guidance for better prompt adherence
+        "num_inference_steps": 30  # More steps for better quality
+    }
+
+
+def voiceover_input(job, script_segments):
+    full_narration = " ".join(script_segments)
+    # Remove punctuation and special characters from the narration for cleaner VoiceOver
+    cleaned_narration = re.sub(r'[^\w\s]', '', full_narration)
+    return {
+        "text": cleaned_narration,
+        "voice_id": VOICE_OPTIONS[job.voice],
+        "emotion": job.emotion,
+        "speed": 1.1,
+        "pitch": 0,
+        "volume": 1,
+        "bitrate": 128000,
+        "channel": "mono",
+        "sample_rate": 32000,
+        "language_boost": "English",
+        "english_normalization": True
+    }
+
+
+def music_input(job):
+    return {"prompt": f"Background music for a cohesive, {job.length}-second educational video about {job.topic}. Light, non-distracting, slightly cinematic tone."}
+
+
+def fetch_segment(generator, model_path, input_data):
+    """Generate one segment clip and return its local path.
+
+    With STREAM_INGEST the download is piped into a stream-copy trim to
+    SEGMENT_SECONDS, so the raw clip never lands on disk.
+    """
+    if not STREAM_INGEST:
+        return generator.run_replicate_to_file(model_path, input_data, ".mp4")
+    return generator.run_replicate_ingest(
+        model_path, input_data, ".mp4",
+        lambda source, dest: ffmpeg_tools.trim_copy(source, dest, SEGMENT_SECONDS),
+        variant=f"trim-{SEGMENT_SECONDS}s",
+    )
+
+
+def make_assembler(job, tracer=None, workspace=None):
+    """IncrementalAssembler for ``job``, with its loop style and a camera move drawn for each segment."""
+    moves = camera_motion.assign_moves(job.camera_movements, job.num_segments)
+    if any(moves):
+        logger.info("Camera moves: %s", ", ".join(move.name if move else "static" for move in moves))
+    return IncrementalAssembler(job.num_segments, SEGMENT_SECONDS, tracer=tracer, workspace=workspace,
+                                loop_mode=job.segment_loop, moves=moves)
+
+
+def build_graph(generator, job, max_workers=None, assembler=None, tracer=None):
+    """Build the stage graph for one job.
+
+    Stages: ``script``, ``segment_1``..``segment_N``, ``music`` and (when
+    enabled) ``voice_1``..``voice_N`` plus ``voiceover``. The script
+    streams in and each segment and its narration start as soon as its
+    line is parsed; ``voiceover`` aligns the narration clips to their
+    segments. Media stages return local file paths. With an
+    ``assembler``, each segment is normalized and appended to it from its
+    worker thread as soon as the download completes. Each stage is traced
+    with ``tracer`` (the generator's tracer by default).
+    """
+    # Every line stage waits on the streaming script in its own worker
+    lines_per_segment = 2 if job.include_voiceover else 1
+    graph = StageGraph(max_workers=max_workers or job.num_segments * lines_per_segment + 2, tracer=tracer or generator.tracer)
+
+    def write_script(on_segment):
+        return stream_script(generator, SCRIPT_MODEL, script_prompt(job), job.num_segments, on_segment)
+
+    def generate_segment(i, segment):
+        path = fetch_segment(generator, VIDEO_MODEL, segment_input(job, i, segment))
+        if assembler is not None:
+            try:
+                assembler.add_segment(i, path)
+            except ffmpeg_tools.FFmpegError as e:
+                # The assembler stays incomplete and finish_video falls back to a full merge
+                logger.warning("Progressive assembly of segment %d failed: %s", i + 1, e)
+        return path
+
+    def generate_voice(i, segment):
+        # One short TTS call per line; all lines are voiced in parallel
+        try:
+            return generator.run_replicate_to_file(VOICE_MODEL, voiceover_input(job, [segment]), ".mp3")
+        except Exception as e:
+            # One failed line leaves only its own slot silent instead of skipping the whole voiceover
+            logger.warning("Narration for segment %d failed: %s", i + 1, e)
+            return None
+
+    def align_voiceover(*clips):
+        if not any(clips):
+            raise RuntimeError("Every narration line failed")
+        track = narration.align_voice(clips, SEGMENT_SECONDS)
+        if generator.workspace:
+            path = generator.workspace.file(".wav", prefix="voiceover")
+        else:
+            path = tempfile.NamedTemporaryFile(delete=False, suffix=".wav").name
+        return track.write_wav(path)
+
+    def generate_music():
+        return generator.run_replicate_to_file(MUSIC_MODEL, music_input(job), ".mp3")
+
+    # Music starts immediately; each segment and its narration start on their script line
+    graph.add("music", generate_music)
+    voices = [f"voice_{i+1}" for i in range(job.num_segments)]
+    line_stages = {"voice": generate_voice} if job.include_voiceover else None
+    add_script_stages(graph, write_script, job.num_segments, generate_segment, line_stages)
+    if job.include_voiceover:
+        graph.add("voiceover", align_voiceover, deps=voices)
+    return graph
+
+
+def build_audio(voice_path, music_path, final_duration, tracer=None):
+    """Render the voice + music mix for the final video as one Track, or None if there is no audio.
+
+    The voice track is already aligned to the segments by narration.py;
+    music is looped, faded in/out over 1s and ducked under the voice.
+    """
+    with (tracer or NULL_TRACER).span("audio_mix") as span:
+        track = audio_engine.mix_tracks(
+            voice_path,
+            music_path,
+            final_duration,
+            voice_gain=1.0,
+            music_gain=0.2,  # Lower music volume for better voice clarity
+            music_fade=1.0,
+            voice_placement="start",
+            loop_cache=get_cache(),
+        )
+        span.bytes = track.samples.nbytes if track else 0
+    return track
+
+
+def assemble_video_fast(segment_paths, final_audio, total_duration, output_path, tracer=None):
+    """Stream-copy assembly: concat the segments without re-encoding and mux in ``final_audio``.
+
+    ``final_audio`` is an audio_engine.Track (or None for a silent video).
+    Returns None (having written nothing) when the segments can't be joined
+    losslessly, so the caller can fall back to the moviepy path. That
+    includes H.264 streams from different encoders: an mp4 track has one
+    set of parameters.
+    """
+    tracer = tracer or NULL_TRACER
+    with tracer.span("probe", segments=len(segment_paths)):
+        infos = [ffmpeg_tools.probe(path) for path in segment_paths]
+    if not ffmpeg_tools.can_stream_copy(infos, SEGMENT_SECONDS):
+        return None
+    with tracer.span("parameter_sets", segments=len(segment_paths)):
+        sets = {ffmpeg_tools.parameter_sets(path) for path in segment_paths}
+    if len(sets) != 1 or None in sets:
+        return None
+
+    video_only = os.path.splitext(output_path)[0] + "-video.mp4"
+    try:
+        with tracer.span("concat") as span:
+            ffmpeg_tools.concat_copy(segment_paths, video_only, SEGMENT_SECONDS)
+            span.bytes = os.path.getsize(video_only)
+        with tracer.span("mux", path="stream_copy") as span:
+            if final_audio is None:
+                ffmpeg_tools.mux_audio(video_only, None, output_path, duration=total_duration)
+            else:
+                ffmpeg_tools.mux_pcm(video_only, final_audio.to_pcm16(), final_audio.sample_rate,
+                                     final_audio.samples.shape[1], output_path, duration=total_duration)
+            span.bytes = os.path.getsize(output_path)
+    finally:
+        if os.path.exists(video_only):
+            os.remove(video_only)
+    return output_path
+
+
+def assemble_video(segment_paths, voice_path, music_path, total_duration, output_path, logger="bar", fast=True, tracer=None):
+    """Merge segments, voiceover and music into ``output_path``.
+
+    The soundtrack is rendered once with audio_engine. Tries the ffmpeg
+    stream-copy path first and falls back to a full moviepy re-encode when
+    the segments differ in codec, size or frame rate.
+    """
+    tracer = tracer or NULL_TRACER
+    final_audio = build_audio(voice_path, music_path, total_duration, tracer=tracer)
+    if fast:
+        try:
+            if assemble_video_fast(segment_paths, final_audio, total_duration, output_path, tracer=tracer):
+                return output_path
+        except ffmpeg_tools.FFmpegError:
+            pass  # Fall back to the re-encoding path below
+
+    from moviepy.editor import concatenate_videoclips
+
+    # Every reader opened here is closed when the scope ends, even on errors or st.stop()
+    with ClipScope() as clips:
+        # Create a VideoFileClip for each segment, ensuring 5s per segment
+        with tracer.span("clip_load", segments=len(segment_paths)) as span:
+            segment_clips = [clips.video(path).subclip(0, SEGMENT_SECONDS) for path in segment_paths]
+            span.bytes = sum(os.path.getsize(path) for path in segment_paths)
+        # Concatenate all generated video clips
+        final_video = clips.track(concatenate_videoclips(segment_clips, method="compose"))
+        # Ensure the final video duration matches the selected total length
+        final_video = final_video.set_duration(total_duration)
+        final_video = final_video.set_audio(final_audio.to_clip() if final_audio else None)
+
+        # Preset, CRF and threads sized to this host and the encode deadline
+        planner = get_planner()
+        width, height = final_video.size
+        frames = int(total_duration * 24)
+        profile = planner.plan(frames, width, height)
+
+        # Write the final video file, taking turns with other sessions' encodes
+        with tracer.span("encode", path="moviepy", profile=profile.describe()) as span, get_scheduler().slot("encode"):
+            start = time.perf_counter()
+            final_video.write_videofile(
+                output_path,
+                codec="libx264",
+                audio_codec="aac",
+                temp_audiofile=os.path.splitext(output_path)[0] + "-audio.m4a",
+                remove_temp=True,
+                fps=24,
+                logger=logger,
+                **profile.moviepy_kwargs(),
+            )
+            span.attrs["fps"] = planner.record(profile, frames, time.perf_counter() - start, width, height)
+            span.bytes = os.path.getsize(output_path)
+    return output_path
+
+
+def finish_video(assembler, segment_paths, voice_path, music_path, total_duration, output_path, logger="bar", tracer=None):
+    """Mux the soundtrack onto the progressively assembled video, or merge from scratch if it is incomplete."""
+    if assembler is not None and assembler.complete:
+        try:
+            return assembler.finalize(build_audio(voice_path, music_path, total_duration, tracer=tracer), output_path)
+        except ffmpeg_tools.FFmpegError:
+            pass  # Fall back to a full merge below
+    return assemble_video(segment_paths, voice_path, music_path, total_duration, output_path, logger=logger, tracer=tracer)
+
+
+def run_job(generator, job, output_path=None, on_done=None, logger="bar", assembler=None):
+    """Generate every asset for ``job`` and merge them; returns (output_path, results, errors).
+
+    Segments are assembled progressively while the rest of the job runs;
+    pass ``assembler`` to watch its preview from ``on_done``. A script or
+    segment failure aborts the job's other predictions at once and raises;
+    a failed voiceover or music track is left out of the final mix, like in
+    the app. Spans are recorded on the generator's tracer.
+    """
+    tracer = generator.tracer
+    if assembler is None:
+        assembler = make_assembler(job, tracer=tracer, workspace=generator.workspace)
+    required = ["script"] + [f"segment_{i+1}" for i in range(job.num_segments)]
+
+    def settle(name, result, error):
+        if on_done:
+            on_done(name, result, error)
+        # A skip follows a failure that settles on its own (the script's); report that one
+        if error is not None and name in required and not isinstance(error, StageSkipped):
+            # The job is lost; don't pay for the predictions still running
+            raise RuntimeError(f"Stage '{name}' failed: {error}") from error
+
+    try:
+        graph = build_graph(generator, job, assembler=assembler)
+        try:
+            results, errors = graph.run(on_done=settle)
+        except BaseException:
+            # Stop the abandoned stages' predictions and let their threads unwind before
+            # the assembler and workspace they write into are removed
+            generator.abort()
+            graph.join()
+            raise
+        finally:
+            # Don't leave predictions billing if the job is aborted
+            generator.cancel_all()
+        for name in required:
+            if name in errors:
+                raise RuntimeError(f"Stage '{name}' failed: {errors[name]}") from errors[name]
+
+        if output_path is None:
+            if generator.workspace:
+                output_path = generator.workspace.file(".mp4", prefix="final")
+            else:
+                output_path = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4").name
+        segment_paths = [results[f"segment_{i+1}"] for i in range(job.num_segments)]
+        finish_video(assembler, segment_paths, results.get("voiceover"), results.get("music"), job.length, output_path, logger=logger, tracer=tracer)
+        return output_path, results, errors
+    finally:
+        assembler.cleanup()
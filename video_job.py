@@ -0,0 +1,93 @@
+"""The options of one video job and their validation.
+
+Only the standard library is imported here: the Streamlit app builds its
+widgets from these lists on every rerun, and the engine (video_engine)
+pulls in NumPy, moviepy and the API clients, which should load only once
+a job is generated.
+"""
+import re
+from dataclasses import dataclass, field
+
+SEGMENT_SECONDS = 5
+
+# How short segments are looped (see video_loop)
+LOOP_MODES = ["crossfade", "pingpong", "forward"]
+
+# Dictionary mapping display names to Replicate voice IDs
+VOICE_OPTIONS = {
+    "Wise Woman": "Wise_Woman",
+    "Friendly Person": "Friendly_Person",
+    "Inspirational Girl": "Inspirational_girl",
+    "Deep Voice Man": "Deep_Voice_Man",
+    "Calm Woman": "Calm_Woman",
+    "Casual Guy": "Casual_Guy",
+    "Lively Girl": "Lively_Girl",
+    "Patient Man": "Patient_Man",
+    "Young Knight": "Young_Knight",
+    "Determined Man": "Determined_Man",
+    "Lovely Girl": "Lovely_Girl",
+    "Decent Boy": "Decent_Boy",
+    "Imposing Manner": "Imposing_Manner",
+    "Elegant Man": "Elegant_Man",
+    "Abbess": "Abbess",
+    "Sweet Girl 2": "Sweet_Girl_2",
+    "Exuberant Girl": "Exuberant_Girl"
+}
+
+# List of available emotion options for the voiceover
+EMOTION_OPTIONS = ["auto", "happy", "sad", "angry", "surprised", "fearful", "disgusted"]
+
+VIDEO_STYLES = ["Documentary", "Cinematic", "Educational", "Modern", "Nature", "Scientific"]
+
+ASPECT_RATIOS = ["16:9", "9:16", "1:1", "4:3"]
+
+# Supported total lengths in seconds, each split into 5-second segments
+VIDEO_LENGTHS = [10, 15, 20]
+
+# List of available camera movement concepts, rendered locally by camera_motion
+CAMERA_CONCEPTS = [
+    "static", "zoom_in", "zoom_out", "pan_left", "pan_right",
+    "tilt_up", "tilt_down", "orbit_left", "orbit_right",
+    "push_in", "pull_out", "crane_up", "crane_down",
+    "aerial", "aerial_drone", "handheld", "dolly_zoom"
+]
+
+
+@dataclass
+class VideoJob:
+    topic: str
+    style: str = "Documentary"
+    length: int = 20
+    voice: str = "Wise Woman"
+    emotion: str = "auto"
+    num_frames: int = 120
+    aspect_ratio: str = "16:9"
+    include_voiceover: bool = True
+    enable_loop: bool = False
+    loop_mode: str = "crossfade"  # How short segments loop when enable_loop is set
+    camera_movements: list = field(default_factory=list)
+
+    def __post_init__(self):
+        # Accept "20 seconds" as well as 20
+        if isinstance(self.length, str):
+            self.length = int(re.match(r"\s*(\d+)", self.length).group(1))
+        if self.length not in VIDEO_LENGTHS:
+            raise ValueError(f"Unsupported video length {self.length}s; choose one of {VIDEO_LENGTHS}")
+        if self.voice not in VOICE_OPTIONS:
+            raise ValueError(f"Unknown voice '{self.voice}'")
+        if self.emotion not in EMOTION_OPTIONS:
+            raise ValueError(f"Unknown emotion '{self.emotion}'")
+        unknown = [move for move in self.camera_movements if move not in CAMERA_CONCEPTS]
+        if unknown:
+            raise ValueError(f"Unknown camera movements {unknown}; choose from {CAMERA_CONCEPTS}")
+        if self.loop_mode not in LOOP_MODES:
+            raise ValueError(f"Unknown loop mode '{self.loop_mode}'; choose one of {LOOP_MODES}")
+
+    @property
+    def num_segments(self):
+        return self.length // SEGMENT_SECONDS
+
+    @property
+    def segment_loop(self):
+        # Passed to the assembler: None leaves short segments to ffmpeg's plain repeat
+        return self.loop_mode if self.enable_loop else None
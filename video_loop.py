@@ -0,0 +1,140 @@
+"""Frame-buffered looping of video segments that are shorter than their slot.
+
+ffmpeg's ``-stream_loop`` (and moviepy's clip concatenation before it)
+decodes the clip again for every repeat and cuts hard from its last frame
+back to its first. Here the clip is decoded once, already scaled to the
+output format, into a preallocated frame buffer whose size is capped by
+GPT_VOLCA_LOOP_BUFFER_MB. The output is read from the buffer by index
+arithmetic, one batch of frames at a time, and piped to a single x264
+encode:
+
+- ``forward`` repeats the clip from the start,
+- ``pingpong`` plays it forwards, then backwards,
+- ``crossfade`` repeats it and blends the clip's last frames into its
+  first ones at every seam, so the loop has no visible cut.
+
+The same pass applies a segment's camera move (see camera_motion). A
+clip that would overflow the buffer is left to ffmpeg's loop instead.
+"""
+import logging
+import os
+import time
+
+import numpy as np
+
+import ffmpeg_tools
+from encoder_planner import get_planner
+from scheduler import get_scheduler
+from video_job import LOOP_MODES
+
+logger = logging.getLogger(__name__)
+
+BUFFER_BYTES = int(os.environ.get("GPT_VOLCA_LOOP_BUFFER_MB", 512)) * 1024 ** 2
+CROSSFADE = 0.5  # Seconds blended at each crossfade seam
+BATCH = 24  # Output frames computed and piped per step
+
+
+def crossfade_frames(count, fps=24, seconds=CROSSFADE):
+    # A third of the clip at most, so most of each repeat plays unblended
+    return min(int(round(seconds * fps)), count // 3)
+
+
+def loop_indices(count, frames, mode, fade=0):
+    """Buffer index of each of ``frames`` output frames looping ``count`` decoded ones.
+
+    For ``crossfade`` the loop body is the first ``count - fade`` frames; the
+    rest of the clip is only seen blended into each seam.
+    """
+    t = np.arange(frames)
+    if count >= frames:
+        return t
+    if count <= 1:
+        return np.zeros(frames, dtype=np.int64)
+    if mode == "pingpong":
+        k = t % (2 * count - 2)
+        return np.where(k < count, k, 2 * count - 2 - k)
+    if mode == "crossfade":
+        return t % (count - fade)
+    return t % count
+
+
+def crossfade_weights(count, frames, fade):
+    """(tail index, weight of the loop frame) for each output frame; weight 1 means no blend.
+
+    Each repeat starts again at frame 0 while the clip's natural
+    continuation past the loop body fades out over it.
+    """
+    t = np.arange(frames)
+    body = count - fade
+    weight = np.ones(frames, dtype=np.float32)
+    tail = np.zeros(frames, dtype=np.int64)
+    if fade <= 0 or count >= frames:
+        return tail, weight
+    k = t % body
+    seam = (t >= body) & (k < fade)
+    weight[seam] = (k[seam] + 0.5) / fade
+    tail[seam] = body + k[seam]
+    return tail, weight
+
+
+def render_frames(buffer, count, frames, mode, fps=24, motion=None):
+    """Yield the looped output as uint8 frame batches of at most BATCH frames.
+
+    ``motion`` (a camera_motion.MovePath) warps each batch after looping.
+    """
+    fade = crossfade_frames(count, fps) if mode == "crossfade" else 0
+    source = loop_indices(count, frames, mode, fade)
+    tail, weight = crossfade_weights(count, frames, fade)
+    for lo in range(0, frames, BATCH):
+        hi = min(frames, lo + BATCH)
+        batch = buffer[source[lo:hi]]
+        blend = np.flatnonzero(weight[lo:hi] < 1)
+        if len(blend):
+            w = weight[lo:hi][blend][:, None, None, None]
+            mixed = batch[blend] * w + buffer[tail[lo:hi][blend]] * (1 - w)
+            batch[blend] = np.rint(mixed).astype(np.uint8)
+        if motion is not None:
+            batch = motion.apply(batch, lo)
+        yield batch
+
+
+def loop_segment(path, reference, segment_seconds, output_path, mode="crossfade", fps=24, deadline=None, move=None, profile=None):
+    """Write ``path`` conformed to ``reference`` and looped with ``mode`` to fill ``segment_seconds``.
+
+    ``move`` (a camera_motion.CameraMove) is applied to the output frames
+    in the same pass. ``profile`` fixes the x264 settings (planned for
+    ``deadline`` otherwise). Returns None (having written nothing) when the
+    clip doesn't fit the frame buffer, so the caller can loop it another
+    way.
+    """
+    if mode not in LOOP_MODES:
+        raise ValueError(f"Unknown loop mode '{mode}'; choose one of {LOOP_MODES}")
+    w, h = reference.width, reference.height
+    fps = reference.fps or fps
+    frames = int(segment_seconds * fps)
+    if frames * w * h * 3 > BUFFER_BYTES:
+        logger.info("A %dx%d loop of %d frames exceeds the %d MB frame buffer", w, h, frames, BUFFER_BYTES // 1024 ** 2)
+        return None
+    planner = get_planner()
+    profile = profile or planner.plan(frames, w, h, deadline=deadline)
+    # Decoding and encoding use every core, so they take turns across sessions
+    with get_scheduler().slot("encode"):
+        start = time.perf_counter()
+        buffer = np.empty((frames, h, w, 3), dtype=np.uint8)
+        count = ffmpeg_tools.decode_frames(
+            path, buffer,
+            f"scale={w}:{h}:force_original_aspect_ratio=decrease,pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,fps={fps}",
+        )
+        if count == 0:
+            raise ffmpeg_tools.FFmpegError(f"No frames decoded from {path}")
+        if count < frames:
+            logger.info("Looping %s: %d of %d frames, %s", os.path.basename(path), count, frames, mode)
+        motion = move.render(frames) if move else None
+        chunks = (batch.tobytes() for batch in render_frames(buffer, count, frames, mode, fps, motion))
+        ffmpeg_tools.run_ffmpeg_stream([
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{w}x{h}", "-r", f"{fps:g}", "-i", "pipe:0",
+            "-frames:v", str(frames), "-pix_fmt", reference.pix_fmt or "yuv420p",
+            *profile.ffmpeg_args(), "-an", "-movflags", "+faststart", output_path,
+        ], chunks)
+    planner.record(profile, frames, time.perf_counter() - start, w, h)
+    return output_path
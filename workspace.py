@@ -0,0 +1,227 @@
+"""Per-job scratch workspaces with optional tmpfs and disk quotas.
+
+Every job gets its own directory for downloads and intermediates, so
+concurrent sessions never share a temp file name, and removing the
+directory cleans up after the job whether it succeeded or not. When
+enabled and there is room, workspaces live on tmpfs (``/dev/shm``) so the
+download -> normalize -> concat round trips stay in memory.
+
+Each job may use up to its quota; workspaces are only handed out while
+the quotas of all live jobs fit under the total. Directories left behind
+by a process that no longer exists are removed on startup.
+
+Configured with GPT_VOLCA_SCRATCH_DIR, GPT_VOLCA_SCRATCH_TMPFS ("auto",
+"1" or "0"), GPT_VOLCA_JOB_QUOTA_MB and GPT_VOLCA_SCRATCH_QUOTA_MB.
+"""
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROOT = os.environ.get("GPT_VOLCA_SCRATCH_DIR", os.path.join(tempfile.gettempdir(), "gpt-volca-scratch"))
+TMPFS_ROOT = "/dev/shm/gpt-volca-scratch"
+TMPFS_MODE = os.environ.get("GPT_VOLCA_SCRATCH_TMPFS", "auto")
+JOB_QUOTA = int(os.environ.get("GPT_VOLCA_JOB_QUOTA_MB", 2048)) * 1024 ** 2
+TOTAL_QUOTA = int(os.environ.get("GPT_VOLCA_SCRATCH_QUOTA_MB", 8192)) * 1024 ** 2
+
+OWNER_FILE = ".owner"
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _free_bytes(path):
+    try:
+        stat = os.statvfs(path)
+    except OSError:
+        return 0
+    return stat.f_bavail * stat.f_frsize
+
+
+def dir_usage(path):
+    """Bytes used by the files under ``path``."""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass  # Removed while we were counting
+    return total
+
+
+class Workspace:
+    """One job's scratch directory. Use as a context manager to remove it however the job ends."""
+
+    def __init__(self, manager, job_id, path, quota, tmpfs):
+        self.manager = manager
+        self.job_id = job_id
+        self.path = path
+        self.quota = quota
+        self.tmpfs = tmpfs
+        self.peak = 0
+        self._counter = 0
+        self._lock = threading.Lock()
+        self.closed = False
+
+    def file(self, suffix="", prefix="asset"):
+        """A fresh, not yet created path inside the workspace."""
+        with self._lock:
+            self._counter += 1
+            n = self._counter
+        return os.path.join(self.path, f"{prefix}-{n:03d}{suffix}")
+
+    def subdir(self, name):
+        path = os.path.join(self.path, name)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def usage(self):
+        return dir_usage(self.path)
+
+    def check(self):
+        """Raise QuotaExceeded once the workspace holds more than its quota; returns the bytes used."""
+        used = self.usage()
+        self.peak = max(self.peak, used)
+        if used > self.quota:
+            raise QuotaExceeded(f"Job {self.job_id} uses {used / 1e6:.0f} MB of scratch space, over its {self.quota / 1e6:.0f} MB quota")
+        return used
+
+    def describe(self):
+        where = "tmpfs" if self.tmpfs else "disk"
+        return f"Scratch: {self.peak / 1e6:.0f} MB peak on {where}"
+
+    def cleanup(self):
+        if self.closed:
+            return
+        self.closed = True
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.manager._release(self)
+        # The downloader keeps throughput records per file; these files are gone
+        from downloader import forget_downloads
+        forget_downloads(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+
+
+class WorkspaceManager:
+    def __init__(self, root=DEFAULT_ROOT, tmpfs_root=TMPFS_ROOT, tmpfs=TMPFS_MODE,
+                 job_quota=JOB_QUOTA, total_quota=TOTAL_QUOTA):
+        self.root = root
+        self.tmpfs_root = tmpfs_root
+        self.tmpfs = str(tmpfs).lower()
+        self.job_quota = job_quota
+        self.total_quota = total_quota
+        self._cond = threading.Condition()
+        self._reserved = {}  # workspace path -> (quota, on tmpfs)
+        for base in self._roots():
+            os.makedirs(base, exist_ok=True)
+            removed = self.sweep(base)
+            if removed:
+                logger.info("Removed %d abandoned scratch workspaces from %s", removed, base)
+
+    def _roots(self):
+        roots = [self.root]
+        if self.tmpfs != "0" and os.path.isdir(os.path.dirname(self.tmpfs_root)):
+            roots.append(self.tmpfs_root)
+        return roots
+
+    def sweep(self, base):
+        """Remove workspaces under ``base`` whose owning process is gone; returns how many."""
+        removed = 0
+        for entry in os.scandir(base):
+            if not entry.is_dir():
+                continue
+            try:
+                with open(os.path.join(entry.path, OWNER_FILE)) as f:
+                    pid = int(f.read().strip() or 0)
+            except (OSError, ValueError):
+                pid = 0
+            if pid and _pid_alive(pid):
+                continue
+            if not pid and time.time() - entry.stat().st_mtime < 60:
+                continue  # Just created; its owner file may not be written yet
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+        return removed
+
+    def _pick_root(self, quota):
+        # tmpfs only when it can hold this job's quota on top of the other tmpfs jobs
+        if self.tmpfs == "0" or self.tmpfs_root not in self._roots():
+            return self.root, False
+        on_tmpfs = sum(q for q, tmpfs in self._reserved.values() if tmpfs)
+        if _free_bytes(self.tmpfs_root) >= on_tmpfs + quota:
+            return self.tmpfs_root, True
+        if self.tmpfs == "1":
+            logger.warning("tmpfs at %s is too small for a %d MB workspace; using %s", self.tmpfs_root, quota // 1024 ** 2, self.root)
+        return self.root, False
+
+    def create(self, job_id=None, quota=None, timeout=None):
+        """Reserve ``quota`` bytes (the job quota by default) and return a new Workspace.
+
+        Waits while the live workspaces' quotas leave no room under the
+        total; raises QuotaExceeded after ``timeout`` seconds or if the
+        quota can never fit.
+        """
+        quota = quota or self.job_quota
+        if quota > self.total_quota:
+            raise QuotaExceeded(f"A {quota / 1e6:.0f} MB workspace can never fit the {self.total_quota / 1e6:.0f} MB scratch quota")
+        job_id = job_id or uuid.uuid4().hex[:12]
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while sum(q for q, _ in self._reserved.values()) + quota > self.total_quota:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise QuotaExceeded(f"No scratch space for job {job_id}: {len(self._reserved)} workspaces hold the whole quota")
+                self._cond.wait(remaining)
+            base, tmpfs = self._pick_root(quota)
+            path = tempfile.mkdtemp(prefix=f"{job_id}-", dir=base)
+            self._reserved[path] = (quota, tmpfs)
+        with open(os.path.join(path, OWNER_FILE), "w") as f:
+            f.write(str(os.getpid()))
+        return Workspace(self, job_id, path, quota, tmpfs)
+
+    def _release(self, workspace):
+        with self._cond:
+            self._reserved.pop(workspace.path, None)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "workspaces": len(self._reserved),
+                "reserved": sum(q for q, _ in self._reserved.values()),
+                "on_tmpfs": sum(1 for _, tmpfs in self._reserved.values() if tmpfs),
+            }
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_workspaces():
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = WorkspaceManager()
+        return _manager